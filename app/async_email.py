@@ -0,0 +1,100 @@
+# app/async_email.py
+# 异步发信引擎：基于 aiosmtplib，一个 worker 进程内即可同时保持多路 SMTP 会话，
+# 适合结算高峰时一次性发出大量 C7–C10 这类互不依赖的邮件。
+# 同一 SMTP 服务器的并发数受 ASYNC_SMTP_PER_HOST_LIMIT 限制，避免被企业邮箱限流。
+import os
+import asyncio
+from datetime import datetime
+from typing import Optional, Union, Iterable
+
+import aiosmtplib
+
+from app.email_utils import (
+    _normalize_cc,
+    build_html_message,
+    build_attachment_message,
+    audit_sent_email,
+)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ASYNC_SMTP_PER_HOST_LIMIT = int(os.getenv("ASYNC_SMTP_PER_HOST_LIMIT", "5"))
+ASYNC_SMTP_TIMEOUT = int(os.getenv("ASYNC_SMTP_TIMEOUT", "30"))
+
+
+class AsyncEmailSender:
+    """
+    用法：
+        sender = AsyncEmailSender()
+        results = await sender.send_many([{"to_email": ..., "subject": ..., "content": ..., "smtp_config": ..., "stage": ...}, ...])
+    每个结果与同步版 send_email 一致，为 (success, error)。
+    """
+
+    def __init__(self, per_host_limit: int = ASYNC_SMTP_PER_HOST_LIMIT, timeout: int = ASYNC_SMTP_TIMEOUT):
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self._semaphores: dict[tuple, asyncio.Semaphore] = {}
+
+    def _semaphore(self, smtp_config: dict) -> asyncio.Semaphore:
+        key = (smtp_config["host"], int(smtp_config["port"]))
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.per_host_limit)
+        return self._semaphores[key]
+
+    async def send(
+        self,
+        to_email: str,
+        subject: str,
+        content: str,
+        smtp_config: dict,
+        stage: str,
+        attachments: list[str] | None = None,
+        cc: Optional[Union[str, Iterable[str]]] = None,
+    ) -> tuple[bool, str]:
+        cc_list = _normalize_cc(cc)
+        try:
+            if attachments:
+                message = build_attachment_message(to_email, subject, content, smtp_config, attachments, cc_list)
+            else:
+                message = build_html_message(to_email, subject, content, smtp_config, cc_list)
+        except OSError as e:
+            return False, f"附件读取失败: {e.filename}，错误信息：{str(e)}"
+
+        # 465 走 SMTPS，其余端口由 aiosmtplib 自动协商 STARTTLS；smtp_config 可显式覆盖
+        use_tls = smtp_config.get("use_tls", int(smtp_config["port"]) == 465)
+        start_tls = smtp_config.get("start_tls", False if use_tls else None)
+
+        try:
+            async with self._semaphore(smtp_config):
+                await aiosmtplib.send(
+                    message,
+                    sender=smtp_config["from"],
+                    recipients=[to_email] + cc_list,
+                    hostname=smtp_config["host"],
+                    port=int(smtp_config["port"]),
+                    username=smtp_config["username"],
+                    password=smtp_config["password"],
+                    use_tls=use_tls,
+                    start_tls=start_tls,
+                    timeout=self.timeout,
+                )
+        except Exception as e:
+            logger.exception(f"[{stage}] ❌ 异步发送失败，to={to_email}")
+            return False, str(e)
+
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
+        logger.info(f"[{stage}] ✅ 异步发送成功，to={to_email}, 时间：{now_str}")
+        # 宜搭记录需要查库，放到线程里，不阻塞事件循环
+        await asyncio.to_thread(audit_sent_email, to_email, subject, content, smtp_config, stage, now_str)
+        return True, ""
+
+    async def send_many(self, jobs: list[dict]) -> list[tuple[bool, str]]:
+        """并发发送一批邮件；jobs 的每一项是 send() 的关键字参数。"""
+        return await asyncio.gather(*(self.send(**job) for job in jobs))
+
+
+def send_many(jobs: list[dict], per_host_limit: int = ASYNC_SMTP_PER_HOST_LIMIT) -> list[tuple[bool, str]]:
+    """同步入口：在当前线程里跑一个事件循环发完整批邮件（供 Celery 任务调用）。"""
+    return asyncio.run(AsyncEmailSender(per_host_limit=per_host_limit).send_many(jobs))
@@ -0,0 +1,135 @@
+# app/batch_writer.py
+# 内存攒批写入的公共部分：调用方 add() 只入队，后台线程按条数或时间窗口把积压分批交给 sink 写出。
+# 宜搭表单写入（yida_writer）和邮件发送记录写入（email_record_writer）只是 sink 不同。
+import os
+import time
+import threading
+from typing import Any, Callable, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+    - 达到 max_batch_size 条立即唤醒后台线程写入
+    - 最早一条等待超过 flush_interval 秒也由后台线程写入
+    - add() 只入内存队列，从不阻塞调用方
+    - sink(items) 一次写出一批：返回 True 表示已写入；False 表示确定没有写入，这一批放回队首下次重试，
+      每条最多尝试 max_attempts 次；None 表示结果不确定，不再重发（避免重复写入），只记日志
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[list], Optional[bool]],
+        label: str,
+        max_batch_size: int,
+        flush_interval: float,
+        max_attempts: int,
+        describe: Callable[[Any], Any] = lambda item: item,
+    ):
+        self.sink = sink
+        self.label = label
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.describe = describe
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: list[dict] = []   # {"item": ..., "attempts": n}
+        self._oldest_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def add(self, item):
+        with self._lock:
+            self._pending.append({"item": item, "attempts": 0})
+            if self._oldest_at is None:
+                self._oldest_at = time.monotonic()
+            full = len(self._pending) >= self.max_batch_size
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """写入当前积压的全部记录，返回本次成功写入的条数。"""
+        with self._flush_lock:
+            with self._lock:
+                entries, self._pending = self._pending, []
+                self._oldest_at = None
+            if not entries:
+                return 0
+
+            written = 0
+            failed: list[dict] = []
+            for start in range(0, len(entries), self.max_batch_size):
+                chunk = entries[start:start + self.max_batch_size]
+                try:
+                    outcome = self.sink([entry["item"] for entry in chunk])
+                except Exception:
+                    logger.exception("❌ %s批量写入异常，结果不确定", self.label)
+                    outcome = None
+                if outcome:
+                    written += len(chunk)
+                    continue
+                if outcome is None:
+                    logger.error("❌ %s写入结果不确定，不再重发以免重复，请人工核对：%s",
+                                 self.label, [self.describe(entry["item"]) for entry in chunk])
+                    continue
+                for entry in chunk:
+                    entry["attempts"] += 1
+                    if entry["attempts"] < self.max_attempts:
+                        failed.append(entry)
+                    else:
+                        logger.error("❌ %s写入失败且达到最大重试次数，放弃：%s", self.label, self.describe(entry["item"]))
+
+            if failed:
+                # 失败的批次放回队首，等下一个时间窗口重试
+                with self._lock:
+                    self._pending = failed + self._pending
+                    self._oldest_at = time.monotonic()
+            return written
+
+    def _ensure_thread(self):
+        if self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=f"batch-writer-{self.label}", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(min(self.flush_interval, 1.0))
+            self._wake.clear()
+            with self._lock:
+                full = len(self._pending) >= self.max_batch_size
+                due = self._oldest_at is not None and time.monotonic() - self._oldest_at >= self.flush_interval
+            if full or due:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("❌ %s后台写入线程异常", self.label)
+
+    def close(self):
+        """停止后台线程并写入剩余记录（进程退出前调用）。"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval)
+        # 失败的批次在 flush 中已计数，最多重试 max_attempts 次后放弃
+        self.flush()
+        while self.pending_count():
+            time.sleep(1)
+            self.flush()
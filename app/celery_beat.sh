@@ -0,0 +1,4 @@
+#!/bin/bash
+# 定时投递到点的邮件链步骤（release_due_email_steps），只需要运行一个实例
+source venv/bin/activate
+exec celery -A tasks beat --loglevel=info
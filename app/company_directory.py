@@ -0,0 +1,229 @@
+# app/company_directory.py
+# 公司信息进程内缓存：company_info 表很小且很少变化，整表载入内存，
+# 按 公司名 / (公司名, 类型) / (简称, 类型) / 邮箱 建索引，发信和接口查公司不再访问数据库。
+#
+# 失效方式：
+# - 写路径（/update_company_info、update_D_company_by_alias）提交后调用 invalidate_companies()，
+#   清空本进程缓存并把 Redis 中的版本号 +1；
+# - 其他进程（API / Celery worker）每隔 COMPANY_CACHE_VERSION_CHECK_INTERVAL 秒比对一次版本号，变了就整表重载；
+# - Redis 不可用或有人直接改库时，最多 COMPANY_CACHE_TTL 秒后也会重载。
+import os
+import time
+import threading
+from dataclasses import dataclass, fields
+from typing import Callable, Optional
+
+import logging
+
+from app import database, models
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+COMPANY_CACHE_TTL = int(os.getenv("COMPANY_CACHE_TTL", "300"))
+COMPANY_CACHE_VERSION_CHECK_INTERVAL = float(os.getenv("COMPANY_CACHE_VERSION_CHECK_INTERVAL", "5"))
+COMPANY_CACHE_VERSION_KEY = "company_directory:version"
+
+
+@dataclass(frozen=True, slots=True)
+class CompanyProfile:
+    """
+    公司信息的只读快照，字段与 models.CompanyInfo 同名，可以直接替代 ORM 实例传给调度、模板代码；
+    不依赖 Session，提交或关闭 Session 后读取字段也不会触发懒加载查询。
+    """
+    id: int
+    company_name: str
+    company_type: Optional[str] = None
+    short_name: Optional[str] = None
+    contact_person: Optional[str] = None
+    last_name: Optional[str] = None
+    last_name_traditional: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    address: Optional[str] = None
+    english_address: Optional[str] = None
+    smtp_host: Optional[str] = None
+    smtp_port: Optional[int] = None
+    smtp_username: Optional[str] = None
+    smtp_password: Optional[str] = None
+    smtp_from: Optional[str] = None
+    pingyin: Optional[str] = None
+    company_en: Optional[str] = None
+
+    @classmethod
+    def from_orm(cls, company: "models.CompanyInfo") -> "CompanyProfile":
+        return cls(**{f.name: getattr(company, f.name) for f in fields(cls)})
+
+    @property
+    def smtp_config(self) -> dict:
+        return {
+            "host": self.smtp_host,
+            "port": self.smtp_port,
+            "username": self.smtp_username,
+            "password": self.smtp_password,
+            "from": self.smtp_from,
+        }
+
+    @property
+    def signature(self) -> dict:
+        """邮件模板落款字段（参数名与 render_invitation_template_content 一致）"""
+        return {
+            "company_name": self.company_name,
+            "contact_person": self.contact_person,
+            "phone": self.phone,
+            "email": self.email,
+            "address": self.address,
+            "english_address": self.english_address,
+            "pingyin": self.pingyin,
+            "company_en": self.company_en,
+        }
+
+
+# 原先在 MySQL 里按默认 *_ci（PAD SPACE）排序规则比较：不区分大小写、忽略尾部空格。
+# 内存索引的键按同样的方式归一化：邮箱去空格并转小写，公司名 / 简称 / 类型去空格
+def _key(value: Optional[str]) -> Optional[str]:
+    return value.strip() if isinstance(value, str) else value
+
+
+def _email_key(value: Optional[str]) -> Optional[str]:
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+def _redis_get_version() -> Optional[str]:
+    return get_redis().get(COMPANY_CACHE_VERSION_KEY)
+
+
+def _redis_bump_version():
+    get_redis().incr(COMPANY_CACHE_VERSION_KEY)
+
+
+class CompanyDirectory:
+    """
+    缓存的是 CompanyProfile 只读快照；需要更新公司信息时请在自己的 Session 里查询 CompanyInfo。
+    """
+
+    def __init__(
+        self,
+        ttl: int = COMPANY_CACHE_TTL,
+        check_interval: float = COMPANY_CACHE_VERSION_CHECK_INTERVAL,
+        version_getter: Callable[[], Optional[str]] = _redis_get_version,
+        version_bumper: Callable[[], None] = _redis_bump_version,
+    ):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.version_getter = version_getter
+        self.version_bumper = version_bumper
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()   # 重载单飞：并发过期时只有一个线程查库
+        self._indexes: Optional[dict] = None
+        self._version: Optional[str] = None
+        self._loaded_at: Optional[float] = None
+        self._checked_at: float = 0.0
+
+    def _read_version(self) -> Optional[str]:
+        try:
+            return self.version_getter()
+        except Exception as e:
+            logger.warning("⚠️ 读取公司缓存版本号失败，按 TTL 过期：%s", e)
+            return self._version
+
+    def load(self) -> int:
+        """整表载入，返回公司数量。"""
+        with self._load_lock:
+            return self._load()
+
+    def _load(self) -> int:
+        # 先读版本号再查库：查库期间有写入的话，版本号会变，下次检查时再重载一次
+        version = self._read_version()
+
+        db = database.SessionLocal()
+        try:
+            rows = [
+                CompanyProfile.from_orm(row)
+                for row in db.query(models.CompanyInfo).order_by(models.CompanyInfo.id)
+            ]
+        finally:
+            db.close()
+
+        by_name, by_name_type, by_short_type, by_email = {}, {}, {}, {}
+        for row in rows:
+            # 与原先 .first() 一致：同一个键取 id 最小的一条
+            by_name.setdefault(_key(row.company_name), row)
+            by_name_type.setdefault((_key(row.company_name), _key(row.company_type)), row)
+            by_short_type.setdefault((_key(row.short_name), _key(row.company_type)), row)
+            if row.email:
+                by_email.setdefault(_email_key(row.email), row)
+
+        now = time.monotonic()
+        with self._lock:
+            self._indexes = {
+                "name": by_name,
+                "name_type": by_name_type,
+                "short_type": by_short_type,
+                "email": by_email,
+            }
+            self._version = version
+            self._loaded_at = now
+            self._checked_at = now
+        logger.info("✅ 公司信息已载入，共 %s 条，版本 %s", len(rows), version)
+        return len(rows)
+
+    def invalidate(self):
+        """本进程立即失效，并通知其他进程重载。"""
+        with self._lock:
+            self._loaded_at = None
+        try:
+            self.version_bumper()
+        except Exception as e:
+            logger.warning("⚠️ 更新公司缓存版本号失败，其他进程将在 TTL 后重载：%s", e)
+
+    def _is_stale(self) -> bool:
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            return True
+        now = time.monotonic()
+        if now - loaded_at > self.ttl:
+            return True
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        return self._read_version() != self._version
+
+    def _get_index(self, name: str) -> dict:
+        if self._is_stale():
+            observed = self._loaded_at
+            with self._load_lock:
+                # 等锁期间别的线程已经重载过（或刚重载失败）就直接用它的结果
+                if self._loaded_at is None or self._loaded_at == observed:
+                    try:
+                        self._load()
+                    except Exception:
+                        if self._indexes is None:
+                            raise
+                        # 重载失败时继续使用旧数据，不阻断发信；下个检查周期 / TTL 后再试，
+                        # 数据库故障期间不会每次查询都整表重试
+                        logger.exception("❌ 公司信息重载失败，继续使用旧缓存")
+                        now = time.monotonic()
+                        with self._lock:
+                            self._loaded_at = now
+                            self._checked_at = now
+        return self._indexes[name]
+
+    def get_by_name(self, company_name: str, company_type: Optional[str] = None) -> Optional[CompanyProfile]:
+        if company_type:
+            return self._get_index("name_type").get((_key(company_name), _key(company_type)))
+        return self._get_index("name").get(_key(company_name))
+
+    def get_by_short(self, short_name: str, company_type: str) -> Optional[CompanyProfile]:
+        return self._get_index("short_type").get((_key(short_name), _key(company_type)))
+
+    def get_by_email(self, email: str) -> Optional[CompanyProfile]:
+        return self._get_index("email").get(_email_key(email))
+
+
+company_directory = CompanyDirectory()
+
+
+def invalidate_companies():
+    company_directory.invalidate()
@@ -0,0 +1,120 @@
+# app/dingtalk_client.py
+# 钉钉 / 宜搭 HTTP 客户端：
+# - 每个进程一个 requests.Session，复用到 api.dingtalk.com 的 keep-alive 连接
+# - 所有请求默认带连接 / 读取超时，钉钉卡住不会拖死 worker
+# - 429 / 网关类 5xx 按指数退避重试（遵守 Retry-After）；POST 只在确定没有被处理时重试
+# - 按接口统计调用次数、耗时与失败数
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DINGTALK_CONNECT_TIMEOUT = float(os.getenv("DINGTALK_CONNECT_TIMEOUT", "5"))
+DINGTALK_READ_TIMEOUT = float(os.getenv("DINGTALK_READ_TIMEOUT", "15"))
+DINGTALK_MAX_RETRIES = int(os.getenv("DINGTALK_MAX_RETRIES", "3"))
+DINGTALK_POOL_SIZE = int(os.getenv("DINGTALK_POOL_SIZE", "10"))
+
+# 500 不重试：POST 新增表单时服务端可能已经落库，重试会产生重复记录
+RETRY_STATUS = (429, 502, 503, 504)
+# 502 / 504 是网关在转发之后报的错，新增 / batchSave 可能已经执行，POST 只重试限流和服务不可用
+POST_RETRY_STATUS = (429, 503)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_stats: dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+
+class DingTalkRetry(Retry):
+    """连接错误对所有方法都重试（请求还没发出）；按状态码重试时，POST 只认 POST_RETRY_STATUS。"""
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == "POST" and status_code not in POST_RETRY_STATUS:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_session() -> requests.Session:
+    retry = DingTalkRetry(
+        total=DINGTALK_MAX_RETRIES,
+        connect=DINGTALK_MAX_RETRIES,
+        read=0,  # 已发出的请求读超时不重试，避免重复写入
+        status=DINGTALK_MAX_RETRIES,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset({"GET", "POST", "PUT"}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=DINGTALK_POOL_SIZE, pool_maxsize=DINGTALK_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """返回本进程的 Session（Celery prefork 子进程各自新建，不共享父进程的 socket）。"""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def _record(endpoint: str, elapsed: float, ok: bool):
+    with _stats_lock:
+        stat = _stats.setdefault(endpoint, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stat["count"] += 1
+        stat["errors"] += 0 if ok else 1
+        stat["total_ms"] += elapsed * 1000
+        stat["max_ms"] = max(stat["max_ms"], elapsed * 1000)
+
+
+def get_latency_stats() -> dict[str, dict]:
+    """各接口的调用统计：次数、失败数、平均 / 最大耗时（毫秒）。"""
+    with _stats_lock:
+        return {
+            endpoint: {
+                "count": stat["count"],
+                "errors": stat["errors"],
+                "avg_ms": round(stat["total_ms"] / stat["count"], 1),
+                "max_ms": round(stat["max_ms"], 1),
+            }
+            for endpoint, stat in _stats.items()
+        }
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", (DINGTALK_CONNECT_TIMEOUT, DINGTALK_READ_TIMEOUT))
+    endpoint = f"{method.upper()} {urlsplit(url).path}"
+    start = time.perf_counter()
+    ok = False
+    try:
+        response = get_session().request(method, url, **kwargs)
+        ok = response.status_code < 400
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        _record(endpoint, elapsed, ok)
+        logger.info("钉钉接口 %s 耗时 %.0f ms%s", endpoint, elapsed * 1000, "" if ok else "（失败）")
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
@@ -0,0 +1,82 @@
+# app/email_bodies.py
+# 邮件正文去重存储：EmailRecord.body 原本每封邮件都存一份完整 HTML，同一模板 + 签名的正文重复成千上万行。
+# 开启 EMAIL_BODY_STORAGE=hashed 后，正文按 sha256 压缩存进 email_bodies，发送记录只保留 body_hash；
+# 读取时用 EmailRecord.content，自动解压。
+import os
+import zlib
+import hashlib
+from datetime import datetime
+
+import logging
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+
+logger = logging.getLogger(__name__)
+
+EMAIL_BODY_STORAGE = os.getenv("EMAIL_BODY_STORAGE", "inline")   # inline：照旧存 body；hashed：存 email_bodies
+EMAIL_BODY_COMPRESS_LEVEL = int(os.getenv("EMAIL_BODY_COMPRESS_LEVEL", "6"))
+
+COMPRESSION = "zlib"
+
+
+def body_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compress_body(content: str) -> bytes:
+    return zlib.compress(content.encode("utf-8"), EMAIL_BODY_COMPRESS_LEVEL)
+
+
+def decompress_body(data: bytes, compression: str = COMPRESSION) -> str:
+    if compression != COMPRESSION:
+        raise ValueError(f"不支持的正文压缩格式：{compression}")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def store_bodies(db: Session, contents) -> dict[str, str]:
+    """
+    把正文写进 email_bodies（已存在的跳过），返回 {正文: body_hash}。
+    多个进程同时写同一正文时，主键冲突后重查一次即可。
+    """
+    hashes = {content: body_hash(content) for content in set(contents) if content is not None}
+    if not hashes:
+        return {}
+
+    for attempt in range(2):
+        existing = {
+            row.body_hash
+            for row in db.query(models.EmailBody.body_hash)
+            .filter(models.EmailBody.body_hash.in_(list(hashes.values())))
+        }
+        now = datetime.now()
+        rows = [
+            {"body_hash": h, "compression": COMPRESSION, "data": compress_body(content),
+             "size": len(content.encode("utf-8")), "created_at": now}
+            for content, h in hashes.items() if h not in existing
+        ]
+        if not rows:
+            return hashes
+        try:
+            db.bulk_insert_mappings(models.EmailBody, rows)
+            db.commit()
+            return hashes
+        except IntegrityError:
+            db.rollback()
+            if attempt:
+                raise
+            logger.info("ℹ️ 邮件正文已被其他进程写入，重新检查")
+    return hashes
+
+
+def externalize_bodies(db: Session, records: list[dict]) -> list[dict]:
+    """按 EMAIL_BODY_STORAGE 处理待写入的发送记录：hashed 时把 body 换成 body_hash。"""
+    if EMAIL_BODY_STORAGE != "hashed":
+        return records
+    hashes = store_bodies(db, [record.get("body") for record in records])
+    return [
+        dict(record, body=None, body_hash=hashes[record["body"]]) if record.get("body") is not None else record
+        for record in records
+    ]
@@ -0,0 +1,146 @@
+# app/email_chains.py
+# 邮件对话链（A1→A2、B3→B6、C7→C10）的持久化：
+# 调度代码仍然拼出嵌套的 followup_task_args 字典，这里把它拍平成一步一行写入 email_chain_steps，
+# 之后 Celery 消息只带 (chain_id, step_index)，每一跳只读自己那一步。
+#
+# 延迟发送：不再用 apply_async(countdown=...) 把消息压在 Redis / worker 里等几十分钟，
+# 而是给步骤记下 due_at，由 beat 定时跑的 release_due_email_steps 把到点的步骤分批投递给 worker。
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+import logging
+
+from sqlalchemy.orm import Session
+
+from app import database, models
+
+logger = logging.getLogger(__name__)
+
+EMAIL_SCHEDULER_BATCH_SIZE = int(os.getenv("EMAIL_SCHEDULER_BATCH_SIZE", "100"))     # 每批投递的步骤数
+EMAIL_SCHEDULER_STUCK_AFTER = int(os.getenv("EMAIL_SCHEDULER_STUCK_AFTER", "900"))    # queued 超过该秒数未完成则重新投递
+
+
+def flatten_chain(root_task: dict, start_delay: int = 0) -> list[dict]:
+    """
+    把嵌套的任务字典拍平成步骤列表。
+    每个任务字典里的 followup_delay 是“上一步成功后、本步发送前”的等待秒数（与原 _delay 任务的语义一致），
+    起点没有上一步，等待时间取 start_delay。
+    """
+    steps = []
+    task = root_task
+    while task:
+        steps.append({
+            "step_index": len(steps),
+            "stage": task.get("stage"),
+            "to_email": task["to_email"],
+            "cc": task.get("cc") or None,
+            "subject": task.get("subject"),
+            "content": task.get("content"),
+            "smtp_config": task["smtp_config"],
+            "attachments": task.get("attachments"),
+            "delay": start_delay if not steps else int(task.get("followup_delay") or 0),
+        })
+        task = task.get("followup_task_args")
+    return steps
+
+
+def create_email_chain(root_task: dict, start_delay: int = 0, db: Optional[Session] = None) -> str:
+    """
+    写入整条邮件链，返回 chain_id。
+    起点等待时间 <= 0 时直接标记为 queued，由调用方立即投递；否则标记 scheduled 等调度器到点投递。
+    """
+    chain_id = uuid.uuid4().hex
+    now = datetime.now()
+    rows = [dict(step, chain_id=chain_id, status="waiting") for step in flatten_chain(root_task, start_delay)]
+    if start_delay <= 0:
+        rows[0].update(status="queued", due_at=now, queued_at=now)
+    else:
+        rows[0].update(status="scheduled", due_at=now + timedelta(seconds=start_delay))
+
+    own_session = db is None
+    db = db or database.SessionLocal()
+    try:
+        db.bulk_insert_mappings(models.EmailChainStep, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if own_session:
+            db.close()
+
+    logger.info("✅ 邮件链已保存 chain_id=%s，共 %s 步：%s", chain_id, len(rows), [r["stage"] for r in rows])
+    return chain_id
+
+
+def load_chain_step(db: Session, chain_id: str, step_index: int) -> Optional[models.EmailChainStep]:
+    return (
+        db.query(models.EmailChainStep)
+        .filter(models.EmailChainStep.chain_id == chain_id, models.EmailChainStep.step_index == step_index)
+        .first()
+    )
+
+
+def advance_chain(db: Session, chain_id: str, step_index: int) -> Optional[models.EmailChainStep]:
+    """本步已发送：标记 sent，并按下一步自己的 delay 定好发送时间，返回下一步（没有则 None）。可重复调用。"""
+    now = datetime.now()
+    db.query(models.EmailChainStep).filter(
+        models.EmailChainStep.chain_id == chain_id, models.EmailChainStep.step_index == step_index
+    ).update({"status": "sent"}, synchronize_session=False)
+
+    next_step = load_chain_step(db, chain_id, step_index + 1)
+    # 只推进还在等待的下一步：重复执行本步时不会把已经投递 / 发送的下一步重新排期
+    if next_step is not None and next_step.status == "waiting":
+        next_step.status = "scheduled"
+        next_step.due_at = now + timedelta(seconds=next_step.delay or 0)
+    db.commit()
+    return next_step
+
+
+def mark_step_failed(db: Session, chain_id: str, step_index: int):
+    db.query(models.EmailChainStep).filter(
+        models.EmailChainStep.chain_id == chain_id, models.EmailChainStep.step_index == step_index
+    ).update({"status": "failed"}, synchronize_session=False)
+    db.commit()
+
+
+def claim_due_steps(
+    db: Session, now: Optional[datetime] = None, batch_size: Optional[int] = None
+) -> list[tuple[str, int]]:
+    """
+    取一批到点的步骤并标记为 queued，返回 [(chain_id, step_index), ...]。
+    行锁用 SKIP LOCKED，多个调度进程同时跑也不会取到同一步；投递后 worker 没跑完（进程被杀等）的步骤，
+    queued 超过 EMAIL_SCHEDULER_STUCK_AFTER 秒会被重新取出。
+    只查三列、每批最多 batch_size 行（默认 EMAIL_SCHEDULER_BATCH_SIZE），积压多少步骤都不会一次载入内存。
+    """
+    now = now or datetime.now()
+    batch_size = batch_size or EMAIL_SCHEDULER_BATCH_SIZE
+    step = models.EmailChainStep
+    columns = (step.id, step.chain_id, step.step_index)
+
+    rows = (
+        db.query(*columns)
+        .filter(step.status == "scheduled", step.due_at <= now)
+        .order_by(step.due_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if len(rows) < batch_size:
+        rows += (
+            db.query(*columns)
+            .filter(step.status == "queued", step.queued_at <= now - timedelta(seconds=EMAIL_SCHEDULER_STUCK_AFTER))
+            .order_by(step.queued_at)
+            .limit(batch_size - len(rows))
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+
+    if rows:
+        db.query(step).filter(step.id.in_([row.id for row in rows])).update(
+            {"status": "queued", "queued_at": now}, synchronize_session=False
+        )
+    db.commit()
+    return [(row.chain_id, row.step_index) for row in rows]
@@ -0,0 +1,73 @@
+# app/email_record_writer.py
+# 邮件发送记录（emails_records）批量写入：发送任务只把记录放进内存队列，
+# 后台线程按条数或时间窗口用 bulk_insert_mappings 一次插入多行，每封邮件不再单独开会话、提交、refresh。
+import os
+import threading
+from typing import Optional
+
+import logging
+
+from app import database, email_bodies, models
+from app.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+EMAIL_RECORD_BATCH_SIZE = int(os.getenv("EMAIL_RECORD_BATCH_SIZE", "100"))          # 单次插入最多行数
+EMAIL_RECORD_FLUSH_INTERVAL = float(os.getenv("EMAIL_RECORD_FLUSH_INTERVAL", "2"))   # 最长攒批时间（秒）
+EMAIL_RECORD_MAX_ATTEMPTS = int(os.getenv("EMAIL_RECORD_MAX_ATTEMPTS", "5"))         # 每行最多尝试次数
+
+
+def _describe_record(record: dict) -> str:
+    return f"to={record.get('to')}, stage={record.get('stage')}, status={record.get('status')}"
+
+
+class EmailRecordWriter(BatchWriter):
+    """
+    攒批插入 emails_records，攒批、重试规则见 BatchWriter；插入失败已回滚，整批下个时间窗口重试。
+    add() 的每一项是一行记录，键与 models.EmailRecord 的列同名。
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = EMAIL_RECORD_BATCH_SIZE,
+        flush_interval: float = EMAIL_RECORD_FLUSH_INTERVAL,
+        max_attempts: int = EMAIL_RECORD_MAX_ATTEMPTS,
+    ):
+        super().__init__(self._insert_chunk, "邮件发送记录", max_batch_size, flush_interval, max_attempts,
+                         describe=_describe_record)
+
+    @staticmethod
+    def _insert_chunk(records: list[dict]) -> bool:
+        db = database.SessionLocal()
+        try:
+            db.bulk_insert_mappings(models.EmailRecord, email_bodies.externalize_bodies(db, records))
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            logger.exception("❌ 邮件发送记录批量写入异常")
+            return False
+        finally:
+            db.close()
+
+
+_email_record_writer: Optional[EmailRecordWriter] = None
+_email_record_writer_pid: Optional[int] = None
+_email_record_writer_lock = threading.Lock()
+
+
+def get_email_record_writer() -> EmailRecordWriter:
+    """每个进程一个写入器（fork 后重新创建）。"""
+    global _email_record_writer, _email_record_writer_pid
+    with _email_record_writer_lock:
+        if _email_record_writer is None or _email_record_writer_pid != os.getpid():
+            _email_record_writer = EmailRecordWriter()
+            _email_record_writer_pid = os.getpid()
+        return _email_record_writer
+
+
+def close_email_record_writer():
+    with _email_record_writer_lock:
+        writer = _email_record_writer if _email_record_writer_pid == os.getpid() else None
+    if writer is not None:
+        writer.close()
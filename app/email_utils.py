@@ -1,20 +1,29 @@
 # app/email_utils.py
+import io
 import os
+import copy
+import time
+import threading
 from datetime import datetime
-from typing import Optional, Union, Iterable, List
+from typing import Callable, Optional, Union, Iterable, List
 
 import smtplib
 from email.message import EmailMessage
+from email.generator import BytesGenerator
+from email.utils import getaddresses
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 
 # from app.tasks import send_reply_email
-from app import database, models
-from app.utils import get_dingtalk_access_token, create_yida_form_instance
+from app import database, models, yida_writer
+from app.utils import create_email_audit_form_instance
+from app.company_directory import company_directory
+from app.redis_client import get_redis
 
 from sqlalchemy import desc, nullslast
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
 
 from contextlib import contextmanager
 
@@ -74,24 +83,246 @@ MAIL_ACCOUNTS = {
     },
 }
 
+# SMTP 连接池：同一进程内按 (host, port, username) 复用已登录的 SMTP_SSL 连接，
+# 省去每封邮件的 TLS 握手与 login 往返。
+SMTP_POOL_IDLE_TIMEOUT = int(os.getenv("SMTP_POOL_IDLE_TIMEOUT", "60"))  # 空闲连接保留秒数
+SMTP_POOL_TIMEOUT = int(os.getenv("SMTP_POOL_TIMEOUT", "30"))            # socket 超时
+
+
+class SMTPConnectionPool:
+    """
+    进程内 SMTP 连接池：
+    - 取连接时先 NOOP 探活，失效则丢弃重连
+    - 空闲超过 idle_timeout 秒的连接直接关闭
+    - fork 之后（Celery prefork）自动丢弃父进程遗留的连接
+    """
+
+    def __init__(self, idle_timeout: int = SMTP_POOL_IDLE_TIMEOUT, timeout: int = SMTP_POOL_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: dict[tuple, list[tuple[smtplib.SMTP, float]]] = {}
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _key(smtp_config: dict) -> tuple:
+        return (smtp_config["host"], int(smtp_config["port"]), smtp_config["username"])
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_alive(smtp: smtplib.SMTP) -> bool:
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _connect(self, smtp_config: dict) -> smtplib.SMTP:
+        logger.info("📧 建立新的 SMTP 连接：%s:%s (%s)", smtp_config["host"], smtp_config["port"], smtp_config["username"])
+        smtp = smtplib.SMTP_SSL(smtp_config["host"], smtp_config["port"], timeout=self.timeout)
+        try:
+            smtp.login(smtp_config["username"], smtp_config["password"])
+        except Exception:
+            self._close(smtp)
+            raise
+        return smtp
+
+    def _check_fork(self):
+        # 子进程不能复用父进程的 socket，直接丢弃（不 quit，避免影响父进程）
+        if self._pid != os.getpid():
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def acquire(self, smtp_config: dict) -> smtplib.SMTP:
+        key = self._key(smtp_config)
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                self._check_fork()
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                smtp, last_used = idle.pop()
+            if now - last_used > self.idle_timeout or not self._is_alive(smtp):
+                self._close(smtp)
+                continue
+            return smtp
+        return self._connect(smtp_config)
+
+    def release(self, smtp_config: dict, smtp: smtplib.SMTP):
+        with self._lock:
+            self._check_fork()
+            self._idle.setdefault(self._key(smtp_config), []).append((smtp, time.monotonic()))
+        self.close_idle()
+
+    def discard(self, smtp: smtplib.SMTP):
+        self._close(smtp)
+
+    @contextmanager
+    def connection(self, smtp_config: dict):
+        """借出一个已登录的连接；块内抛异常时连接被关闭而不是放回池中。"""
+        smtp = self.acquire(smtp_config)
+        try:
+            yield smtp
+        except Exception:
+            self.discard(smtp)
+            raise
+        else:
+            self.release(smtp_config, smtp)
+
+    def _open_envelope(self, smtp_config: dict, from_addr: str, to_addrs: list[str]) -> smtplib.SMTP:
+        """
+        借出连接并完成 MAIL FROM / RCPT TO。此时服务端还没收到正文，
+        复用的连接恰好被服务端断开时可以放心重连再试一次。
+        """
+        for attempt in range(2):
+            smtp = self.acquire(smtp_config)
+            try:
+                smtp.ehlo_or_helo_if_needed()
+                code, resp = smtp.mail(from_addr)
+                if code != 250:
+                    raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+                refused = {}
+                for addr in to_addrs:
+                    code, resp = smtp.rcpt(addr)
+                    if code not in (250, 251):
+                        refused[addr] = (code, resp)
+                # 与 smtplib.sendmail 一致：部分收件人被拒仍继续发送，全部被拒才报错
+                if len(refused) == len(to_addrs):
+                    raise smtplib.SMTPRecipientsRefused(refused)
+                return smtp
+            except smtplib.SMTPServerDisconnected:
+                self.discard(smtp)
+                if attempt:
+                    raise
+                logger.warning("⚠️ SMTP 连接已被服务端断开（尚未发送正文），重连后重试")
+            except Exception:
+                self.discard(smtp)
+                raise
+
+    def sendmail(self, smtp_config: dict, from_addr: str, to_addrs: list[str], msg: Union[str, bytes]):
+        """
+        发送一封邮件。只在信封阶段（MAIL FROM / RCPT TO）断开时重连重试；
+        DATA 开始后服务端可能已经收下邮件，任何异常都直接抛出，不再重发以免重复投递。
+        """
+        smtp = self._open_envelope(smtp_config, from_addr, to_addrs)
+        try:
+            code, resp = smtp.data(msg)
+            if code != 250:
+                raise smtplib.SMTPDataError(code, resp)
+        except Exception:
+            self.discard(smtp)
+            raise
+        self.release(smtp_config, smtp)
+
+    def send_message(self, smtp_config: dict, message):
+        """按 smtplib.SMTP.send_message 的规则从 Sender/From、To/Cc/Bcc 取地址，去掉 Bcc 头后发送。"""
+        from_addr = message["Sender"] if "Sender" in message else message["From"]
+        from_addr = getaddresses([from_addr])[0][1]
+        fields = [f for f in (message["To"], message["Bcc"], message["Cc"]) if f is not None]
+        to_addrs = [addr for _, addr in getaddresses(fields)]
+        message_copy = copy.copy(message)
+        del message_copy["Bcc"]
+        del message_copy["Resent-Bcc"]
+        with io.BytesIO() as buffer:
+            BytesGenerator(buffer).flatten(message_copy, linesep="\r\n")
+            flat = buffer.getvalue()
+        self.sendmail(smtp_config, from_addr, to_addrs, flat)
+
+    def close_idle(self):
+        """关闭空闲超时的连接。"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            self._check_fork()
+            for key, idle in self._idle.items():
+                keep = []
+                for smtp, last_used in idle:
+                    (expired if now - last_used > self.idle_timeout else keep).append((smtp, last_used))
+                self._idle[key] = keep
+        for smtp, _ in expired:
+            self._close(smtp)
+
+    def close_all(self):
+        with self._lock:
+            self._check_fork()
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for smtp, _ in conns:
+                self._close(smtp)
+
+
+smtp_pool = SMTPConnectionPool()
+
 # 轮换顺序：A→B→C→D→A
-def get_last_plss_email() -> str:
-    with get_db_session() as db:
-        last_project = (
-            db.query(models.ProjectInfo)
-            .filter(models.ProjectInfo.current_plss_email.isnot(None))
-            .order_by(
-                models.ProjectInfo.created_at.desc(),  # 先按时间倒序
-                models.ProjectInfo.id.desc(),          # 时间相同再按自增ID倒序
-            )
-            .first()
+PLSS_ROTATION = {"A": "B", "B": "C", "C": "D", "D": "A"}
+PLSS_ROTATION_ROW_ID = 1
+
+
+def _last_assigned_plss_alias(db) -> Optional[str]:
+    """扫描 project_info 找最近一个项目使用的别名（项目越多越慢，只用于兜底和初始化轮换表）。"""
+    last_project = (
+        db.query(models.ProjectInfo)
+        .filter(models.ProjectInfo.current_plss_email.isnot(None))
+        .order_by(
+            models.ProjectInfo.created_at.desc(),  # 先按时间倒序
+            models.ProjectInfo.id.desc(),          # 时间相同再按自增ID倒序
         )
+        .first()
+    )
+    return getattr(last_project, "current_plss_email", None)
+
 
-        prev_alias = getattr(last_project, "current_plss_email", None)
+def get_last_plss_email() -> str:
+    with get_db_session() as db:
+        prev_alias = _last_assigned_plss_alias(db)
         print("上一个PLSS邮箱别名:", prev_alias)
 
-        rotation = {"A": "B", "B": "C", "C": "D", "D": "A"}
-        return rotation.get(prev_alias, "A")
+        return PLSS_ROTATION.get(prev_alias, "A")
+
+
+def allocate_plss_email() -> str:
+    """
+    分配本项目的 PLSS 邮箱别名：锁住 plss_rotation 的单行读出上一个别名并写回下一个，
+    并发登记时各自拿到不同的别名；轮换表不可用时退回 get_last_plss_email()。
+    """
+    try:
+        with get_db_session() as db:
+            rotation = _lock_plss_rotation(db)
+            alias = PLSS_ROTATION.get(rotation.last_alias, "A")
+            rotation.last_alias = alias
+            db.commit()
+            return alias
+    except SQLAlchemyError:
+        logger.exception("❌ PLSS 轮换表不可用，改为按 project_info 推算")
+        return get_last_plss_email()
+
+
+def _lock_plss_rotation(db) -> "models.PlssRotation":
+    query = db.query(models.PlssRotation).filter_by(id=PLSS_ROTATION_ROW_ID).with_for_update()
+    rotation = query.first()
+    if rotation is not None:
+        return rotation
+
+    # 首次使用：从 project_info 推出上一个别名作为起点，与旧逻辑衔接
+    rotation = models.PlssRotation(id=PLSS_ROTATION_ROW_ID, last_alias=_last_assigned_plss_alias(db))
+    db.add(rotation)
+    try:
+        db.flush()
+        return rotation
+    except IntegrityError:
+        # 另一个请求同时完成了初始化，改为锁它插入的那一行
+        db.rollback()
+        return query.one()
+
 
 def _normalize_cc(cc: Optional[Union[str, Iterable[str]]]) -> List[str]:
     """
@@ -115,6 +346,89 @@ def _normalize_cc(cc: Optional[Union[str, Iterable[str]]]) -> List[str]:
         return [s] if s else []
 
 
+def record_email_audit(form_data: dict):
+    """
+    把一次成功的发送写入宜搭邮件管理表单。
+    记录先落库到 email_audit_outbox（一次本地插入），由定时任务攒批写入宜搭，SMTP 发送成功后立即返回；
+    落库失败时退回同步写入，保证每封邮件仍然有且只有一条记录。
+    """
+    try:
+        yida_writer.enqueue_email_audit(form_data)
+    except Exception:
+        logger.exception("❌ 宜搭记录写入 outbox 失败，改为同步写入")
+        create_email_audit_form_instance(form_data)
+
+
+def build_html_message(to: str, subject: str, body: str, smtp_config: dict, cc_list: List[str]) -> EmailMessage:
+    """构造 HTML 正文邮件（同步 / 异步发送共用）。"""
+    message = EmailMessage()
+    message["From"] = smtp_config["from"]
+    message["To"] = to
+    message["Subject"] = subject
+    if cc_list:
+        message["Cc"] = ", ".join(cc_list)
+    message.add_alternative(body, subtype="html")
+    return message
+
+
+def build_attachment_message(
+    to_email: str,
+    subject: str,
+    content: str,
+    smtp_config: dict,
+    attachments: list[str] | None,
+    cc_list: List[str],
+) -> MIMEMultipart:
+    """构造带附件的邮件；附件读取失败时抛出 OSError。"""
+    message = MIMEMultipart()
+    message["From"] = smtp_config["from"]
+    message["To"] = to_email
+    message["Subject"] = subject
+    if cc_list:
+        message["Cc"] = ", ".join(cc_list)
+
+    # 添加正文
+    message.attach(MIMEText(content, "html", "utf-8"))
+
+    # 添加附件
+    if not attachments:
+        logger.warning("📎 未提供任何附件，跳过附件处理")
+    else:
+        for file_path in attachments:
+            with open(file_path, "rb") as f:
+                part = MIMEApplication(f.read())
+                part.add_header("Content-Disposition", "attachment", filename=os.path.basename(file_path))
+                message.attach(part)
+    return message
+
+
+def build_email_audit_form_data(to: str, subject: str, body: str, smtp_config: dict, stage: str, sent_at: str) -> dict:
+    """宜搭邮件管理表单数据（注意：这里只记录 From 与 To 的公司信息；如需记录 CC，可在表单中追加一项文本字段）"""
+    from_company = company_directory.get_by_email(smtp_config["from"])
+    to_company = company_directory.get_by_email(to)
+
+    return {
+        "textField_m8sdofy7": getattr(to_company, "company_name", to),
+        "textField_m8sdofy8": getattr(from_company, "company_name", smtp_config["from"]),
+        "textfield_G00FCbMy": subject,
+        "editorField_m8sdofy9": body,
+        "radioField_manpa6yh": "发送成功",
+        "textField_mbyq9ksm": sent_at,
+        "textField_mbyq9ksn": sent_at,
+        "textField_mc8eps0i": stage,
+        # 如需展示 CC，可在钉钉表单里新增一个文本字段并替换成真实字段ID
+        # "textField_cc_list": ", ".join(cc_list),
+    }
+
+
+def audit_sent_email(to: str, subject: str, body: str, smtp_config: dict, stage: str, sent_at: str):
+    """邮件已被 SMTP 接收后写宜搭记录；这里的任何异常都不能让发送被判为失败（否则会重发）。"""
+    try:
+        record_email_audit(build_email_audit_form_data(to, subject, body, smtp_config, stage, sent_at))
+    except Exception:
+        logger.exception("❌ 宜搭记录提交失败（邮件已发送成功）")
+
+
 def send_email(
     to: str,
     subject: str,
@@ -124,78 +438,19 @@ def send_email(
     cc: Optional[Union[str, Iterable[str]]] = None,  # ← 新增：可选抄送
 ):
     print("✅ 执行同步 send_email 函数")
-    message = EmailMessage()
-    message["From"] = smtp_config["from"]
-    message["To"] = to
-    message["Subject"] = subject
-    message.add_alternative(body, subtype="html")
-
     # 规范化 cc，并写入头
-    def _normalize_cc(cc_val) -> list[str]:
-        if cc_val is None:
-            return []
-        if isinstance(cc_val, str):
-            parts = [p.strip() for p in cc_val.replace(";", ",").split(",")]
-            return [p for p in parts if p]
-        try:
-            return [str(p).strip() for p in cc_val if str(p).strip()]
-        except TypeError:
-            s = str(cc_val).strip()
-            return [s] if s else []
-
     cc_list = _normalize_cc(cc)
-    if cc_list:
-        message["Cc"] = ", ".join(cc_list)
-
-    # DB 查询保持不变（注意：这里只记录 From 与 To 的公司信息；如需记录 CC，可在表单中追加一项文本字段）
-    with get_db_session() as db:
-        from_company = db.query(models.CompanyInfo).filter(models.CompanyInfo.email == smtp_config["from"]).first()
-        to_company = db.query(models.CompanyInfo).filter(models.CompanyInfo.email == to).first()
+    message = build_html_message(to, subject, body, smtp_config, cc_list)
 
     try:
-        logger.info("📧 开始建立 SMTP 连接")
-        logger.info("host", smtp_config["host"])
-        logger.info("port", smtp_config["port"])
-        logger.info("username", smtp_config["username"])
-        logger.info("password", smtp_config["password"])
-        logger.info("from", smtp_config["from"])
-        logger.info("to", to)
-        logger.info("subject", subject)
-        print("body", body)
-        print("cc", cc)
-        with smtplib.SMTP_SSL(smtp_config["host"], smtp_config["port"], timeout=30) as smtp:
-            logger.info("📧 登录 SMTP...")
-            logger.info("📧 登录 SMTP...username: %s, password: %s", smtp_config["username"], smtp_config["password"])
-            smtp.login(smtp_config["username"], smtp_config["password"])
-            logger.info("📧 登录成功，开始发送邮件...")
-            # send_message 若未提供 to_addrs，会自动使用消息头中的 To/Cc/Bcc
-            smtp.send_message(message)
+        logger.info("📧 从连接池获取 SMTP 连接...username: %s, to: %s, cc: %s", smtp_config["username"], to, cc_list)
+        # send_message 若未提供 to_addrs，会自动使用消息头中的 To/Cc/Bcc
+        smtp_pool.send_message(smtp_config, message)
 
         now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
         logger.info("✅ #########发送邮件成功，时间：%s; cc=%s", now_str, cc_list if cc_list else "[]")
 
-        # 如果你希望把 CC 也落到钉钉表单，可以加一个字段（文本拼接）
-        cc_text = ", ".join(cc_list) if cc_list else ""
-
-        create_yida_form_instance(
-            access_token=get_dingtalk_access_token(),
-            user_id=os.getenv("USER_ID"),
-            app_type=os.getenv("APP_TYPE"),
-            system_token=os.getenv("SYSTEM_TOKEN"),
-            form_uuid=os.getenv("FORM_UUID"),
-            form_data={
-                "textField_m8sdofy7": getattr(to_company, "company_name", to),
-                "textField_m8sdofy8": getattr(from_company, "company_name", smtp_config["from"]),
-                "textfield_G00FCbMy": subject,
-                "editorField_m8sdofy9": body,
-                "radioField_manpa6yh": "发送成功",
-                "textField_mbyq9ksm": now_str,
-                "textField_mbyq9ksn": now_str,
-                "textField_mc8eps0i": stage,
-                # 如需展示 CC，可在钉钉表单里新增一个文本字段并替换成真实字段ID
-                # "textField_cc_list": cc_text,
-            }
-        )
+        audit_sent_email(to, subject, body, smtp_config, stage, now_str)
 
         return True, ""
     except Exception as e:
@@ -231,64 +486,22 @@ def send_email_with_attachments(
     stage: str,
     cc: Optional[Union[str, Iterable[str]]] = None,  # ← 新增
 ):
-    message = MIMEMultipart()
-    message["From"] = smtp_config["from"]
-    message["To"] = to_email
-    message["Subject"] = subject
-
     cc_list = _normalize_cc(cc)
-    if cc_list:
-        message["Cc"] = ", ".join(cc_list)
-
-    # 添加正文
-    message.attach(MIMEText(content, "html", "utf-8"))
-
-    with get_db_session() as db:
-        from_company = db.query(models.CompanyInfo).filter(models.CompanyInfo.email == smtp_config["from"]).first()
-        to_company = db.query(models.CompanyInfo).filter(models.CompanyInfo.email == to_email).first()
-
-    # 添加附件
-    if not attachments:
-        logger.warning("📎 未提供任何附件，跳过附件处理")
-    else:
-        for file_path in attachments:
-            try:
-                with open(file_path, "rb") as f:
-                    part = MIMEApplication(f.read())
-                    part.add_header("Content-Disposition", "attachment", filename=os.path.basename(file_path))
-                    message.attach(part)
-            except Exception as e:
-                return False, f"附件读取失败: {file_path}，错误信息：{str(e)}"
+    try:
+        message = build_attachment_message(to_email, subject, content, smtp_config, attachments, cc_list)
+    except OSError as e:
+        return False, f"附件读取失败: {e.filename}，错误信息：{str(e)}"
 
     try:
         logger.info("📧 开始建立 SMTP 连接")
-        with smtplib.SMTP_SSL(smtp_config["host"], smtp_config["port"], timeout=30) as server:
-            server.login(smtp_config["username"], smtp_config["password"])
-            # 收件人列表必须包含 To + Cc
-            recipients = [to_email] + cc_list
-            server.sendmail(smtp_config["from"], recipients, message.as_string())
+        # 收件人列表必须包含 To + Cc
+        recipients = [to_email] + cc_list
+        smtp_pool.sendmail(smtp_config, smtp_config["from"], recipients, message.as_string())
 
         now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
         logger.info("✅ #########发送邮件成功，时间：%s, 抄送=%s", now_str, cc_list if cc_list else "[]")
 
-        create_yida_form_instance(
-            access_token=get_dingtalk_access_token(),
-            user_id=os.getenv("USER_ID"),
-            app_type=os.getenv("APP_TYPE"),
-            system_token=os.getenv("SYSTEM_TOKEN"),
-            form_uuid=os.getenv("FORM_UUID"),
-            form_data={
-                "textField_m8sdofy7": getattr(to_company, "company_name", to_email),
-                "textField_m8sdofy8": getattr(from_company, "company_name", smtp_config["from"]),
-                "textfield_G00FCbMy": subject,
-                "editorField_m8sdofy9": content,
-                "radioField_manpa6yh": "发送成功",
-                "textField_mbyq9ksm": now_str,
-                "textField_mbyq9ksn": now_str,
-                "textField_mc8eps0i": stage,
-                # 如需记录抄送人，可加一个字段： "textField_cc": ", ".join(cc_list)
-            }
-        )
+        audit_sent_email(to_email, subject, content, smtp_config, stage, now_str)
 
         return True, ""
     except Exception as e:
@@ -296,6 +509,126 @@ def send_email_with_attachments(
         return False, str(e)
 
 
+# 邮件标题模板缓存：email_subject 表几乎不变，整表载入进程内存，按 (stage, short_name) 索引。
+# 失效方式（与 company_directory 相同）：
+# - 标题模板在库里直接维护，改完调用 POST /reload_email_subjects（invalidate_email_subjects），
+#   清空本进程缓存并把 Redis 中的版本号 +1；
+# - 其他进程（API / Celery worker）每隔 EMAIL_SUBJECT_VERSION_CHECK_INTERVAL 秒比对一次版本号，变了就整表重载；
+# - Redis 不可用或改库后没有通知时，最多 EMAIL_SUBJECT_CACHE_TTL 秒后也会重载。
+EMAIL_SUBJECT_CACHE_TTL = int(os.getenv("EMAIL_SUBJECT_CACHE_TTL", "600"))
+EMAIL_SUBJECT_VERSION_CHECK_INTERVAL = float(os.getenv("EMAIL_SUBJECT_VERSION_CHECK_INTERVAL", "5"))
+EMAIL_SUBJECT_VERSION_KEY = "email_subject:version"
+
+
+def _redis_get_subject_version() -> Optional[str]:
+    return get_redis().get(EMAIL_SUBJECT_VERSION_KEY)
+
+
+def _redis_bump_subject_version():
+    get_redis().incr(EMAIL_SUBJECT_VERSION_KEY)
+
+
+class EmailSubjectCache:
+    def __init__(
+        self,
+        ttl: int = EMAIL_SUBJECT_CACHE_TTL,
+        check_interval: float = EMAIL_SUBJECT_VERSION_CHECK_INTERVAL,
+        version_getter: Callable[[], Optional[str]] = _redis_get_subject_version,
+        version_bumper: Callable[[], None] = _redis_bump_subject_version,
+    ):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.version_getter = version_getter
+        self.version_bumper = version_bumper
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()   # 重载单飞：并发过期时只有一个线程查库
+        self._subjects: Optional[dict[tuple[str, str], dict]] = None
+        self._version: Optional[str] = None
+        self._loaded_at: float | None = None
+        self._checked_at: float = 0.0
+
+    def _read_version(self) -> Optional[str]:
+        try:
+            return self.version_getter()
+        except Exception as e:
+            logger.warning("⚠️ 读取邮件标题缓存版本号失败，按 TTL 过期：%s", e)
+            return self._version
+
+    def load(self) -> int:
+        """从数据库整表载入，返回载入的标题模板数量。"""
+        with self._load_lock:
+            return self._load()
+
+    def _load(self) -> int:
+        # 先读版本号再查库：查库期间有人通知失效的话，版本号会变，下次检查时再重载一次
+        version = self._read_version()
+        with get_db_session() as db:
+            rows = db.query(models.EmailSubject).order_by(models.EmailSubject.id).all()
+            subjects = {}
+            for row in rows:
+                # 与原先 .first() 一致：同一 (stage, short_name) 取 id 最小的一条
+                subjects.setdefault((row.stage, row.short_name), {
+                    "subject": row.subject,
+                    "company_name": row.company_name,
+                    "short_name": row.short_name,
+                })
+        now = time.monotonic()
+        with self._lock:
+            self._subjects = subjects
+            self._version = version
+            self._loaded_at = now
+            self._checked_at = now
+        logger.info("✅ 邮件标题模板已载入，共 %s 条，版本 %s", len(subjects), version)
+        return len(subjects)
+
+    def invalidate(self):
+        """本进程立即失效，并通知其他进程重载。"""
+        with self._lock:
+            self._loaded_at = None
+        try:
+            self.version_bumper()
+        except Exception as e:
+            logger.warning("⚠️ 更新邮件标题缓存版本号失败，其他进程将在 TTL 后重载：%s", e)
+
+    def _is_stale(self) -> bool:
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            return True
+        now = time.monotonic()
+        if now - loaded_at > self.ttl:
+            return True
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        return self._read_version() != self._version
+
+    def get(self, stage: str | None, short_name: str | None) -> dict | None:
+        if self._is_stale():
+            observed = self._loaded_at
+            with self._load_lock:
+                # 等锁期间别的线程已经重载过（或刚重载失败）就直接用它的结果
+                if self._loaded_at is None or self._loaded_at == observed:
+                    try:
+                        self._load()
+                    except Exception:
+                        if self._subjects is None:
+                            raise
+                        # 重载失败时继续使用旧数据，不阻断发信；下个检查周期 / TTL 后再试
+                        logger.exception("❌ 邮件标题模板重载失败，继续使用旧缓存")
+                        now = time.monotonic()
+                        with self._lock:
+                            self._loaded_at = now
+                            self._checked_at = now
+        return self._subjects.get((stage, short_name))
+
+
+email_subject_cache = EmailSubjectCache()
+
+
+def invalidate_email_subjects():
+    email_subject_cache.invalidate()
+
+
 # 获取对应公司邮件发送标题
 # 1. 邮件阶段
 # 2. 公司简称
@@ -315,29 +648,23 @@ def render_email_subject(
     tender_number: str | None = None, # 招标编号
     purchase_department: str | None = None # 采购单位
 ) -> str: # 中标时间
-    # 从数据库中获取标题模板
-    
-    with get_db_session() as db:
-        subject = db.query(models.EmailSubject).filter(
-            models.EmailSubject.stage == stage,
-            models.EmailSubject.short_name == company_short_name,
-            # models.EmailSubject.project_name == project_name,
-        ).first()
-
-        if not subject:
-            return f"{stage}_{company_short_name}_{project_name}"
-        
-        return subject.subject.format(
-            company_name=subject.company_name or "",
-            short_name=subject.short_name or "",
-            project_name=project_name or "",
-            serial_number=serial_number or "",
-            contract_number=contract_number or "",
-            contract_amount=winning_amount or "",
-            winning_time=winning_time or "",
-            tender_number=tender_number or "", 
-            purchase_department=purchase_department or ""
-        )
+    # 从缓存中获取标题模板
+    subject = email_subject_cache.get(stage, company_short_name)
+
+    if not subject:
+        return f"{stage}_{company_short_name}_{project_name}"
+
+    return subject["subject"].format(
+        company_name=subject["company_name"] or "",
+        short_name=subject["short_name"] or "",
+        project_name=project_name or "",
+        serial_number=serial_number or "",
+        contract_number=contract_number or "",
+        contract_amount=winning_amount or "",
+        winning_time=winning_time or "",
+        tender_number=tender_number or "", 
+        purchase_department=purchase_department or ""
+    )
 
 
 
@@ -351,6 +678,50 @@ def render_email_subject(
 # buyer_name 中标商名称
 # winning_time 中标时间
 
+# 邮件正文模板：进程内共享一个 Environment，编译结果常驻内存，
+# 字节码再落一份到磁盘，worker 重启后也不必重新编译。
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "email_templates")
+TEMPLATE_BYTECODE_DIR = os.getenv(
+    "TEMPLATE_BYTECODE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".jinja_cache"),
+)
+# 生产环境设为 false：不再逐次 stat 模板文件检查是否修改
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "true").lower() in ("1", "true", "yes")
+
+
+def _build_template_env() -> Environment:
+    bytecode_cache = None
+    try:
+        os.makedirs(TEMPLATE_BYTECODE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(TEMPLATE_BYTECODE_DIR)
+    except OSError:
+        logger.warning("⚠️ 无法创建模板字节码缓存目录：%s，仅使用内存缓存", TEMPLATE_BYTECODE_DIR)
+
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(['html', 'xml']),  # 自动转义 HTML
+        bytecode_cache=bytecode_cache,
+        auto_reload=TEMPLATE_AUTO_RELOAD,
+        cache_size=-1,  # 模板数量有限，全部常驻，不做 LRU 淘汰
+    )
+
+
+template_env = _build_template_env()
+
+
+def warm_up_templates() -> int:
+    """预编译 email_templates 下的全部模板，返回成功编译的数量。在 worker / app 启动时调用。"""
+    count = 0
+    for name in template_env.list_templates(extensions=["html"]):
+        try:
+            template_env.get_template(name)
+            count += 1
+        except Exception:
+            logger.exception("❌ 模板预编译失败：%s", name)
+    logger.info("✅ 邮件模板预编译完成，共 %s 个", count)
+    return count
+
+
 def render_invitation_template_content(
     buyer_name: str | None = None,
     project_name: str | None = None,
@@ -371,16 +742,7 @@ def render_invitation_template_content(
     pingyin: str | None = None,
     company_en: str | None = None,
 ):
-    
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    template_dir = os.path.join(base_dir, "app", "email_templates")
-
-    env = Environment(
-        loader=FileSystemLoader(template_dir),
-        autoescape=select_autoescape(['html', 'xml'])  # 自动转义 HTML
-    )
-
-    template = env.get_template(template_name)  # 例如 "bidding_invite.html"
+    template = template_env.get_template(template_name)  # 例如 "bidding_invite.html"
     return template.render(
         buyer_name=buyer_name, 
         winning_time=winning_time,
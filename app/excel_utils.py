@@ -1,316 +1,374 @@
+import io
 import os
+import uuid
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Optional
 
 from openpyxl import Workbook
 from openpyxl.styles import Alignment, Font, Border, Side
 
 import paramiko
 
-import os 
+import os
 from dotenv import load_dotenv
 
+import logging
+
 load_dotenv()
 
-def generate_common_settlement_excel(
-    filename: str,
-    stage: str,
-    project_type: str,
+logger = logging.getLogger(__name__)
+
+
+# 结算单样式：模块级共享的样式对象，每个单元格只赋需要的属性，
+# 不再每张表新建 Font / Border，也不再用 apply_border 对整行逐格重复赋边框
+AMOUNT_FORMAT = "#,##0.00"
+_THIN = Side(style="thin")
+BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+TITLE_FONT = Font(size=14, bold=True)
+BOLD_FONT = Font(bold=True)
+CENTER = Alignment(horizontal="center", vertical="center")
+RIGHT = Alignment(horizontal="right")
+
+
+def _amount(value) -> float:
+    try:
+        return float(value) if value not in ("", None) else 0
+    except ValueError:
+        return 0
+
+
+def render_settlement_workbook(
     received_amount: float,
     receivable_items: list,
     head_company_name: str,
     bottom_company_name: str
-):
+) -> Workbook:
     """
-    生成结算单 Excel 文件
+    生成结算单工作簿（不落盘）
 
     参数：
-        filename: 输出的 Excel 文件名，如 "结算单.xlsx"
         received_amount: 实收款项金额（float）
         receivable_items: 应收项目列表，格式如：[("三方/四方货款", 1000), ("第三方费用", 200)]
-        company_name: 底部公司名称
+        head_company_name: 抬头公司名称
+        bottom_company_name: 底部公司名称
     """
-
-    # 使用用户主目录作为基础路径
-    home_dir = str(Path.home())
-    save_dir = os.path.join(home_dir, "settlements")
-    os.makedirs(save_dir, exist_ok=True)
-    file_path = os.path.join(save_dir, filename)
-
     wb = Workbook()
-    ws = wb.active 
+    ws = wb.active
     ws.title = "结算单"
 
-    # 样式
-    title_font = Font(size=14, bold=True)
-    bold_font = Font(bold=True)
-    center = Alignment(horizontal="center", vertical="center")
-    border = Border(
-        left=Side(style="thin"),
-        right=Side(style="thin"),
-        top=Side(style="thin"),
-        bottom=Side(style="thin")
-    )
-
-    def apply_border(cell_range):
-        for row in ws[cell_range]:
-            for cell in row:
-                cell.border = border
+    def put(coord, value=None, font=None, alignment=None, border=BORDER, number_format=None):
+        cell = ws[coord]
+        if value is not None:
+            cell.value = value
+        if font is not None:
+            cell.font = font
+        if alignment is not None:
+            cell.alignment = alignment
+        if border is not None:
+            cell.border = border
+        if number_format is not None:
+            cell.number_format = number_format
 
     # 列宽
     ws.column_dimensions["A"].width = 14
     ws.column_dimensions["B"].width = 25
     ws.column_dimensions["C"].width = 20
 
-    # 标题
+    # 标题、抬头
     ws.merge_cells("A1:C1")
-    ws["A1"] = "结算单"
-    ws["A1"].font = title_font
-    ws["A1"].alignment = center
-
-    # 抬头
+    put("A1", "结算单", font=TITLE_FONT, alignment=CENTER, border=None)
     ws.merge_cells("A2:C2")
     ws["A2"] = head_company_name
 
-    # 实收款项标题
+    # 实收款项
     ws.merge_cells("A4:C4")
-    ws["A4"] = "实收款项："
-    ws["A4"].font = bold_font
-
-    apply_border("A4:C4")
-    # apply_border("A5:C5")
-
-    # 实收表头
-    ws["A5"] = "序号"
-    ws["B5"] = "中标金额（RMB）"
-    ws["A5"].font = ws["B5"].font = bold_font
-    ws["A5"].alignment = ws["B5"].alignment = center
-    apply_border("A5:C5")
-
-    # 实收数据
-    ws["A6"] = "1"
-    ws["B6"] = float(received_amount)
-    ws["B6"].number_format = "#,##0.00"
-    ws["A6"].alignment = center
-    ws["B6"].alignment = center
-    apply_border("A6:C6")
-
-    # 应收账款标题
+    put("A4", "实收款项：", font=BOLD_FONT)
+    put("B4")
+    put("C4")
+    put("A5", "序号", font=BOLD_FONT, alignment=CENTER)
+    put("B5", "中标金额（RMB）", font=BOLD_FONT, alignment=CENTER)
+    put("C5")
+    put("A6", "1", alignment=CENTER)
+    put("B6", float(received_amount), alignment=CENTER, number_format=AMOUNT_FORMAT)
+    put("C6")
+
+    # 应收账款
     ws.merge_cells("A8:C8")
-    ws["A8"] = "应收账款："
-    ws["A8"].font = bold_font
-    apply_border("A8:C8")
-
-    # 应收表头
-    ws["A9"] = "序号"
-    ws["B9"] = "项目"
-    ws["C9"] = "金额（RMB）"
-    for col in ["A", "B", "C"]:
-        ws[f"{col}9"].font = bold_font
-        ws[f"{col}9"].alignment = center
-    apply_border("A9:C9")
-
-    # 应收项目
+    put("A8", "应收账款：", font=BOLD_FONT)
+    put("B8")
+    put("C8")
+    for col, title in (("A", "序号"), ("B", "项目"), ("C", "金额（RMB）")):
+        put(f"{col}9", title, font=BOLD_FONT, alignment=CENTER)
+
     for i, (item, amount) in enumerate(receivable_items, start=1):
         row = 9 + i
-        ws[f"A{row}"] = i
-        ws[f"A{row}"].alignment = center
-        ws[f"B{row}"] = item
-        try:
-            ws[f"C{row}"] = float(amount) if amount not in ("", None) else 0
-        except ValueError:
-            ws[f"C{row}"] = 0
-        ws[f"C{row}"].number_format = "#,##0.00"
-        apply_border(f"A{row}:C{row}")
+        put(f"A{row}", i, alignment=CENTER)
+        put(f"B{row}", item)
+        put(f"C{row}", _amount(amount), number_format=AMOUNT_FORMAT)
 
     # 小计行
     subtotal_row = 9 + len(receivable_items) + 1
-    receivable_start_row = 10
-    receivable_end_row = 9 + len(receivable_items)
-
     ws.merge_cells(f"A{subtotal_row}:B{subtotal_row}")
-    ws[f"A{subtotal_row}"] = "小计："
-    ws[f"A{subtotal_row}"].alignment = Alignment(horizontal="right")
-
+    put(f"A{subtotal_row}", "小计：", alignment=RIGHT)
+    put(f"B{subtotal_row}")
     # 修复：确保SUM范围准确
-    if receivable_items:
-        ws[f"C{subtotal_row}"] = f"=SUM(C{receivable_start_row}:C{receivable_end_row})"
-    else:
-        ws[f"C{subtotal_row}"] = 0
-
-    ws[f"C{subtotal_row}"].number_format = "#,##0.00"
-    apply_border(f"A{subtotal_row}:C{subtotal_row}")
+    put(f"C{subtotal_row}", f"=SUM(C10:C{subtotal_row - 1})" if receivable_items else 0, number_format=AMOUNT_FORMAT)
 
     # 结算款行
     balance_row = subtotal_row + 2
-    # ws.merge_cells(f"A{balance_row}:B{balance_row}")
-    ws[f"A{balance_row}"] = "结算款(RMB)："
-    ws[f"A{balance_row}"].font = Font(bold=True)
-    
-    ws[f"B{balance_row}"] = "实收款项-应收账款="
-    ws[f"C{balance_row}"] = f"=B6 - C{subtotal_row}"
-    ws[f"C{balance_row}"].number_format = "#,##0.00"
-    apply_border(f"A{balance_row}:C{balance_row}")
+    put(f"A{balance_row}", "结算款(RMB)：", font=BOLD_FONT)
+    put(f"B{balance_row}", "实收款项-应收账款=")
+    put(f"C{balance_row}", f"=B6 - C{subtotal_row}", number_format=AMOUNT_FORMAT)
 
     # 公司名称
-    ws[f"C{balance_row + 2}"] = bottom_company_name
-    ws[f"C{balance_row + 2}"].alignment = Alignment(horizontal="right")
+    put(f"C{balance_row + 2}", bottom_company_name, alignment=RIGHT, border=None)
 
     # 设置每行高度
     for row in range(1, ws.max_row + 1):
         ws.row_dimensions[row].height = 20
 
-    wb.save(file_path)
-    
-    return file_path
+    return wb
+
+
+def settlement_excel_bytes(
+    received_amount: float,
+    receivable_items: list,
+    head_company_name: str,
+    bottom_company_name: str
+) -> bytes:
+    """生成结算单并序列化为 xlsx 字节，只构建、压缩一次。"""
+    buffer = io.BytesIO()
+    render_settlement_workbook(received_amount, receivable_items, head_company_name, bottom_company_name).save(buffer)
+    return buffer.getvalue()
 
 
-def generate_email_settlement_excel(
+def write_file_copies(data: bytes, paths: list[str]) -> list[str]:
+    """
+    把同一份文件内容写到多个位置：第一个位置写入，其余位置硬链接到它（跨文件系统时退回复制）。
+    每个位置都先写 / 链接到同目录的临时文件再 os.replace，读者不会读到半个文件；
+    覆盖已存在的目标（如各项目共用的“结算单.xlsx”）只替换目录项，不会改写与其共享 inode 的其他副本。
+    """
+    first = None
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+        try:
+            if first is None:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+            else:
+                try:
+                    os.link(first, tmp_path)
+                except OSError:
+                    shutil.copyfile(first, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        first = first or path
+    return paths
+
+
+def generate_settlement_excels(
     filename: str,
     prefix: str,
     received_amount: float,
     receivable_items: list,
     head_company_name: str,
-    bottom_company_name: str
-):
+    bottom_company_name: str,
+    email_filename: str = "结算单.xlsx"
+) -> tuple[str, str]:
     """
-    生成结算单 Excel 文件
-
-    参数：
-        filename: 输出的 Excel 文件名，如 "结算单.xlsx"
-        received_amount: 实收款项金额（float）
-        receivable_items: 应收项目列表，格式如：[("三方/四方货款", 1000), ("第三方费用", 200)]
-        company_name: 底部公司名称
+    一次生成结算单，同时落到归档目录（~/settlements/<filename>，供下载和 SFTP 上传）
+    和邮件附件目录（~/<prefix>_settlements/<email_filename>），返回 (归档路径, 附件路径)。
     """
-
-    # 使用用户主目录作为基础路径
     home_dir = str(Path.home())
-    save_dir = os.path.join(home_dir, prefix+"_settlements")
-    os.makedirs(save_dir, exist_ok=True)
-    file_path = os.path.join(save_dir, filename)
+    settlement_path = os.path.join(home_dir, "settlements", filename)
+    email_attachment_path = os.path.join(home_dir, prefix + "_settlements", email_filename)
 
-    wb = Workbook()
-    ws = wb.active 
-    ws.title = "结算单"
+    data = settlement_excel_bytes(received_amount, receivable_items, head_company_name, bottom_company_name)
+    write_file_copies(data, [settlement_path, email_attachment_path])
+    return settlement_path, email_attachment_path
 
-    # 样式
-    title_font = Font(size=14, bold=True)
-    bold_font = Font(bold=True)
-    center = Alignment(horizontal="center", vertical="center")
-    border = Border(
-        left=Side(style="thin"),
-        right=Side(style="thin"),
-        top=Side(style="thin"),
-        bottom=Side(style="thin")
-    )
 
-    def apply_border(cell_range):
-        for row in ws[cell_range]:
-            for cell in row:
-                cell.border = border
+# 结算单生成进程池：openpyxl 构建 / 压缩是纯 CPU 计算，放在子进程里并行生成同一次结算的几张表，
+# 不占 API 线程的 GIL；SETTLEMENT_WORKERS=0 时退回当前进程顺序生成
+SETTLEMENT_WORKERS = int(os.getenv("SETTLEMENT_WORKERS", "2"))
 
-    # 列宽
-    ws.column_dimensions["A"].width = 14
-    ws.column_dimensions["B"].width = 25
-    ws.column_dimensions["C"].width = 20
+_settlement_pool: Optional[ProcessPoolExecutor] = None
+_settlement_pool_pid: Optional[int] = None
+_settlement_pool_lock = threading.Lock()
 
-    # 标题
-    ws.merge_cells("A1:C1")
-    ws["A1"] = "结算单"
-    ws["A1"].font = title_font
-    ws["A1"].alignment = center
 
-    # 抬头
-    ws.merge_cells("A2:C2")
-    ws["A2"] = head_company_name
+def get_settlement_pool() -> Optional[ProcessPoolExecutor]:
+    """每个进程一个进程池（fork 后重新创建）；子进程用 spawn 启动，不继承父进程的线程和连接。"""
+    global _settlement_pool, _settlement_pool_pid
+    if SETTLEMENT_WORKERS <= 0:
+        return None
+    with _settlement_pool_lock:
+        if _settlement_pool is None or _settlement_pool_pid != os.getpid():
+            _settlement_pool = ProcessPoolExecutor(
+                max_workers=SETTLEMENT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+            _settlement_pool_pid = os.getpid()
+        return _settlement_pool
 
-    # 实收款项标题
-    ws.merge_cells("A4:C4")
-    ws["A4"] = "实收款项："
-    ws["A4"].font = bold_font
-
-    apply_border("A4:C4")
-    # apply_border("A5:C5")
-
-    # 实收表头
-    ws["A5"] = "序号"
-    ws["B5"] = "中标金额（RMB）"
-    ws["A5"].font = ws["B5"].font = bold_font
-    ws["A5"].alignment = ws["B5"].alignment = center
-    apply_border("A5:C5")
-
-    # 实收数据
-    ws["A6"] = "1"
-    ws["B6"] = float(received_amount)
-    ws["B6"].number_format = "#,##0.00"
-    ws["A6"].alignment = center
-    ws["B6"].alignment = center
-    apply_border("A6:C6")
-
-    # 应收账款标题
-    ws.merge_cells("A8:C8")
-    ws["A8"] = "应收账款："
-    ws["A8"].font = bold_font
-    apply_border("A8:C8")
-
-    # 应收表头
-    ws["A9"] = "序号"
-    ws["B9"] = "项目"
-    ws["C9"] = "金额（RMB）"
-    for col in ["A", "B", "C"]:
-        ws[f"{col}9"].font = bold_font
-        ws[f"{col}9"].alignment = center
-    apply_border("A9:C9")
-
-    # 应收项目
-    for i, (item, amount) in enumerate(receivable_items, start=1):
-        row = 9 + i
-        ws[f"A{row}"] = i
-        ws[f"A{row}"].alignment = center
-        ws[f"B{row}"] = item
-        try:
-            ws[f"C{row}"] = float(amount) if amount not in ("", None) else 0
-        except ValueError:
-            ws[f"C{row}"] = 0
-        ws[f"C{row}"].number_format = "#,##0.00"
-        apply_border(f"A{row}:C{row}")
 
-    # 小计行
-    subtotal_row = 9 + len(receivable_items) + 1
-    receivable_start_row = 10
-    receivable_end_row = 9 + len(receivable_items)
+def _settlement_worker_ready() -> int:
+    return os.getpid()
 
-    ws.merge_cells(f"A{subtotal_row}:B{subtotal_row}")
-    ws[f"A{subtotal_row}"] = "小计："
-    ws[f"A{subtotal_row}"].alignment = Alignment(horizontal="right")
 
-    # 修复：确保SUM范围准确
-    if receivable_items:
-        ws[f"C{subtotal_row}"] = f"=SUM(C{receivable_start_row}:C{receivable_end_row})"
-    else:
-        ws[f"C{subtotal_row}"] = 0
+def warm_up_settlement_pool():
+    """启动时拉起子进程并导入本模块（openpyxl），首次结算不再承担进程启动开销。"""
+    pool = get_settlement_pool()
+    if pool is not None:
+        futures = [pool.submit(_settlement_worker_ready) for _ in range(SETTLEMENT_WORKERS)]
+        return [future.result() for future in futures]
 
-    ws[f"C{subtotal_row}"].number_format = "#,##0.00"
-    apply_border(f"A{subtotal_row}:C{subtotal_row}")
 
-    # 结算款行
-    balance_row = subtotal_row + 2
-    # ws.merge_cells(f"A{balance_row}:B{balance_row}")
-    ws[f"A{balance_row}"] = "结算款(RMB)："
-    ws[f"A{balance_row}"].font = Font(bold=True)
-    
-    ws[f"B{balance_row}"] = "实收款项-应收账款="
-    ws[f"C{balance_row}"] = f"=B6 - C{subtotal_row}"
-    ws[f"C{balance_row}"].number_format = "#,##0.00"
-    apply_border(f"A{balance_row}:C{balance_row}")
+def shutdown_settlement_pool():
+    global _settlement_pool
+    with _settlement_pool_lock:
+        pool = _settlement_pool if _settlement_pool_pid == os.getpid() else None
+        _settlement_pool = None
+    if pool is not None:
+        pool.shutdown(wait=True)
 
-    # 公司名称
-    ws[f"C{balance_row + 2}"] = bottom_company_name
-    ws[f"C{balance_row + 2}"].alignment = Alignment(horizontal="right")
 
-    # 设置每行高度
-    for row in range(1, ws.max_row + 1):
-        ws.row_dimensions[row].height = 20
+def _reset_settlement_pool(broken: ProcessPoolExecutor):
+    global _settlement_pool
+    with _settlement_pool_lock:
+        if _settlement_pool is broken:
+            _settlement_pool = None
+    broken.shutdown(wait=False)
 
+
+def generate_settlement_excels_parallel(jobs: list[dict]) -> list[tuple[str, str]]:
+    """
+    并行生成同一次结算的多张结算单，全部写好后按 jobs 的顺序返回 (归档路径, 附件路径)。
+    jobs 的每一项是 generate_settlement_excels 的关键字参数。进程池不可用时在当前进程顺序生成。
+    """
+    pool = get_settlement_pool()
+    if pool is not None:
+        try:
+            futures = [pool.submit(generate_settlement_excels, **job) for job in jobs]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            # 子进程被杀等情况：丢弃这个池，本次在当前进程生成，下次请求重建
+            logger.exception("❌ 结算单进程池已损坏，改为在当前进程生成")
+            _reset_settlement_pool(pool)
+    return [generate_settlement_excels(**job) for job in jobs]
+
+
+# ---------------- 月末结算汇总报表 ----------------
+# 跨项目汇总所有 ProjectFeeDetails：write_only 工作簿逐行写出，行直接来自服务端游标（stream_results），
+# 上万个项目时内存也只占一批行，不会把整张表或整个工作簿载入内存
+
+SETTLEMENT_REPORT_FEES = [
+    ("三方/四方货款", "three_fourth_amount"),
+    ("C进口服务费", "import_service_fee"),
+    ("第三方费用", "third_party_fee"),
+    ("费用结算服务费", "settlement_service_fee"),
+    ("中标服务费", "bidding_service_fee"),
+    ("购买标书费", "document_purchase_fee"),
+    ("投标服务费", "tender_service_fee"),
+]
+SETTLEMENT_REPORT_HEADERS = (
+    ["合同号", "项目名称", "流水号", "项目类型", "B公司", "C公司", "D公司", "中标时间", "中标金额"]
+    + [title for title, _ in SETTLEMENT_REPORT_FEES]
+    + ["应收合计", "结算款", "结算单已发送"]
+)
+SETTLEMENT_REPORT_BATCH_SIZE = int(os.getenv("SETTLEMENT_REPORT_BATCH_SIZE", "1000"))
+
+
+def iter_settlement_report_rows(db, start=None, end=None, batch_size: int = SETTLEMENT_REPORT_BATCH_SIZE):
+    """按中标时间 [start, end) 逐行产出汇总数据；只查需要的列，按 batch_size 从服务端游标分批取。"""
+    from app import models
+
+    project, fee = models.ProjectInfo, models.ProjectFeeDetails
+    query = (
+        db.query(
+            project.contract_number, project.project_name, project.serial_number, project.project_type,
+            project.company_b_name, project.company_c_name, project.company_d_name,
+            fee.winning_time, fee.winning_amount, *(getattr(fee, column) for _, column in SETTLEMENT_REPORT_FEES),
+            fee.is_sent,
+        )
+        .join(fee, fee.project_id == project.id)
+        .order_by(fee.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    if start is not None:
+        query = query.filter(fee.winning_time >= start)
+    if end is not None:
+        query = query.filter(fee.winning_time < end)
+
+    for row in query:
+        yield row
+
+
+def write_settlement_report(file_path: str, rows) -> int:
+    """把汇总行写进 write_only 工作簿，返回写入的项目数。"""
+    from openpyxl.cell import WriteOnlyCell
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("结算汇总")
+    for col, width in zip("ABCDEFGHIJKLMNOPQRS", [22, 36, 18, 10, 30, 30, 30, 12] + [16] * 11):
+        ws.column_dimensions[col].width = width
+
+    def cell(value, font=None, number_format=None):
+        c = WriteOnlyCell(ws, value=value)
+        if font is not None:
+            c.font = font
+        if number_format is not None:
+            c.number_format = number_format
+        return c
+
+    def amount(value):
+        return cell(float(value) if value is not None else 0, number_format=AMOUNT_FORMAT)
+
+    ws.append([cell(title, font=BOLD_FONT) for title in SETTLEMENT_REPORT_HEADERS])
+
+    fee_count = len(SETTLEMENT_REPORT_FEES)
+    count = 0
+    for row in rows:
+        count += 1
+        fees = row[9:9 + fee_count]
+        receivable = sum(float(v) for v in fees if v is not None)
+        ws.append(
+            list(row[:8])
+            + [amount(row[8])]
+            + [amount(v) for v in fees]
+            + [amount(receivable), amount(float(row[8] or 0) - receivable), "是" if row[-1] else "否"]
+        )
+
+    # 合计行：金额列求和
+    if count:
+        last = count + 1
+        totals = [cell("合计", font=BOLD_FONT)] + [None] * 7
+        for col in "IJKLMNOPQR":
+            totals.append(cell(f"=SUM({col}2:{col}{last})", font=BOLD_FONT, number_format=AMOUNT_FORMAT))
+        ws.append(totals)
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
     wb.save(file_path)
-    
-    return file_path
\ No newline at end of file
+    return count
+
+
+def generate_settlement_report(file_path: str, start=None, end=None, db=None,
+                               batch_size: int = SETTLEMENT_REPORT_BATCH_SIZE) -> int:
+    """生成中标时间在 [start, end) 内所有项目的结算汇总表，返回项目数。"""
+    from app import database
+
+    own_session = db is None
+    db = db or database.SessionLocal()
+    try:
+        return write_settlement_report(file_path, iter_settlement_report_rows(db, start, end, batch_size))
+    finally:
+        if own_session:
+            db.close()
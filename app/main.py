@@ -10,6 +10,7 @@ from typing import TypeVar
 from pydantic import BaseModel
 
 
+from anyio import to_thread
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
@@ -18,8 +19,10 @@ from fastapi import Request
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
-from app import email_utils, models, database, schemas, tasks, send_email_tasks, tasks
+from app import email_utils, excel_utils, models, database, schemas, tasks, send_email_tasks, tasks
 from app.utils import simplify_to_traditional
+from app.company_directory import company_directory, invalidate_companies
+from app.project_context import load_project_context
 from app.log_config import setup_logger
 
 from app.stage_utils.stage_A1_A2_utils import normalize_company_name, make_a1_task_from_d_to_b, make_a2_task_for_target_d, get_company_by_name, update_D_company_by_alias, get_company_by_short
@@ -66,6 +69,39 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 models.Base.metadata.create_all(bind=database.engine)
 
+
+# 同步接口（def）由 FastAPI 放到线程池执行，其中的 MySQL / Redis / 模板渲染不会阻塞事件循环；
+# 线程池大小决定同时处理的同步请求数
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", "40"))
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+
+
+@app.on_event("startup")
+def warm_up_caches():
+    email_utils.warm_up_templates()
+    try:
+        email_utils.email_subject_cache.load()
+    except Exception as e:
+        logger.error("❌ 邮件标题模板预载失败，将在首次使用时重试：%s", e)
+    try:
+        company_directory.load()
+    except Exception as e:
+        logger.error("❌ 公司信息预载失败，将在首次使用时重试：%s", e)
+    try:
+        excel_utils.warm_up_settlement_pool()
+    except Exception as e:
+        logger.error("❌ 结算单进程池启动失败，将在首次结算时重试：%s", e)
+
+
+@app.on_event("shutdown")
+def close_settlement_pool():
+    excel_utils.shutdown_settlement_pool()
+
+
 # 将 ~/settlements 目录挂载为 /download 路由
 settlement_dir = Path.home() / "settlements"
 app.mount("/download", StaticFiles(directory=settlement_dir), name="download")
@@ -103,10 +139,18 @@ def update_company_info(req: schemas.UpdateCompanyInfoRequest, db: Session = Dep
     company_info.company_en = req.company_en
 
     db.commit()
+    invalidate_companies()
     
     return {"message": "公司信息更新成功"}
 
 
+# 邮件标题模板在库里直接维护，改完调用本接口，API 和所有 worker 在几秒内重新载入，无需重启
+@app.post("/reload_email_subjects")
+def reload_email_subjects():
+    email_utils.invalidate_email_subjects()
+    return {"message": "邮件标题模板缓存已失效，将重新载入"}
+
+
 '''
 1. 委托投标
 第一封邮件：三家D公司给B公司发送邮件    
@@ -133,7 +177,7 @@ def update_company_info(req: schemas.UpdateCompanyInfoRequest, db: Session = Dep
 """
 
 @app.post("/receive_bidding_register")
-async def receive_bidding_register(
+def receive_bidding_register(
     req: schemas.BiddingRegisterRequest,
     db: Session = Depends(database.get_db)
 ):
@@ -148,7 +192,7 @@ async def receive_bidding_register(
     req = strip_request_fields(req)
 
     # 2) 确定本项目邮箱别名 (A/B/C)
-    current_plss = email_utils.get_last_plss_email()
+    current_plss = email_utils.allocate_plss_email()
     logger.info("(2) 确定本项目邮箱别名 (A/B/C): %s", current_plss)
 
     # 3) 新增项目
@@ -233,7 +277,7 @@ async def receive_bidding_register(
         project_name=simplify_to_traditional(req.project_name),
         a1_delay_minutes=LF_A1_delay, follow_a2_task=task_LF_A2,
     )
-    tasks.send_email_with_followup_delay.apply_async(kwargs=task_LF_A1, countdown=LF_A1_delay * 60)
+    tasks.start_email_chain(task_LF_A1, countdown=LF_A1_delay * 60)
 
     # FR
     fr_subject = f"【誠邀合作】{simplify_to_traditional(req.project_name)}投標{req.f_serial_number}"
@@ -244,7 +288,7 @@ async def receive_bidding_register(
         project_name=simplify_to_traditional(req.project_name),
         a1_delay_minutes=FR_A1_delay, follow_a2_task=task_FR_A2,
     )
-    tasks.send_email_with_followup_delay.apply_async(kwargs=task_FR_A1, countdown=FR_A1_delay * 60)
+    tasks.start_email_chain(task_FR_A1, countdown=FR_A1_delay * 60)
 
     # PR
     pr_subject = f"{simplify_to_traditional(req.project_name)}投標委託{req.p_serial_number}"
@@ -258,7 +302,7 @@ async def receive_bidding_register(
     if cc_list:
         task_PR_A1["cc"] = cc_list
 
-    tasks.send_email_with_followup_delay.apply_async(kwargs=task_PR_A1, countdown=PR_A1_delay * 60)
+    tasks.start_email_chain(task_PR_A1, countdown=PR_A1_delay * 60)
 
     # 8) 日志
     logger.info("A1邮件调度延迟（分钟）: LF=%s, FR=%s, PR=%s", LF_A1_delay, FR_A1_delay, PR_A1_delay)
@@ -274,7 +318,7 @@ async def receive_bidding_register(
 #     3. 招标编号
 #     4. 合同号
 @app.post("/project_bidding_winning_information")
-async def project_bidding_winning_information(req: schemas.ProjectWinningInfoRequest, db: Session = Depends(database.get_db)):
+def project_bidding_winning_information(req: schemas.ProjectWinningInfoRequest, db: Session = Depends(database.get_db)):
 
     logger.info("2项目中标信息|请求参数：%s", req.model_dump())
     
@@ -329,7 +373,7 @@ async def project_bidding_winning_information(req: schemas.ProjectWinningInfoReq
     8. 合同类型 contract_type
 """
 @app.post("/contract_audit")
-async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depends(database.get_db)):
+def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depends(database.get_db)):
 
     logger.info("3合同审核|请求参数: %s", req.model_dump())
     
@@ -353,14 +397,13 @@ async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depend
         return {"message": "没有L流水号，P流水号，F流水号，不发送邮件"}
 
     
-    # 项目信息
-    project = db.query(models.ProjectInfo).filter(
-        models.ProjectInfo.contract_number == req.contract_number
-    ).first()
+    # 项目信息（连同费用明细一次取回）
+    context = load_project_context(db, req.contract_number)
 
-    if not project:
+    if not context:
         logger.info("没有找到项目信息，不发送邮件")
         return {"message": "没有找到项目信息，不发送邮件"}
+    project = context.project
 
     # 保存旧的C公司和D公司名称，用于判断CD值是否互换
     old_c_company_name = project.company_c_name
@@ -375,7 +418,7 @@ async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depend
     # 更新project_info表中的C公司信息
     project.company_c_name = c_company_name
 
-    c_company = db.query(models.CompanyInfo).filter(models.CompanyInfo.company_name == c_company_name, models.CompanyInfo.company_type == 'C').first()
+    c_company = company_directory.get_by_name(c_company_name, 'C')
     # 如果找到了C公司，说明是内部公司，如果没有找到，说明是外部公司
 
     d_company_name = ''
@@ -394,9 +437,7 @@ async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depend
     project.company_d_name = d_company_name
 
     # 项目流水号是根据D公司的值来确认的
-    d_company = db.query(models.CompanyInfo).filter(
-        models.CompanyInfo.company_name == d_company_name
-    ).first()
+    d_company = company_directory.get_by_name(d_company_name)
 
     actual_serial_number = ''
 
@@ -413,11 +454,8 @@ async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depend
 
 
     # 从project_fee_details表中获取中标金额，中标时间
-    fee_details = db.query(models.ProjectFeeDetails).filter(
-        models.ProjectFeeDetails.project_id == project.id
-    ).first()
-    winning_amount = fee_details.winning_amount if fee_details else None
-    winning_time = fee_details.winning_time if fee_details else None
+    winning_amount = context.winning_amount
+    winning_time = context.winning_time
 
     logger.info("获取到的中标金额为%s，中标时间为%s", winning_amount, winning_time)
 
@@ -433,15 +471,9 @@ async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depend
                 
  
                 # 再次触发发邮件
-                b_company = db.query(models.CompanyInfo).filter(
-                    models.CompanyInfo.company_name == project.company_b_name
-                ).first()
-                c_company = db.query(models.CompanyInfo).filter(
-                    models.CompanyInfo.company_name == c_company_name
-                ).first()
-                d_company = db.query(models.CompanyInfo).filter(
-                    models.CompanyInfo.company_name == d_company_name
-                ).first()
+                b_company = context.b_company
+                c_company = context.c_company
+                d_company = context.d_company
 
                 if project.project_type == 'BCD':
                     send_email_tasks.schedule_bid_conversation_BCD(
@@ -498,14 +530,12 @@ async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depend
     logger.info("B公司名称：%s", project.company_b_name)
     logger.info("C公司名称：%s", c_company_name)
     logger.info("D公司名称：%s", d_company_name)
-    b_company = db.query(models.CompanyInfo).filter(
-        models.CompanyInfo.company_name == project.company_b_name, models.CompanyInfo.company_type == 'B'
-    ).first()
+    b_company = company_directory.get_by_name(project.company_b_name, 'B')
     # 如果找到了B公司，说明是内部公司
     if not b_company:
         return {"message": "没有找到B公司，不发送邮件"}
 
-    d_company = db.query(models.CompanyInfo).filter(models.CompanyInfo.company_name == d_company_name, models.CompanyInfo.company_type == 'D').first()
+    d_company = company_directory.get_by_name(d_company_name, 'D')
     # 如果找到了D公司，说明是内部公司
     if not d_company:
         return {"message": "没有找到D公司，不发送邮件"}
@@ -521,12 +551,10 @@ async def contract_audit(req: schemas.ContractAuditRequest, db: Session = Depend
         project_type = 'BCD'
 
     # 更新project_info表中的项目类型
-    project = db.query(models.ProjectInfo).filter(models.ProjectInfo.contract_number == req.contract_number).first()
-    if project:
-        project.project_type = project_type
-        db.add(project)
-        db.commit()
-        db.refresh(project)
+    project.project_type = project_type
+    db.add(project)
+    db.commit()
+    db.refresh(project)
 
     # 发送邮件
 
@@ -624,13 +652,14 @@ def settlement(
     logger.info("=" * 80)
 
 
-    project_information = db.query(models.ProjectInfo).filter_by(contract_number=req.contract_number).first()
-    if not project_information:
+    context = load_project_context(db, req.contract_number)
+    if not context:
         logger.info("没有找到项目信息，不发送邮件，合同号为: %s", req.contract_number)
         return {"message": "没有找到项目信息"}
+    project_information = context.project
 
     # 已经发送过结算单的，不用再发送
-    is_sent = project_information.fee_details.is_sent
+    is_sent = context.fee_details.is_sent
     if is_sent:
         return {"message": "已经发送过结算单，不用再发送"}
 
@@ -646,10 +675,15 @@ def settlement(
         return 0 if val == "" else float(val)
 
     # 中标时间 
-    winning_time = project_information.fee_details.winning_time if project_information.fee_details else None
+    winning_time = context.winning_time
+
+    # 提交前先解析 B/C/D 公司，避免提交后项目字段过期再触发刷新查询
+    b_company = context.b_company
+    c_company = context.c_company
+    d_company = context.d_company
 
     # 更新 project_fee_details 表
-    fee = project_information.fee_details
+    fee = context.fee_details
     fee.three_fourth_amount = clean_decimal(req.three_fourth)
     fee.import_service_fee = clean_decimal(req.import_service_fee) + clean_decimal(req.external_agent_fee) # 2036.3.10 新增计算方式：C进口服务费取值=C进口服务费（RMB）+ 外付代理费
     fee.third_party_fee = clean_decimal(req.third_party_fee)
@@ -661,17 +695,14 @@ def settlement(
     db.commit()
     db.refresh(fee)
 
-    b_company = db.query(models.CompanyInfo).filter_by(company_name=project_information.company_b_name).first()
     if not b_company:
         logger.info("没有找到B公司，不发送邮件，合同号为: %s", req.contract_number)
         return {"message": "没有找到B公司"}
 
-    d_company = db.query(models.CompanyInfo).filter_by(company_name=project_information.company_d_name).first()
     if not d_company:
         logger.info("没有找到D公司，不发送邮件，合同号为: %s", req.contract_number)
         return {"message": "没有找到D公司"}
 
-    c_company = db.query(models.CompanyInfo).filter_by(company_name=project_information.company_c_name).first()
     if not c_company:
         logger.info("没有找到C公司，说明是BD项目，合同号为: %s", req.contract_number)
         # 说明是BD项目
@@ -737,7 +768,7 @@ def settlement(
     logger.info("BC_download_url: %s, BD_download_url: %s", BC_download_url, BD_download_url)
 
     # 更新project_fee_details表中的is_sent字段
-    fee = project_information.fee_details
+    fee = context.fee_details
     fee.is_sent = True
     db.add(fee)
     db.commit()
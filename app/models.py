@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, TIMESTAMP, DECIMAL, Date, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, TIMESTAMP, DECIMAL, Date, ForeignKey, Index, JSON, LargeBinary, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, timezone
@@ -19,7 +19,39 @@ class EmailRecord(Base):
     project_id = Column(Integer)
     stage = Column(String(12))  
     actual_sending_time = Column(DateTime, nullable=True)
-    
+    body_hash = Column(String(64), nullable=True)  # 正文存在 email_bodies 时，这里只存 sha256，body 为空
+
+    stored_body = relationship(
+        "EmailBody", primaryjoin="foreign(EmailRecord.body_hash) == EmailBody.body_hash", viewonly=True
+    )
+
+    __table_args__ = (
+        Index("ix_emails_records_body_hash", "body_hash"),
+    )
+
+    @property
+    def content(self):
+        """邮件正文：内联的 body，或按 body_hash 从 email_bodies 解压出来的正文。"""
+        if self.body is not None or self.stored_body is None:
+            return self.body
+        return self.stored_body.text
+
+
+# 邮件正文按内容去重存储：同一模板 + 同一签名的正文只存一份压缩数据
+class EmailBody(Base):
+    __tablename__ = "email_bodies"
+
+    body_hash = Column(String(64), primary_key=True)     # 正文 UTF-8 的 sha256
+    compression = Column(String(8), nullable=False)      # zlib
+    data = Column(LargeBinary(length=2 ** 24), nullable=False)   # MySQL 下为 MEDIUMBLOB
+    size = Column(Integer)                               # 原文字节数
+    created_at = Column(DateTime, default=datetime.now)
+
+    @property
+    def text(self) -> str:
+        from app import email_bodies
+        return email_bodies.decompress_body(self.data, self.compression)
+
 
 class CompanyInfo(Base):
     __tablename__ = "company_info"
@@ -43,6 +75,14 @@ class CompanyInfo(Base):
     pingyin = Column(String(255))
     company_en = Column(String(255)) # 公司英文名
 
+    # 已有库表通过 app/scripts/add_indexes.py 补建（create_all 不会修改已存在的表）
+    __table_args__ = (
+        # 公司全称 + 类型唯一；单独按 company_name 查询也走这个索引的最左前缀
+        Index("uq_company_info_name_type", "company_name", "company_type", unique=True),
+        Index("ix_company_info_short_name_type", "short_name", "company_type"),
+        Index("ix_company_info_email", "email"),
+    )
+
     def __repr__(self):
         return (f"<CompanyInfo id={self.id} short_name={self.short_name} "
                 f"type={self.company_type} name={getattr(self, 'name', None)}>")
@@ -90,6 +130,84 @@ class ProjectInfo(Base):
 
     fee_details = relationship("ProjectFeeDetails", back_populates="project", uselist=False, cascade="all, delete")
 
+    __table_args__ = (
+        # 新项目登记时合同号为空字符串，所以合同号不能建唯一索引
+        Index("ix_project_info_contract_number", "contract_number"),
+        Index("ix_project_info_serial_numbers", "p_serial_number", "l_serial_number", "f_serial_number"),
+    )
+
+# 邮件对话链的步骤：每封预先渲染好的邮件只存一份，Celery 消息里只带 (chain_id, step_index)；
+# 延迟发送不再用 countdown 压在 Redis 里，而是记下 due_at，由调度任务到点批量投递
+class EmailChainStep(Base):
+    __tablename__ = "email_chain_steps"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chain_id = Column(String(32), nullable=False)
+    step_index = Column(Integer, nullable=False)          # 0 为起点，发送成功后调度 step_index + 1
+    stage = Column(String(12))
+    to_email = Column(String(255), nullable=False)
+    cc = Column(JSON, nullable=True)                      # 抄送列表
+    subject = Column(String(255))
+    content = Column(Text)
+    smtp_config = Column(JSON, nullable=False)
+    attachments = Column(JSON, nullable=True)             # None：普通 HTML 邮件；列表：走带附件发送
+    delay = Column(Integer, nullable=False, default=0)    # 上一步发送成功后等待的秒数
+    # waiting：等上一步发完 / scheduled：已定发送时间 / queued：已投递到 Celery / sent / failed
+    status = Column(String(12), nullable=False, default="waiting")
+    due_at = Column(DateTime, nullable=True)              # 计划发送时间，由调度器到点投递
+    queued_at = Column(DateTime, nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (
+        Index("uq_email_chain_steps_chain_step", "chain_id", "step_index", unique=True),
+        Index("ix_email_chain_steps_status_due", "status", "due_at"),
+    )
+
+# 发送台账：每封邮件一个确定性的 message_key，SMTP 发送前先认领，发送成功后标记 sent；
+# 任务重试或被重新投递时据此跳过已经发出的邮件
+class EmailSendLedger(Base):
+    __tablename__ = "email_send_ledger"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_key = Column(String(64), nullable=False)      # sha256
+    status = Column(String(12), nullable=False, default="sending")  # sending / sent
+    owner = Column(String(100))                           # 认领的 Celery 任务 ID
+    stage = Column(String(12))
+    to_email = Column(String(255))
+    claimed_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("uq_email_send_ledger_message_key", "message_key", unique=True),
+    )
+
+# 宜搭邮件管理表单的待写入记录（outbox）：发送成功后先落库，调度器再按批用 batchSave 写入宜搭，
+# worker 崩溃 / 重启都不会丢记录
+class EmailAuditOutbox(Base):
+    __tablename__ = "email_audit_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    form_data = Column(JSON, nullable=False)
+    # pending：待写入 / sending：已取出正在写入 / sent / failed：明确失败且达到最大次数
+    # unknown：请求发出后结果不确定（读超时、5xx 等），可能已写入，不再自动重发，需人工核对
+    status = Column(String(12), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    claimed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_audit_outbox_status_id", "status", "id"),
+    )
+
+# PLSS 发信邮箱轮换状态（只有 id=1 一行），分配时 SELECT ... FOR UPDATE 加行锁
+class PlssRotation(Base):
+    __tablename__ = "plss_rotation"
+
+    id = Column(Integer, primary_key=True)
+    last_alias = Column(String(12), nullable=True)   # 最近一次分配出去的别名（A/B/C/D）
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
 # 邮件标题表
 class EmailSubject(Base):
 
@@ -0,0 +1,53 @@
+# app/project_context.py
+# 合同审批、结算接口共用的项目上下文：项目 + 费用明细一次 JOIN 查询取回，
+# B/C/D 公司从进程内公司缓存解析，不再逐个查库。
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.orm import Session, joinedload
+
+from app import models
+from app.company_directory import CompanyProfile, company_directory
+
+
+@dataclass
+class ProjectContext:
+    """
+    project / fee_details 仍绑定在调用方的 Session 上，可以直接修改后提交；
+    公司属性按项目当前的公司名现查缓存，接口里改了 company_c_name 等字段后取到的就是新公司。
+    """
+    project: models.ProjectInfo
+    fee_details: Optional[models.ProjectFeeDetails]
+
+    @property
+    def b_company(self) -> Optional[CompanyProfile]:
+        return company_directory.get_by_name(self.project.company_b_name)
+
+    @property
+    def c_company(self) -> Optional[CompanyProfile]:
+        return company_directory.get_by_name(self.project.company_c_name)
+
+    @property
+    def d_company(self) -> Optional[CompanyProfile]:
+        return company_directory.get_by_name(self.project.company_d_name)
+
+    @property
+    def winning_amount(self):
+        return self.fee_details.winning_amount if self.fee_details else None
+
+    @property
+    def winning_time(self):
+        return self.fee_details.winning_time if self.fee_details else None
+
+
+def load_project_context(db: Session, contract_number: str) -> Optional[ProjectContext]:
+    """按合同号取项目及其费用明细（一条 LEFT JOIN 查询），找不到项目返回 None。"""
+    project = (
+        db.query(models.ProjectInfo)
+        .options(joinedload(models.ProjectInfo.fee_details))
+        .filter(models.ProjectInfo.contract_number == contract_number)
+        .first()
+    )
+    if not project:
+        return None
+    return ProjectContext(project=project, fee_details=project.fee_details)
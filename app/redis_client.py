@@ -0,0 +1,33 @@
+# app/redis_client.py
+# 业务侧共用的 Redis 连接（与 Celery broker 同一实例），每个进程一个连接池。
+import os
+import threading
+
+import redis
+
+from dotenv import load_dotenv
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    """返回当前进程的 Redis 客户端；Celery prefork 子进程会重新建立连接池。"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = redis.Redis.from_url(
+                    REDIS_URL,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                    decode_responses=True,
+                )
+                _client_pid = pid
+    return _client
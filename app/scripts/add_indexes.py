@@ -0,0 +1,78 @@
+"""
+
+为已有的库表补建 models.py 中声明的索引（create_all 只建新表，不会给已存在的表加索引）
+
+可重复执行：已存在的索引会跳过；唯一索引在建之前先检查重复数据，有重复时只打印出来，不建索引。
+Run with: python -m app.scripts.add_indexes
+
+"""
+from sqlalchemy import func, inspect, select
+
+from app import database, models
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+# 后加的列：create_all 不会给已存在的表加列，需先运行对应的迁移脚本补列，再建这些列上的索引
+COLUMN_MIGRATIONS = {
+    ("emails_records", "body_hash"): "python -m app.scripts.migrate_email_bodies",
+}
+
+
+def find_duplicates(conn, index):
+    """返回违反唯一索引的重复值组合及其行数。"""
+    columns = list(index.columns)
+    stmt = (
+        select(*columns, func.count().label("cnt"))
+        .group_by(*columns)
+        .having(func.count() > 1)
+    )
+    return conn.execute(stmt).all()
+
+
+def add_missing_indexes(engine=None):
+    """按 models 中的声明补建缺失的索引，返回新建的索引名列表。"""
+    engine = engine or database.engine
+    inspector = inspect(engine)
+    created = []
+
+    for table in models.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        columns = {col["name"] for col in inspector.get_columns(table.name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in existing:
+                continue
+
+            missing = [col.name for col in index.columns if col.name not in columns]
+            if missing:
+                for name in missing:
+                    hint = COLUMN_MIGRATIONS.get((table.name, name), "先补上该列")
+                    print(f"⚠️ {table.name}.{name} 列还不存在，跳过索引 {index.name}，请先运行：{hint}")
+                continue
+
+            if index.unique:
+                with engine.connect() as conn:
+                    duplicates = find_duplicates(conn, index)
+                if duplicates:
+                    print(f"❌ {table.name}.{index.name} 存在重复数据，跳过建唯一索引，请先清理：")
+                    for row in duplicates:
+                        print(f"   {tuple(row)}")
+                    continue
+
+            index.create(bind=engine)
+            created.append(index.name)
+            print(f"✅ 已创建索引 {table.name}.{index.name}")
+
+    if not created:
+        print("✅ 索引均已存在，无需变更")
+    return created
+
+
+if __name__ == "__main__":
+    add_missing_indexes()
@@ -0,0 +1,75 @@
+"""
+
+把 emails_records 中已有的内联正文迁移到 email_bodies（按 sha256 去重、zlib 压缩），记录只保留 body_hash
+
+先补 body_hash 列、email_bodies 表和索引，再按 id 分批迁移；每批单独提交，可中断后重复执行。
+迁移完成后可设置 EMAIL_BODY_STORAGE=hashed，让新记录也按此方式存储。
+Run with: python -m app.scripts.migrate_email_bodies [--batch-size 500]
+
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+
+from app import database, email_bodies, models
+from app.scripts.add_indexes import add_missing_indexes
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+def ensure_schema(engine):
+    """create_all 不会给已存在的表加列，这里补上 emails_records.body_hash。"""
+    models.EmailBody.__table__.create(bind=engine, checkfirst=True)
+    columns = {col["name"] for col in inspect(engine).get_columns(models.EmailRecord.__tablename__)}
+    if "body_hash" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE emails_records ADD COLUMN body_hash VARCHAR(64) NULL"))
+        print("✅ 已添加列 emails_records.body_hash")
+    add_missing_indexes(engine)
+
+
+def migrate_email_bodies(engine=None, batch_size: int = 500) -> int:
+    """迁移全部内联正文，返回迁移的记录数。"""
+    engine = engine or database.engine
+    ensure_schema(engine)
+
+    record = models.EmailRecord
+    migrated = 0
+    last_id = 0
+    db = database.SessionLocal(bind=engine)
+    try:
+        while True:
+            rows = (
+                db.query(record.id, record.body)
+                .filter(record.id > last_id, record.body.isnot(None), record.body_hash.is_(None))
+                .order_by(record.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+
+            hashes = email_bodies.store_bodies(db, [row.body for row in rows])
+            db.bulk_update_mappings(record, [
+                {"id": row.id, "body": None, "body_hash": hashes[row.body]} for row in rows
+            ])
+            db.commit()
+
+            last_id = rows[-1].id
+            migrated += len(rows)
+            print(f"✅ 已迁移 {migrated} 条（至 id={last_id}），本批去重后正文 {len(set(hashes.values()))} 份")
+    finally:
+        db.close()
+
+    print(f"✅ 迁移完成，共 {migrated} 条")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移 emails_records 正文到 email_bodies")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    migrate_email_bodies(batch_size=args.batch_size)
@@ -0,0 +1,55 @@
+"""
+
+生成月末结算汇总表：所有项目的中标金额、各项费用、应收合计和结算款，一个项目一行
+
+按中标时间筛选，默认上个月；数据从数据库游标流式读出、write_only 模式逐行写入，项目再多内存也不会增长。
+Run with: python -m app.scripts.settlement_report --month 2025-09 [--output ~/settlement_reports/2025-09.xlsx]
+          python -m app.scripts.settlement_report --all
+
+"""
+import argparse
+import os
+from datetime import date
+from pathlib import Path
+
+from app import excel_utils
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+def month_range(month: str) -> tuple[date, date]:
+    """'2025-09' -> (2025-09-01, 2025-10-01)"""
+    year, mon = (int(part) for part in month.split("-"))
+    start = date(year, mon, 1)
+    end = date(year + 1, 1, 1) if mon == 12 else date(year, mon + 1, 1)
+    return start, end
+
+
+def last_month() -> str:
+    first = date.today().replace(day=1)
+    return f"{first.year - 1}-12" if first.month == 1 else f"{first.year}-{first.month - 1:02d}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成月末结算汇总表")
+    parser.add_argument("--month", default=None, help="中标月份，如 2025-09（默认上个月）")
+    parser.add_argument("--all", action="store_true", help="不按月份筛选，汇总全部项目")
+    parser.add_argument("--output", default=None, help="输出文件路径")
+    parser.add_argument("--batch-size", type=int, default=excel_utils.SETTLEMENT_REPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.all:
+        start = end = None
+        label = "全部"
+    else:
+        label = args.month or last_month()
+        start, end = month_range(label)
+
+    output = os.path.expanduser(args.output) if args.output else os.path.join(
+        str(Path.home()), "settlement_reports", f"结算汇总_{label}.xlsx"
+    )
+    count = excel_utils.generate_settlement_report(output, start, end, batch_size=args.batch_size)
+    print(f"✅ 已生成结算汇总表 {output}，共 {count} 个项目")
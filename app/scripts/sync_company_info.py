@@ -7,7 +7,7 @@
 import os
 
 from app import database, models
-from app.utils import get_dingtalk_access_token,create_yida_form_instance
+from app.yida_writer import YidaBatchWriter
 
 from dotenv import load_dotenv
 
@@ -25,14 +25,16 @@ def sync_company_info():
     for company_info in company_infos:
         print(company_info.company_name)
 
+    # 批量写入：按 batchSave 的批次大小合并请求
+    writer = YidaBatchWriter(
+        user_id=os.getenv("USER_ID"),
+        app_type=os.getenv("COMPANY_INFO_APP_TYPE"),
+        system_token=os.getenv("COMPANY_INFO_SYSTEM_TOKEN"),
+        form_uuid=os.getenv("COMPANY_INFO_FORM_UUID"),
+    )
     for company_info in company_infos:
-        create_yida_form_instance(
-            access_token=get_dingtalk_access_token(),
-            user_id=os.getenv("USER_ID"),
-            app_type=os.getenv("COMPANY_INFO_APP_TYPE"),
-            system_token=os.getenv("COMPANY_INFO_SYSTEM_TOKEN"),
-            form_uuid=os.getenv("COMPANY_INFO_FORM_UUID"),
-            form_data={
+        writer.add(
+            {
                 "selectField_md18jaro": company_info.company_type, # 公司类型
                 "textField_md18jark": company_info.company_name, # 公司名称
                 "textField_md18jary": company_info.short_name, # 公司简称
@@ -45,6 +47,7 @@ def sync_company_info():
                 "textField_md18jasj": company_info.english_address, # 英文地址
             }
         )
+    writer.close()
 
 
 sync_company_info()
@@ -6,9 +6,10 @@ from datetime import datetime, timedelta
 from contextlib import contextmanager
 
 from app import database, models, email_utils, excel_utils
-from app.tasks import send_reply_email, upload_file_to_sftp_task, send_email_with_followup_delay, send_reply_email_with_attachments_delay
+from app.tasks import send_reply_email, upload_files_to_sftp_task, start_email_chain
 from app.utils import simplify_to_traditional
 from app.email_utils import MAIL_ACCOUNTS
+from app.company_directory import CompanyProfile
 
 from celery import chain
 
@@ -31,9 +32,9 @@ def get_db_session():
 
 def schedule_bid_conversation_BCD(
     project_info: models.ProjectInfo,
-    b_company: models.CompanyInfo, 
-    c_company: models.CompanyInfo, 
-    d_company: models.CompanyInfo, 
+    b_company: CompanyProfile, 
+    c_company: CompanyProfile, 
+    d_company: CompanyProfile, 
     contract_number: str,  # 合同号
     winning_amount: str,   # 中标金额
     winning_time: str,     # 中标时间
@@ -280,10 +281,7 @@ def schedule_bid_conversation_BCD(
     logger.info(f"[B3] 💌 调度链准备完成，目标：{c_company.email}")
 
     # === 调度起点 (B3) ===
-    send_email_with_followup_delay.apply_async(
-        kwargs=task_b3,
-        countdown=0
-    )
+    start_email_chain(task_b3)
 
     return {"message": "BCD email chain scheduled"}
 
@@ -293,8 +291,8 @@ def schedule_bid_conversation_BCD(
 # 特殊B5模板
 def schedule_bid_conversation_CCD(
     project_info: models.ProjectInfo,
-    b_company: models.CompanyInfo, 
-    d_company: models.CompanyInfo, 
+    b_company: CompanyProfile, 
+    d_company: CompanyProfile, 
     contract_serial_number: str,
     winning_amount: str,
     winning_time: str,
@@ -470,10 +468,7 @@ def schedule_bid_conversation_CCD(
     logger.info(f"[B5] 🚀 邮件已调度，发送对象：{d_company.email}，发送成功后将调度 B6")
 
     # 调度 B5 邮件立即执行（或你也可以加入前置 delay）
-    send_email_with_followup_delay.apply_async(
-        kwargs=task_b5,
-        countdown=0
-    )
+    start_email_chain(task_b5)
 
     return {
         "message": "email sent!"
@@ -483,9 +478,9 @@ def schedule_bid_conversation_CCD(
 # BD 项目类型发送邮件
 def schedule_bid_conversation_BD(
     project_info: models.ProjectInfo,
-    b_company: models.CompanyInfo, 
+    b_company: CompanyProfile, 
     c_company_name: str,
-    d_company: models.CompanyInfo,
+    d_company: CompanyProfile,
     contract_serial_number: str,
     winning_amount: str,
     winning_time: str,
@@ -643,10 +638,7 @@ def schedule_bid_conversation_BD(
     logger.info(f"[B5] 🚀 调度中，目标: {d_company.email}，成功后将调度 B6")
 
     # 调度 B5，立即执行
-    send_email_with_followup_delay.apply_async(
-        kwargs=task_b5,
-        countdown=0
-    )
+    start_email_chain(task_b5)
 
     return {
         "message": "email sent!"
@@ -673,9 +665,9 @@ def schedule_bid_conversation_BD(
 
 def schedule_settlement_BCD(
     project_info: models.ProjectInfo,
-    b_company: models.CompanyInfo,
-    c_company: models.CompanyInfo,
-    d_company: models.CompanyInfo,
+    b_company: CompanyProfile,
+    c_company: CompanyProfile,
+    d_company: CompanyProfile,
     contract_number: str, # 合同号
     contract_serial_number: str, # 流水号
     project_name: str,
@@ -774,46 +766,54 @@ def schedule_settlement_BCD(
         company_en=c_company.company_en,
     )
 
-    # 生成C->B结算单
+    # 生成C->B、B->D结算单
     # 文件名：项目号-流水号-BCD模式-BC结算单.xlsx
     BC_filename = f"{contract_number}_{contract_serial_number}_BCD模式_BC结算单.xlsx"
+    BD_filename = f"{contract_number}_{contract_serial_number}_BCD模式_BD结算单.xlsx"
 
     BC_download_url = f"http://103.30.78.107:8000/download/{BC_filename}"
+    BD_download_url = f"http://103.30.78.107:8000/download/{BD_filename}"
 
-    CB_settlement_path = excel_utils.generate_common_settlement_excel(
-        filename=BC_filename,  # 可根据项目名称动态命名
-        stage="C7",
-        project_type="BCD",
-        received_amount=amount,
-        receivable_items=[
-            ("三方/四方货款", three_fourth),
-            ('C进口服务费', import_service_fee),
-            ("第三方费用", third_party_fee),
-            ("费用结算服务费", service_fee),
-        ],
-        head_company_name=b_company.company_name,
-        bottom_company_name=c_company.company_name
-    )
-
-    CB_email_attachment_path = excel_utils.generate_email_settlement_excel(
-        filename="结算单.xlsx",
-        prefix="CB",
-        received_amount=amount,
-        receivable_items=[
-            ("三方/四方货款", three_fourth),
-            ('C进口服务费', import_service_fee),
-            ("第三方费用", third_party_fee),
-            ("费用结算服务费", service_fee),
-        ],
-        head_company_name=b_company.company_name,
-        bottom_company_name=c_company.company_name
-    )
+    # 两张结算单互不依赖，放进进程池并行生成；归档副本和邮件附件副本只生成一次，附件目录硬链接到归档文件
+    (CB_settlement_path, CB_email_attachment_path), (BD_settlement_path, BD_email_attachment_path) = \
+        excel_utils.generate_settlement_excels_parallel([
+            dict(
+                filename=BC_filename,
+                prefix="CB",
+                received_amount=amount,
+                receivable_items=[
+                    ("三方/四方货款", three_fourth),
+                    ('C进口服务费', import_service_fee),
+                    ("第三方费用", third_party_fee),
+                    ("费用结算服务费", service_fee),
+                ],
+                head_company_name=b_company.company_name,
+                bottom_company_name=c_company.company_name
+            ),
+            dict(
+                filename=BD_filename,
+                prefix="BD",
+                received_amount=amount,
+                receivable_items=[
+                    ("三方/四方货款", three_fourth),
+                    ('C进口服务费', import_service_fee),
+                    ("第三方费用", third_party_fee),
+                    ("费用结算服务费", service_fee),
+                    ("中标服务费", win_bidding_fee),
+                    ("购买标书费", bidding_document_fee),
+                    ("投标服务费", bidding_service_fee)
+                ],
+                head_company_name=d_company.company_name,
+                bottom_company_name=b_company.company_name
+            ),
+        ])
 
     logger.info("CB_settlement_path&&&: %s", CB_settlement_path)
     logger.info("CB_email_attachment_path&&&: %s", CB_email_attachment_path)
     #TODO 1. FTP将生成的文件回传到归档服务器
     
-    upload_file_to_sftp_task.delay("~/settlements/"+BC_filename, BC_filename)
+    # 两张结算单走同一个 SFTP 会话上传
+    upload_files_to_sftp_task.delay([(CB_settlement_path, BC_filename), (BD_settlement_path, BD_filename)])
 
     # 第二封邮件：B ➝ D
     # 随机延迟 5–60 分钟发出B-D间结算单
@@ -851,51 +851,9 @@ def schedule_settlement_BCD(
         company_en=b_company.company_en,
     )
 
-    BD_filename = f"{contract_number}_{contract_serial_number}_BCD模式_BD结算单.xlsx"
-
-    BD_download_url = f"http://103.30.78.107:8000/download/{BD_filename}"
-
-    # 生成B-D结算单
-    BD_settlement_path = excel_utils.generate_common_settlement_excel(
-        filename=BD_filename,  # 可根据项目名称动态命名
-        stage="C8",
-        project_type="BCD",
-        received_amount=amount,
-        receivable_items=[
-            ("三方/四方货款", three_fourth),
-            ('C进口服务费', import_service_fee),
-            ("第三方费用", third_party_fee),
-            ("费用结算服务费", service_fee),
-            ("中标服务费", win_bidding_fee),
-            ("购买标书费", bidding_document_fee),
-            ("投标服务费", bidding_service_fee)
-        ],
-        head_company_name=d_company.company_name,
-        bottom_company_name=b_company.company_name
-    )
-
-    BD_email_attachment_path = excel_utils.generate_email_settlement_excel(
-        filename="结算单.xlsx",
-        prefix="BD",
-        received_amount=amount,
-        receivable_items=[
-            ("三方/四方货款", three_fourth),
-            ('C进口服务费', import_service_fee),
-            ("第三方费用", third_party_fee),
-            ("费用结算服务费", service_fee),
-            ("中标服务费", win_bidding_fee),
-            ("购买标书费", bidding_document_fee),
-            ("投标服务费", bidding_service_fee)
-        ],
-        head_company_name=d_company.company_name,
-        bottom_company_name=b_company.company_name
-    )
-
     logger.info("BD_settlement_path&&&: %s", BD_settlement_path)
     logger.info("BD_email_attachment_path&&&: %s", BD_email_attachment_path)
 
-    upload_file_to_sftp_task.delay("~/settlements/"+BD_filename, BD_filename)
-
 
     # 第三封邮件：D ➝ B
     # 随机延迟 5–60 分钟发出D-B间结算单确认
@@ -1031,10 +989,7 @@ def schedule_settlement_BCD(
     logger.info(f"[C7] 🚀 开始调度，目标：{b_company.email}，成功后将在 {delay_c7 // 60} 分钟后调度 C8")
 
     # 启动入口任务 C7
-    send_reply_email_with_attachments_delay.apply_async(
-        kwargs=task_c7,
-        countdown=0
-    )
+    start_email_chain(task_c7)
     
 
     return {
@@ -1053,9 +1008,9 @@ def schedule_settlement_BCD(
 # BD之间发送结算单
 def schedule_settlement_CCD_BD(
     project_info: models.ProjectInfo,
-    b_company: models.CompanyInfo,
-    c_company: models.CompanyInfo,
-    d_company: models.CompanyInfo,
+    b_company: CompanyProfile,
+    c_company: CompanyProfile,
+    d_company: CompanyProfile,
     contract_number: str, # 合同号
     contract_serial_number: str, # 流水号
     project_name: str,
@@ -1161,46 +1116,31 @@ def schedule_settlement_CCD_BD(
         BD_filename = f"{contract_number}_{contract_serial_number}_CCD模式_BD结算单.xlsx"
 
     # 生成B-D结算单
-    BD_settlement_path = excel_utils.generate_common_settlement_excel(
-        filename=BD_filename,  
-        stage="C8",
-        project_type="BD",
-        received_amount=amount,
-        receivable_items=[
-            ("三方/四方货款", three_fourth),
-            ('C进口服务费', import_service_fee),
-            ("第三方费用", third_party_fee),
-            ("费用结算服务费", service_fee),
-            ("中标服务费", win_bidding_fee),
-            ("购买标书费", bidding_document_fee),
-            ("投标服务费", bidding_service_fee)
-        ],
-        head_company_name=d_company.company_name,
-        bottom_company_name=b_company.company_name
-    )
-
-    BD_email_attachment_path = excel_utils.generate_email_settlement_excel(
-        filename="结算单.xlsx",
-        prefix="BD",
-        received_amount=amount,
-        receivable_items=[
-            ("三方/四方货款", three_fourth),
-            ('C进口服务费', import_service_fee),
-            ("第三方费用", third_party_fee),
-            ("费用结算服务费", service_fee),
-            ("中标服务费", win_bidding_fee),
-            ("购买标书费", bidding_document_fee),
-            ("投标服务费", bidding_service_fee)
-        ],
-        head_company_name=d_company.company_name,
-        bottom_company_name=b_company.company_name
-    )
+    # 在结算单进程池里生成，不占 API 进程的 GIL；归档副本和邮件附件副本只生成一次，附件目录硬链接到归档文件
+    [(BD_settlement_path, BD_email_attachment_path)] = excel_utils.generate_settlement_excels_parallel([
+        dict(
+            filename=BD_filename,
+            prefix="BD",
+            received_amount=amount,
+            receivable_items=[
+                ("三方/四方货款", three_fourth),
+                ('C进口服务费', import_service_fee),
+                ("第三方费用", third_party_fee),
+                ("费用结算服务费", service_fee),
+                ("中标服务费", win_bidding_fee),
+                ("购买标书费", bidding_document_fee),
+                ("投标服务费", bidding_service_fee)
+            ],
+            head_company_name=d_company.company_name,
+            bottom_company_name=b_company.company_name
+        ),
+    ])
 
     logger.info("BD_settlement_path&&&: %s", BD_settlement_path)
     logger.info("BD_email_attachment_path&&&: %s", BD_email_attachment_path)
 
 
-    upload_file_to_sftp_task.delay("~/settlements/"+BD_filename, BD_filename)
+    upload_files_to_sftp_task.delay([(BD_settlement_path, BD_filename)])
 
 
     # 第二封邮件：D ➝ B
@@ -1273,15 +1213,9 @@ def schedule_settlement_CCD_BD(
     logger.info(f"[C8] 🚀 调度任务，目标：{d_email}，成功后将在 {delay_c9 // 60} 分钟后发送 C9")
 
     # 执行任务 C8（立即）
-    logger.info(f"[C8] 📋 准备调用apply_async，task_c8参数: {list(task_c8.keys())}")
-    logger.info(f"[C8] 📋 task_c8['followup_task_args']的keys: {list(task_c8['followup_task_args'].keys()) if task_c8.get('followup_task_args') else 'None'}")
-
-    send_reply_email_with_attachments_delay.apply_async(
-        kwargs=task_c8,
-        countdown=0
-    )
+    chain_id = start_email_chain(task_c8)
 
-    logger.info(f"[C8] ✅ apply_async调用完成")
+    logger.info(f"[C8] ✅ 邮件链已调度，chain_id: {chain_id}")
 
 
     return {
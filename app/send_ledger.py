@@ -0,0 +1,82 @@
+# app/send_ledger.py
+# 幂等发送台账：任务在 SMTP 发送前按 message_key 认领，发送成功后标记 sent。
+# 任务因后续步骤（宜搭记录、调度 followup 等）异常而重试，或 worker 挂掉后消息被重新投递时，
+# 已经发出的邮件不会再发一次，followup 也不会被重复调度。
+import os
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+import logging
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+
+logger = logging.getLogger(__name__)
+
+# 认领后超过该秒数仍未标记 sent，视为认领者已经挂掉，允许其他任务接手
+SEND_LEDGER_LEASE = int(os.getenv("SEND_LEDGER_LEASE", "600"))
+
+CLAIMED = "claimed"            # 本任务获得发送权
+ALREADY_SENT = "sent"          # 之前已经发送成功，跳过
+IN_PROGRESS = "in_progress"    # 其他任务正在发送
+
+
+def make_message_key(*parts) -> str:
+    return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def claim(
+    db: Session,
+    message_key: str,
+    owner: Optional[str] = None,
+    stage: Optional[str] = None,
+    to_email: Optional[str] = None,
+) -> str:
+    """原子认领，返回 CLAIMED / ALREADY_SENT / IN_PROGRESS。同一 owner（同一任务的重试）可以重新认领。"""
+    ledger = models.EmailSendLedger
+    for _ in range(2):
+        now = datetime.now()
+        db.add(ledger(message_key=message_key, status="sending", owner=owner, stage=stage,
+                      to_email=to_email, claimed_at=now))
+        try:
+            db.commit()
+            return CLAIMED
+        except IntegrityError:
+            db.rollback()
+
+        entry = db.query(ledger).filter(ledger.message_key == message_key).first()
+        if entry is None:
+            continue  # 认领者刚刚释放，再插一次
+        if entry.status == "sent":
+            return ALREADY_SENT
+
+        # 仍在 sending：自己的重试或租约已过期时接手（条件 UPDATE，只有一个任务能成功）
+        takeover = ledger.claimed_at < now - timedelta(seconds=SEND_LEDGER_LEASE)
+        if owner is not None:
+            takeover = takeover | (ledger.owner == owner)
+        taken = (
+            db.query(ledger)
+            .filter(ledger.message_key == message_key, ledger.status == "sending", takeover)
+            .update({"owner": owner, "claimed_at": now}, synchronize_session=False)
+        )
+        db.commit()
+        return CLAIMED if taken else IN_PROGRESS
+    return IN_PROGRESS
+
+
+def mark_sent(db: Session, message_key: str):
+    db.query(models.EmailSendLedger).filter(models.EmailSendLedger.message_key == message_key).update(
+        {"status": "sent", "sent_at": datetime.now()}, synchronize_session=False
+    )
+    db.commit()
+
+
+def release(db: Session, message_key: str):
+    """发送失败时释放认领，重试时可以重新发送。"""
+    db.query(models.EmailSendLedger).filter(
+        models.EmailSendLedger.message_key == message_key, models.EmailSendLedger.status == "sending"
+    ).delete(synchronize_session=False)
+    db.commit()
@@ -0,0 +1,195 @@
+# app/sftp_pool.py
+# SFTP 连接池：NAS 在 FRP 后面，每次新建 paramiko.Transport 都要 TCP 穿透、SSH 密钥交换、认证，动辄数秒。
+# 同一进程内按 (host, port, username) 复用已认证的 transport，开 keepalive 防止 FRP / NAS 断开空闲连接，
+# 连接失效时丢弃重连；一个项目的多个结算单在同一个会话里上传。
+import os
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+import logging
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+SFTP_POOL_IDLE_TIMEOUT = int(os.getenv("SFTP_POOL_IDLE_TIMEOUT", "300"))   # 空闲连接保留秒数
+SFTP_KEEPALIVE = int(os.getenv("SFTP_KEEPALIVE", "30"))                    # SSH keepalive 间隔（秒）
+SFTP_CONNECT_TIMEOUT = int(os.getenv("SFTP_CONNECT_TIMEOUT", "30"))        # 连接 / 握手超时
+
+
+def sftp_config_from_env(username_env: str, password_env: str) -> dict:
+    # 历史上两套账号变量都在用：Celery 上传任务读 SFTP_USER/SFTP_PASS，
+    # utils / sftp_task 读 SFTP_USERNAME/SFTP_PASSWORD，由调用方指明，各自沿用原来的账号
+    return {
+        "host": os.getenv("SFTP_HOST"),
+        "port": int(os.getenv("SFTP_PORT", "22")),
+        "username": os.getenv(username_env),
+        "password": os.getenv(password_env),
+    }
+
+
+class SFTPSession:
+    def __init__(self, transport: paramiko.Transport, sftp: paramiko.SFTPClient):
+        self.transport = transport
+        self.sftp = sftp
+
+    def close(self):
+        for closable in (self.sftp, self.transport):
+            try:
+                closable.close()
+            except Exception:
+                pass
+
+
+class SFTPConnectionPool:
+    """
+    进程内 SFTP 连接池：
+    - 借出前检查 transport 仍然活着且已认证，失效则丢弃重连
+    - 空闲超过 idle_timeout 秒的连接直接关闭
+    - fork 之后（Celery prefork）自动丢弃父进程遗留的连接
+    """
+
+    def __init__(self, idle_timeout: int = SFTP_POOL_IDLE_TIMEOUT, keepalive: int = SFTP_KEEPALIVE,
+                 timeout: int = SFTP_CONNECT_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: dict[tuple, list[tuple[SFTPSession, float]]] = {}
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _key(sftp_config: dict) -> tuple:
+        return (sftp_config["host"], int(sftp_config["port"]), sftp_config["username"])
+
+    @staticmethod
+    def _is_alive(session: SFTPSession) -> bool:
+        transport = session.transport
+        return transport.is_active() and transport.is_authenticated()
+
+    def _connect(self, sftp_config: dict) -> SFTPSession:
+        logger.info("📁 建立新的 SFTP 连接：%s:%s (%s)", sftp_config["host"], sftp_config["port"], sftp_config["username"])
+        sock = socket.create_connection((sftp_config["host"], int(sftp_config["port"])), timeout=self.timeout)
+        transport = paramiko.Transport(sock)
+        transport.banner_timeout = self.timeout
+        transport.auth_timeout = self.timeout
+        try:
+            transport.connect(username=sftp_config["username"], password=sftp_config["password"])
+            transport.set_keepalive(self.keepalive)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+        except Exception:
+            transport.close()
+            raise
+        return SFTPSession(transport, sftp)
+
+    def _check_fork(self):
+        # 子进程不能复用父进程的 socket，直接丢弃（不 close，避免影响父进程）
+        if self._pid != os.getpid():
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def acquire(self, sftp_config: dict) -> SFTPSession:
+        key = self._key(sftp_config)
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                self._check_fork()
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                session, last_used = idle.pop()
+            if now - last_used > self.idle_timeout or not self._is_alive(session):
+                session.close()
+                continue
+            return session
+        return self._connect(sftp_config)
+
+    def release(self, sftp_config: dict, session: SFTPSession):
+        with self._lock:
+            self._check_fork()
+            self._idle.setdefault(self._key(sftp_config), []).append((session, time.monotonic()))
+        self.close_idle()
+
+    def discard(self, session: SFTPSession):
+        session.close()
+
+    @contextmanager
+    def connection(self, sftp_config: dict):
+        """借出一个已认证的 SFTP 会话；块内抛异常时会话被关闭而不是放回池中。"""
+        session = self.acquire(sftp_config)
+        try:
+            yield session.sftp
+        except Exception:
+            self.discard(session)
+            raise
+        else:
+            self.release(sftp_config, session)
+
+    def put_files(self, sftp_config: dict, files: list[tuple[str, str]]) -> list[str]:
+        """
+        在同一个会话里上传 [(本地路径, 远端路径), ...]，返回上传失败的本地路径列表，不抛异常。
+        复用的连接恰好已断开（或上传途中断开）时，换一个新连接把剩下的文件再试一次。
+        """
+        pending = list(files)
+        failed = []
+        for attempt in range(2):
+            try:
+                with self.connection(sftp_config) as sftp:
+                    while pending:
+                        local_file, remote_path = pending[0]
+                        try:
+                            sftp.put(local_file, remote_path)
+                        except (OSError, paramiko.SFTPError) as e:
+                            if not self._is_channel_error(sftp):
+                                # 本地文件缺失、远端目录不存在等：只影响这个文件
+                                logger.error("❌ SFTP 上传失败：%s -> %s，%s", local_file, remote_path, e)
+                                failed.append(local_file)
+                                pending.pop(0)
+                                continue
+                            raise
+                        logger.info("✅ SFTP 上传成功：%s", remote_path)
+                        pending.pop(0)
+                return failed
+            except (paramiko.SSHException, paramiko.SFTPError, EOFError, OSError) as e:
+                if attempt:
+                    logger.error("❌ SFTP 连接失败，放弃剩余 %s 个文件：%s", len(pending), e)
+                    return failed + [local_file for local_file, _ in pending]
+                logger.warning("⚠️ SFTP 连接已断开，重连后重试：%s", e)
+            except Exception:
+                # 与原上传函数一致：任何异常都只算上传失败，不抛给调用方
+                logger.exception("❌ SFTP 上传异常，放弃剩余 %s 个文件", len(pending))
+                return failed + [local_file for local_file, _ in pending]
+        return failed
+
+    @staticmethod
+    def _is_channel_error(sftp: paramiko.SFTPClient) -> bool:
+        channel = sftp.get_channel()
+        transport = channel.get_transport() if channel is not None else None
+        return channel is None or channel.closed or transport is None or not transport.is_active()
+
+    def close_idle(self):
+        """关闭空闲超时的连接。"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            self._check_fork()
+            for key, idle in self._idle.items():
+                keep = []
+                for session, last_used in idle:
+                    (expired if now - last_used > self.idle_timeout else keep).append((session, last_used))
+                self._idle[key] = keep
+        for session, _ in expired:
+            session.close()
+
+    def close_all(self):
+        with self._lock:
+            self._check_fork()
+            idle, self._idle = self._idle, {}
+        for sessions in idle.values():
+            for session, _ in sessions:
+                session.close()
+
+
+sftp_pool = SFTPConnectionPool()
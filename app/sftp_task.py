@@ -7,6 +7,7 @@ from celery import Celery
 load_dotenv()
 
 from app.main_celery import celery  # 根据你的项目结构调整导入
+from app.sftp_pool import sftp_pool, sftp_config_from_env
 
 def ensure_remote_dir(sftp: paramiko.SFTPClient, remote_dir: str):
     dirs = remote_dir.strip("/").split("/")
@@ -23,30 +24,20 @@ def upload_file_to_sftp_task(local_file: str, remote_filename: str) -> bool:
     """
     异步上传文件到 SFTP，remote_filename 是文件名（会放在根目录或你定义的子目录中）
     """
-    host = os.getenv("SFTP_HOST")
-    port = int(os.getenv("SFTP_PORT", "22"))
-    username = os.getenv("SFTP_USERNAME")
-    password = os.getenv("SFTP_PASSWORD")
-
     remote_path = f"财务部/中港模式结算单/{remote_filename}"  # 你可以灵活改成传参
+    sftp_config = sftp_config_from_env("SFTP_USERNAME", "SFTP_PASSWORD")
 
     try:
-        transport = paramiko.Transport((host, port))
-        transport.connect(username=username, password=password)
-        print("✅ 连接成功")
-
-        sftp = paramiko.SFTPClient.from_transport(transport)
-
-        remote_dir = os.path.dirname(remote_path)
-        ensure_remote_dir(sftp, remote_dir)
-
-        sftp.put(local_file, remote_path)
-        print(f"✅ 文件上传成功：{remote_path}")
-
-        sftp.close()
-        transport.close()
-        return True
-
+        # 复用进程内连接池里已认证的会话，只在需要时建目录
+        with sftp_pool.connection(sftp_config) as sftp:
+            remote_dir = os.path.dirname(remote_path)
+            ensure_remote_dir(sftp, remote_dir)
     except Exception as e:
         print("❌ 上传失败:", str(e))
-        return False
\ No newline at end of file
+        return False
+
+    if sftp_pool.put_files(sftp_config, [(local_file, remote_path)]):
+        print("❌ 上传失败:", local_file)
+        return False
+    print(f"✅ 文件上传成功：{remote_path}")
+    return True
@@ -4,29 +4,20 @@ from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
 
 from app import models, email_utils
+from app.company_directory import CompanyProfile, company_directory, invalidate_companies
 
 from app.log_config import setup_logger
 
 logger = setup_logger(__name__)
 
-# 统一把 CompanyInfo 转成 SMTP 配置
-def smtp_from_company(c: "models.CompanyInfo") -> Dict[str, Any]:
-    return {
-        "host": c.smtp_host,
-        "port": c.smtp_port,
-        "username": c.smtp_username,
-        "password": c.smtp_password,
-        "from": c.smtp_from,
-    }
+# 统一把公司信息转成 SMTP 配置
+def smtp_from_company(c: CompanyProfile) -> Dict[str, Any]:
+    return c.smtp_config
 
 # 按公司简称+类型拿公司（不存在就报错日志并返回 None）
-def get_company_by_short(db: Session, short_name: str, company_type: str) -> Optional["models.CompanyInfo"]:
-    company = (
-        db.query(models.CompanyInfo)
-        .filter(models.CompanyInfo.short_name == short_name,
-                models.CompanyInfo.company_type == company_type)
-        .first()
-    )
+def get_company_by_short(db: Session, short_name: str, company_type: str) -> Optional[CompanyProfile]:
+    # 走进程内公司缓存；db 参数保留以兼容现有调用
+    company = company_directory.get_by_short(short_name, company_type)
     if not company:
         logger.error("未找到公司：short=%s, type=%s", short_name, company_type)
     return company
@@ -40,7 +31,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from app import models, email_utils
 
-def update_D_company_by_alias(db: Session, alias: str) -> models.CompanyInfo:
+def update_D_company_by_alias(db: Session, alias: str) -> CompanyProfile:
     # 1) 选中要更新的 D 公司（你现在逻辑写死 PR，如需按 alias 选择可改 filter）
     company = (
         db.query(models.CompanyInfo)
@@ -81,9 +72,11 @@ def update_D_company_by_alias(db: Session, alias: str) -> models.CompanyInfo:
         raise ValueError(f"别名 {alias} 的发信配置缺失字段：{', '.join(missing)}")
 
     # 5) 仅在值变化时赋值，减少无谓 UPDATE
+    changed = False
     for k, v in new_values.items():
         if getattr(company, k, None) != v:
             setattr(company, k, v)
+            changed = True
 
     # 6) 事务提交（失败回滚）
     try:
@@ -93,6 +86,10 @@ def update_D_company_by_alias(db: Session, alias: str) -> models.CompanyInfo:
         db.rollback()
         raise
 
+    # 发信账号切换后通知各进程的公司缓存重载
+    if changed:
+        invalidate_companies()
+
     # 7) 刷新得到数据库中的最新值
     db.refresh(company)
 
@@ -107,16 +104,13 @@ def update_D_company_by_alias(db: Session, alias: str) -> models.CompanyInfo:
         # "smtp_password": "******"
     })
 
-    return company
+    return CompanyProfile.from_orm(company)
 
 
 
 # 按公司名（可选限定类型）拿公司
-def get_company_by_name(db: Session, company_name: str, company_type: Optional[str] = None) -> Optional["models.CompanyInfo"]:
-    q = db.query(models.CompanyInfo).filter(models.CompanyInfo.company_name == company_name)
-    if company_type:
-        q = q.filter(models.CompanyInfo.company_type == company_type)
-    company = q.first()
+def get_company_by_name(db: Session, company_name: str, company_type: Optional[str] = None) -> Optional[CompanyProfile]:
+    company = company_directory.get_by_name(company_name, company_type)
     if not company:
         logger.error("未找到公司：name=%s, type=%s", company_name, company_type or "*")
     return company
@@ -128,22 +122,15 @@ def render_invitation(
     template_name: str,
     buyer_name: Optional[str] = None,
     full_name: Optional[str] = None,      # 正文称呼
-    signer_company: "models.CompanyInfo", # 落款公司（是谁发这封邮件）
+    signer_company: CompanyProfile,       # 落款公司（是谁发这封邮件）
 ) -> str:
     return email_utils.render_invitation_template_content(
         buyer_name=buyer_name,
         project_name=project_name,
         template_name=template_name,
-        # 发送人落款信息（签名信息统一从 signer_company 带出）
-        contact_person=signer_company.contact_person,
-        company_name=signer_company.company_name,
         full_name=full_name or signer_company.contact_person,
-        phone=signer_company.phone,
-        email=signer_company.email,
-        address=signer_company.address,
-        english_address=signer_company.english_address,
-        pingyin=getattr(signer_company, "pingyin", None),   # 与现有模板字段保持一致
-        company_en=signer_company.company_en,
+        # 发送人落款信息（签名信息统一从 signer_company 带出）
+        **signer_company.signature,
     )
 
 # 组装通用 Celery 任务字典
@@ -174,8 +161,8 @@ def normalize_company_name(name: str) -> str:
 # A2：使用 B 公司 SMTP，模板按 B 的短名切换
 def make_a2_task_for_target_d(
     *,
-    b_company: models.CompanyInfo,
-    target_d: models.CompanyInfo,
+    b_company: CompanyProfile,
+    target_d: CompanyProfile,
     project_name: str,
     serial_number: str,       # 对应 F/L/P 号
     delay_minutes: int,       # 你原来是 randint(5, max_sending_time)
@@ -206,8 +193,8 @@ def make_a2_task_for_target_d(
 # A1：由 D 公司发，收件人固定是 B 公司
 def make_a1_task_from_d_to_b(
     *,
-    d_company: models.CompanyInfo,
-    b_company: models.CompanyInfo,
+    d_company: CompanyProfile,
+    b_company: CompanyProfile,
     subject: str,
     template_name: str,
     buyer_name: str,
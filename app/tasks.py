@@ -13,8 +13,13 @@ from typing import List, Optional, Union, Iterable
 import paramiko
 
 from celery import Celery, Task
+from celery.signals import worker_process_init, worker_process_shutdown
 from celery.exceptions import MaxRetriesExceededError
-from app import email_utils, models
+from app import email_utils, email_chains, send_ledger
+from app import yida_writer
+from app.email_record_writer import get_email_record_writer, close_email_record_writer
+from app.company_directory import company_directory
+from app.sftp_pool import sftp_pool, sftp_config_from_env
 
 import logging
 
@@ -51,11 +56,79 @@ celery.conf.update(
     },
 )
 
+@worker_process_init.connect
+def _warm_up_worker(**kwargs):
+    # 每个子进程启动时预编译邮件模板、载入标题模板，首个任务不再承担这些开销
+    email_utils.warm_up_templates()
+    try:
+        email_utils.email_subject_cache.load()
+    except Exception:
+        logger.exception("❌ 邮件标题模板预载失败，将在首次使用时重试")
+    try:
+        company_directory.load()
+    except Exception:
+        logger.exception("❌ 公司信息预载失败，将在首次使用时重试")
+
+
+@worker_process_shutdown.connect
+def _close_smtp_pool(**kwargs):
+    # 子进程退出时礼貌地 QUIT 掉池中的 SMTP / SFTP 连接，并写完积压的发送记录
+    email_utils.smtp_pool.close_all()
+    sftp_pool.close_all()
+    close_email_record_writer()
+
+
 class EmailSendFailed(Exception):
     """自定义异常：表示邮件逻辑上发送失败"""
     pass
 
 
+def _record_email(record: dict, success: bool, error: str, actual_sending_time: Optional[datetime] = None):
+    """发送记录交给本进程的批量写入器，不在发送路径上单独开会话、提交。"""
+    get_email_record_writer().add(dict(
+        record,
+        status="success" if success else "failed",
+        error_message=error if not success else None,
+        actual_sending_time=actual_sending_time or datetime.now(),
+    ))
+
+
+def _send_once(
+    db, message_key: str, owner: str, stage: str, to_email: str, send, record: Optional[dict] = None
+) -> tuple[Optional[bool], str]:
+    """
+    按发送台账最多发送一次：send() 返回 (success, error)。
+    已经发送过的直接视为成功；其他任务正在发送同一封邮件时返回 (None, ...)，调用方应直接结束。
+    传入 record 时，每次实际的 SMTP 发送都写一条发送记录（台账跳过的不写）。
+    """
+    state = send_ledger.claim(db, message_key, owner=owner, stage=stage, to_email=to_email)
+    if state == send_ledger.ALREADY_SENT:
+        logger.info(f"[{stage}] ⏭️ 发送台账显示该邮件已发送，跳过 SMTP")
+        return True, ""
+    if state == send_ledger.IN_PROGRESS:
+        logger.warning(f"[{stage}] ⏭️ 其他任务正在发送该邮件，本次跳过")
+        return None, "其他任务正在发送"
+
+    success, error = send()
+    if record is not None:
+        _record_email(record, success, error)
+    if success:
+        send_ledger.mark_sent(db, message_key)
+    else:
+        send_ledger.release(db, message_key)
+    return success, error
+
+
+def _claim_followup(db, task_id: str, stage: str) -> Optional[str]:
+    """认领“调度 followup”这一动作；已经调度过返回 None，否则返回台账 key，调度成功后需 mark_sent。"""
+    followup_key = send_ledger.make_message_key("task", task_id, "followup")
+    if send_ledger.claim(db, followup_key, owner=task_id, stage=stage) != send_ledger.CLAIMED:
+        logger.info(f"[{stage}] ⏭️ followup 已调度过，跳过")
+        return None
+    return followup_key
+
+
+
 def _normalize_cc(cc: Optional[Union[str, Iterable[str]]]) -> List[str]:
     """
     将 cc 归一化为字符串列表：
@@ -84,10 +157,7 @@ def send_sync_email(to_email, subject, content, smtp_config):
     msg["Subject"] = subject
 
     try:
-        server = smtplib.SMTP_SSL(smtp_config["host"], smtp_config["port"])
-        server.login(smtp_config["username"], smtp_config["password"])
-        server.sendmail(smtp_config["from"], [to_email], msg.as_string())
-        server.quit()
+        email_utils.smtp_pool.sendmail(smtp_config, smtp_config["from"], [to_email], msg.as_string())
         return True, ""
     except Exception as e:
         return False, str(e)
@@ -95,9 +165,6 @@ def send_sync_email(to_email, subject, content, smtp_config):
 
 @celery.task(bind=True, max_retries=3, default_retry_delay=60)
 def send_reply_email(self, to_email: str, subject: str, content: str, smtp_config: dict, delay: int, stage: str, project_id: int):
-    from app import database
-    db = database.SessionLocal()
-
     # 当前时间 + delay 秒 = 实际发送时间
     scheduled_time = datetime.now() + timedelta(seconds=delay)
     try:
@@ -107,24 +174,13 @@ def send_reply_email(self, to_email: str, subject: str, content: str, smtp_confi
         success = False
         error = str(e)
         print(f"[邮件发送异常] to={to_email}, subject={subject}, error={error}")
-    
-    try:
-        # 需要更新这个邮件发送记录
-        record = models.EmailRecord(
-            to=to_email,
-            subject=subject,
-            body=content,
-            status="success" if success else "failed",
-            error_message=error if not success else None,
-            actual_sending_time=scheduled_time,
-            stage=stage,
-            project_id=project_id
-        )
-        db.add(record)
-        db.commit()
-        db.refresh(record)
-    finally:
-        db.close()
+
+    # 需要更新这个邮件发送记录
+    _record_email(
+        {"to": to_email, "subject": subject, "body": content, "stage": stage,
+         "project_id": project_id, "task_id": self.request.id},
+        success, error, actual_sending_time=scheduled_time,
+    )
     return {"success": success, "error": error}
 
 
@@ -148,21 +204,13 @@ def send_email_with_followup(
         logger.info(f"[{stage}] 🚀 发送邮件任务开始，to={to_email}")
         
         success, error = email_utils.send_email(to_email, subject, content, smtp_config, stage)
-        scheduled_time = datetime.now()
 
         # 保存发送记录
-        record = models.EmailRecord(
-            to=to_email,
-            subject=subject,
-            body=content,
-            status="success" if success else "failed",
-            error_message=error if not success else None,
-            actual_sending_time=scheduled_time,
-            stage=stage,
-            project_id=project_id
+        _record_email(
+            {"to": to_email, "subject": subject, "body": content, "stage": stage,
+             "project_id": project_id, "task_id": self.request.id},
+            success, error,
         )
-        db.add(record)
-        db.commit()
 
         if not success:
             logger.warning(f"[{stage}] ❌ 邮件发送失败，将重试：{error}")
@@ -216,17 +264,27 @@ def send_email_with_followup_delay(
         logger.info(f"[{stage}] 🚀 发送邮件任务开始，to={to_email}")
         cc_list = _normalize_cc(cc)
         logger.info(f"[{stage}] 🚀 发送邮件任务开始，to={to_email}, cc={cc_list or '[]'}")
-        
-        success, error = email_utils.send_email(to_email, subject, content, smtp_config, stage, cc=cc_list)
+
+        # 同一个任务 ID 的重试 / 重新投递共用一条台账，已发出的邮件不再重发
+        task_id = self.request.id
+        success, error = _send_once(
+            db, send_ledger.make_message_key("task", task_id), task_id, stage, to_email,
+            lambda: email_utils.send_email(to_email, subject, content, smtp_config, stage, cc=cc_list),
+            record={"to": to_email, "subject": subject, "body": content, "stage": stage, "task_id": task_id},
+        )
+        if success is None:
+            return
         scheduled_time = datetime.now()
 
         if not success:
             logger.warning(f"[{stage}] ❌ 邮件发送失败，将重试：{error}")
             raise EmailSendFailed(error)
 
-        # 如果成功且有后续任务，调度之
-        if followup_task_args:
-            # 从 followup_task_args 中提取自己的 delay，不用 A1 的
+        # 如果成功且有后续任务，调度之（重试时不会重复调度）
+        followup_key = _claim_followup(db, task_id, stage) if followup_task_args else None
+        if followup_key:
+            # 从 followup_task_args 中提取自己的 delay，不用 A1 的；复制一份，避免改动重试时复用的参数
+            followup_task_args = dict(followup_task_args)
             next_delay = followup_task_args.pop("followup_delay", 60)
             logger.info(
                 f"[{stage}] 🕐 调度 followup 任务（下一阶段 {followup_task_args.get('stage')}），延迟 {next_delay} 秒"
@@ -235,6 +293,7 @@ def send_email_with_followup_delay(
                 kwargs=followup_task_args,
                 countdown=next_delay
             )
+            send_ledger.mark_sent(db, followup_key)
 
         logger.info(f"[{stage}] ✅ 邮件发送任务成功完成")
     except EmailSendFailed as e:
@@ -282,19 +341,11 @@ def send_reply_email_with_attachments(
         )
 
         # 保存记录
-        record = models.EmailRecord(
-            to=to_email,
-            subject=subject,
-            body=content,
-            status="success" if success else "failed",
-            error_message=error if not success else None,
-            actual_sending_time=datetime.now(),
-            stage=stage,
-            project_id=project_id
+        _record_email(
+            {"to": to_email, "subject": subject, "body": content, "stage": stage,
+             "project_id": project_id, "task_id": self.request.id},
+            success, error,
         )
-        db.add(record)
-        db.commit()
-        db.refresh(record)
 
         if not success:
             logger.warning(f"[{stage}] ❌ 带附件邮件发送失败，将重试：{error}")
@@ -370,9 +421,17 @@ def send_reply_email_with_attachments_delay(
         logger.info("=" * 60)
 
         logger.info(f"[{stage}] 📧 开始发送邮件...")
-        success, error = email_utils.send_email_with_attachments(
-            to_email, subject, content, smtp_config, attachments, stage, cc=cc
+        # 同一个任务 ID 的重试 / 重新投递共用一条台账，已发出的邮件不再重发
+        success, error = _send_once(
+            db, send_ledger.make_message_key("task", task_id), task_id, stage, to_email,
+            lambda: email_utils.send_email_with_attachments(
+                to_email, subject, content, smtp_config, attachments, stage, cc=cc
+            ),
+            record={"to": to_email, "subject": subject, "body": content, "stage": stage,
+                    "project_id": project_id, "task_id": task_id},
         )
+        if success is None:
+            return {"success": False, "error": error}
 
         if not success:
             logger.warning(f"[{stage}] ❌ 带附件邮件发送失败，将重试：{error}")
@@ -380,10 +439,12 @@ def send_reply_email_with_attachments_delay(
             raise EmailSendFailed(error)
 
         logger.info(f"[{stage}] ✅ SMTP 邮件发送成功！")
-        logger.info(f"[{stage}] ✅ 钉钉表单创建成功！")
+        logger.info(f"[{stage}] ✅ 钉钉表单记录已入队！")
 
-        # 调度后续任务（若有）
-        if followup_task_args:
+        # 调度后续任务（若有；重试时不会重复调度）
+        followup_key = _claim_followup(db, task_id, stage) if followup_task_args else None
+        if followup_key:
+            followup_task_args = dict(followup_task_args)
             logger.info(f"[{stage}] 🔍 检测到后续任务，准备调度...")
             logger.info(f"[{stage}] 🔍 followup_task_args类型: {type(followup_task_args)}")
             logger.info(f"[{stage}] 🔍 followup_task_args内容: {followup_task_args}")
@@ -412,11 +473,13 @@ def send_reply_email_with_attachments_delay(
                     countdown=next_delay
                 )
                 logger.info(f"[{stage}] ✅ 后续任务 {next_stage} 调度成功！Task ID: {result.id}")
+                send_ledger.mark_sent(db, followup_key)
             except Exception as e:
+                send_ledger.release(db, followup_key)
                 logger.error(f"[{stage}] ❌ 调度后续任务失败：{e}")
                 logger.exception(f"[{stage}] 详细错误信息：")
                 logger.error(f"[{stage}] ⚠️ 注意：后续任务调度失败，但当前任务将继续完成")
-        else:
+        elif not followup_task_args:
             logger.info(f"[{stage}] ℹ️ 无后续任务，流程结束")
 
         logger.info("=" * 60)
@@ -464,6 +527,193 @@ def send_reply_email_with_attachments_delay(
         db.close()
 
 
+# 邮件对话链：步骤内容存在 email_chain_steps 表，消息只带 (chain_id, step_index)；
+# 需要等待的步骤由 release_due_email_steps 到点投递，Redis 里不压带 countdown 的消息
+def start_email_chain(root_task: dict, countdown: int = 0) -> str:
+    """保存嵌套的任务字典，返回 chain_id；不需要等待的第一步立即投递。"""
+    chain_id = email_chains.create_email_chain(root_task, start_delay=countdown)
+    if countdown <= 0:
+        send_email_chain_step.apply_async(args=(chain_id, 0))
+    return chain_id
+
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60)
+def send_email_chain_step(self, chain_id: str, step_index: int):
+    from app import database
+    db = database.SessionLocal()
+    stage = f"{chain_id}#{step_index}"
+
+    try:
+        step = email_chains.load_chain_step(db, chain_id, step_index)
+        if step is None:
+            logger.error(f"[{stage}] ❌ 邮件链步骤不存在，跳过")
+            return {"success": False, "error": "chain step not found"}
+        stage = step.stage
+
+        logger.info(f"[{stage}] 🚀 邮件链步骤开始，chain={chain_id}, step={step_index}, to={step.to_email}, cc={step.cc or '[]'}")
+
+        def send():
+            if step.attachments is None:
+                return email_utils.send_email(
+                    step.to_email, step.subject, step.content, step.smtp_config, step.stage, cc=step.cc
+                )
+            return email_utils.send_email_with_attachments(
+                step.to_email, step.subject, step.content, step.smtp_config, step.attachments, step.stage, cc=step.cc
+            )
+
+        # 台账按 (chain_id, step_index) 去重：重试、重新投递、调度器重新取出都不会重发
+        success, error = _send_once(
+            db, send_ledger.make_message_key("chain", chain_id, step_index), self.request.id,
+            stage, step.to_email, send,
+            record={"to": step.to_email, "subject": step.subject, "body": step.content, "stage": stage,
+                    "task_id": self.request.id},
+        )
+        if success is None:
+            return {"success": False, "error": error}
+
+        if not success:
+            logger.warning(f"[{stage}] ❌ 邮件发送失败，将重试：{error}")
+            raise EmailSendFailed(error)
+
+        # 本步标记已发送，下一步（若有）定好发送时间，由调度器到点投递
+        next_step = email_chains.advance_chain(db, chain_id, step_index)
+        if next_step is not None:
+            logger.info(f"[{stage}] 🕐 下一步 {next_step.stage} 计划于 {next_step.due_at} 发送（延迟 {next_step.delay} 秒）")
+        else:
+            logger.info(f"[{stage}] ℹ️ 邮件链结束")
+
+        logger.info(f"[{stage}] ✅ 邮件链步骤完成")
+        return {"success": True, "error": ""}
+    except EmailSendFailed as e:
+        try:
+            raise self.retry(exc=e)
+        except MaxRetriesExceededError:
+            logger.error(f"[{stage}] 达到最大重试次数（逻辑失败）：{e}")
+            _mark_chain_step_failed(db, chain_id, step_index)
+            return {"success": False, "error": str(e)}
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"[{stage}] ❌ 邮件链步骤异常，将重试：{e}")
+        try:
+            raise self.retry(exc=e)
+        except MaxRetriesExceededError:
+            logger.error(f"[{stage}] 达到最大重试次数（系统异常）：{e}")
+            _mark_chain_step_failed(db, chain_id, step_index)
+            return {"success": False, "error": str(e)}
+    finally:
+        db.close()
+
+
+def _mark_chain_step_failed(db, chain_id: str, step_index: int):
+    try:
+        email_chains.mark_step_failed(db, chain_id, step_index)
+    except Exception:
+        db.rollback()
+        logger.exception(f"❌ 标记邮件链步骤失败状态出错 chain={chain_id}, step={step_index}")
+
+
+EMAIL_SCHEDULER_INTERVAL = float(os.getenv("EMAIL_SCHEDULER_INTERVAL", "30"))       # 调度器轮询间隔（秒）
+EMAIL_SCHEDULER_MAX_BATCHES = int(os.getenv("EMAIL_SCHEDULER_MAX_BATCHES", "20"))   # 单次轮询最多投递的批数
+
+
+@celery.task
+def release_due_email_steps() -> int:
+    """把到点的邮件链步骤分批投递给 worker，返回本次投递的步骤数。"""
+    from app import database
+
+    released = 0
+    for _ in range(EMAIL_SCHEDULER_MAX_BATCHES):
+        db = database.SessionLocal()
+        try:
+            due = email_chains.claim_due_steps(db)
+        finally:
+            db.close()
+
+        for chain_id, step_index in due:
+            try:
+                send_email_chain_step.apply_async(args=(chain_id, step_index))
+                released += 1
+            except Exception:
+                # 步骤保持 queued，超过 EMAIL_SCHEDULER_STUCK_AFTER 后会被重新取出
+                logger.exception(f"❌ 投递邮件链步骤失败 chain={chain_id}, step={step_index}")
+
+        if len(due) < email_chains.EMAIL_SCHEDULER_BATCH_SIZE:
+            break
+
+    if released:
+        logger.info(f"📬 调度器投递邮件链步骤 {released} 个")
+    return released
+
+
+# 宜搭邮件记录：发送成功后写入 email_audit_outbox，由 beat 定时按批用 batchSave 写入宜搭；
+# 确定失败的批次下次再试，结果不确定的批次不重发，不会导致邮件重发或重复记录
+@celery.task
+def flush_email_audit_records() -> int:
+    return yida_writer.flush_email_audit_outbox()
+
+
+# 兼容升级前已入队的消息：落到 outbox，由定时任务写入
+@celery.task
+def create_email_audit_record(form_data: dict):
+    yida_writer.enqueue_email_audit(form_data)
+
+
+celery.conf.beat_schedule = {
+    "release-due-email-steps": {
+        "task": release_due_email_steps.name,
+        "schedule": EMAIL_SCHEDULER_INTERVAL,
+    },
+    "flush-email-audit-records": {
+        "task": flush_email_audit_records.name,
+        "schedule": yida_writer.YIDA_FLUSH_INTERVAL,
+    },
+}
+
+
+# 批量异步发送：一个任务内用 aiosmtplib 并发发出多封互不依赖的邮件。
+# 每封邮件按 (任务 ID, 序号) 在发送台账认领，任务重试或消息被重新投递时已发出的不会再发、也不会重复写发送记录
+@celery.task
+def send_emails_async_batch(jobs: list[dict]) -> list[dict]:
+    from app import async_email, database
+
+    task_id = send_emails_async_batch.request.id
+    keys = [send_ledger.make_message_key("task", task_id, "job", index) for index in range(len(jobs))]
+    results: list[dict] = [{}] * len(jobs)
+
+    db = database.SessionLocal()
+    try:
+        claimed = []
+        for index, job in enumerate(jobs):
+            state = send_ledger.claim(db, keys[index], owner=task_id, stage=job.get("stage"), to_email=job["to_email"])
+            if state == send_ledger.CLAIMED:
+                claimed.append(index)
+            elif state == send_ledger.ALREADY_SENT:
+                results[index] = {"success": True, "error": ""}
+            else:
+                results[index] = {"success": None, "error": "其他任务正在发送"}
+
+        logger.info(f"📨 异步批量发送开始，共 {len(jobs)} 封，本次发送 {len(claimed)} 封")
+        sent = async_email.send_many([jobs[index] for index in claimed])
+        for index, (success, error) in zip(claimed, sent):
+            job = jobs[index]
+            _record_email(
+                {"to": job["to_email"], "subject": job.get("subject"), "body": job.get("content"),
+                 "stage": job.get("stage"), "task_id": task_id},
+                success, error,
+            )
+            if success:
+                send_ledger.mark_sent(db, keys[index])
+            else:
+                send_ledger.release(db, keys[index])
+            results[index] = {"success": success, "error": error}
+    finally:
+        db.close()
+
+    failed = sum(1 for result in results if result["success"] is False)
+    logger.info(f"📨 异步批量发送完成，成功 {len(results) - failed} 封，失败 {failed} 封")
+    return results
+
+
 def ensure_remote_dir(sftp: paramiko.SFTPClient, remote_dir: str):
     dirs = remote_dir.strip("/").split("/")
     current = ""
@@ -474,41 +724,34 @@ def ensure_remote_dir(sftp: paramiko.SFTPClient, remote_dir: str):
         except FileNotFoundError:
             sftp.mkdir(current)
 
+SFTP_SETTLEMENT_DIR = os.getenv("SFTP_SETTLEMENT_DIR", "财务部/中港模式结算单")
+
+
 @celery.task(bind=True, max_retries=3, default_retry_delay=60)
-def upload_file_to_sftp_task(self, local_file: str, filename: str) -> bool:
+def upload_files_to_sftp_task(self, files: list[tuple[str, str]]) -> bool:
     """
-    异步上传文件到 SFTP，remote_filename 是文件名（会放在根目录或你定义的子目录中）
+    把一个项目的多个结算单 [(本地文件, 文件名), ...] 通过同一个复用的 SFTP 会话上传到归档目录
     """
-    host = os.getenv("SFTP_HOST")
-    port = int(os.getenv("SFTP_PORT", "22"))
-    username = os.getenv("SFTP_USER")
-    password = os.getenv("SFTP_PASS")
-    REMOTE_PATH = os.getenv("REMOTE_PATH")
-
-    remote_path = f"财务部/中港模式结算单/{filename}"  # 你可以灵活改成传参
-
-    local_file_path = os.path.expanduser(local_file)
-
-    print("📂 上传文件：", local_file_path)
-    print("📁 目标路径：", REMOTE_PATH + filename)
-
-    try:
-        transport = paramiko.Transport((host, port))
-        transport.connect(username=username, password=password)
-        print("✅ 连接成功")
-
-        sftp = paramiko.SFTPClient.from_transport(transport)
+    uploads = [
+        (os.path.expanduser(local_file), f"{SFTP_SETTLEMENT_DIR}/{filename}") for local_file, filename in files
+    ]
+    for local_file, remote_path in uploads:
+        print("📂 上传文件：", local_file, "📁 目标路径：", remote_path)
 
-        sftp.put(local_file_path, remote_path)
-        print(f"✅ 文件上传成功：{remote_path}")
+    failed = sftp_pool.put_files(sftp_config_from_env("SFTP_USER", "SFTP_PASS"), uploads)
+    if failed:
+        print("❌ 上传失败:", failed)
+        return False
+    print(f"✅ 文件上传成功：{len(uploads)} 个")
+    return True
 
-        sftp.close()
-        transport.close()
-        return True
 
-    except Exception as e:
-        print("❌ 上传失败:", str(e))
-        return False
+@celery.task(bind=True, max_retries=3, default_retry_delay=60)
+def upload_file_to_sftp_task(self, local_file: str, filename: str) -> bool:
+    """
+    异步上传文件到 SFTP，remote_filename 是文件名（会放在根目录或你定义的子目录中）
+    """
+    return upload_files_to_sftp_task([(local_file, filename)])
 
 
 @celery.task(bind=True, max_retries=3, default_retry_delay=60)
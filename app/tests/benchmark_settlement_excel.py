@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Settlement Excel Benchmark
+
+对比结算单生成的旧实现（逐格新建样式、apply_border 循环）与 excel_utils.render_settlement_workbook（模块级共享样式对象），
+输出每张结算单的构建 / 保存耗时和内存分配峰值。
+Run with: python -m app.tests.benchmark_settlement_excel -n 200
+"""
+import argparse
+import io
+import statistics
+import time
+import tracemalloc
+
+from app import excel_utils
+from app.tests.test_excel_utils import RECEIVABLE_ITEMS, legacy_settlement_workbook
+
+
+def measure(build, rounds: int) -> dict:
+    build_times, save_times = [], []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        wb = build(1234567.89, RECEIVABLE_ITEMS, "深圳某某采购有限公司", "香港某某贸易有限公司")
+        built = time.perf_counter()
+        wb.save(io.BytesIO())
+        build_times.append(built - start)
+        save_times.append(time.perf_counter() - built)
+
+    tracemalloc.start()
+    build(1234567.89, RECEIVABLE_ITEMS, "深圳某某采购有限公司", "香港某某贸易有限公司").save(io.BytesIO())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "build_ms": statistics.mean(build_times) * 1000,
+        "save_ms": statistics.mean(save_times) * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="结算单生成基准测试")
+    parser.add_argument("-n", "--rounds", type=int, default=200, help="每种实现生成的结算单数量")
+    args = parser.parse_args()
+
+    results = {
+        "legacy": measure(legacy_settlement_workbook, args.rounds),
+        "shared styles": measure(excel_utils.render_settlement_workbook, args.rounds),
+    }
+    print(f"{'实现':<16}{'构建 ms/张':>12}{'保存 ms/张':>12}{'合计 ms/张':>12}{'内存峰值 KiB':>14}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['build_ms']:>12.2f}{r['save_ms']:>12.2f}{r['build_ms'] + r['save_ms']:>12.2f}{r['peak_kib']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+API Load Test Script
+
+并发压测 FastAPI 接口，输出吞吐量和延迟分布，用于对比接口改为线程池执行前后的效果。
+Run with: python app/tests/load_test.py --url http://127.0.0.1:8000/ping-db -n 500 -c 50
+
+POST 接口可以通过 --payload 传入 JSON 文件（注意业务接口会真实写库、发邮件，只在测试环境压测）。
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+async def run_load_test(url: str, total: int, concurrency: int, payload: dict | None, timeout: float) -> dict:
+    """按给定并发数发出 total 个请求，返回统计结果。"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    status_counts = {}
+    errors = 0
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async def one_request():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    if payload is None:
+                        resp = await client.get(url)
+                    else:
+                        resp = await client.post(url, json=payload)
+                    status_counts[resp.status_code] = status_counts.get(resp.status_code, 0) + 1
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    result = {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "status": status_counts,
+        "errors": errors,
+    }
+    if latencies:
+        latencies.sort()
+        result["p50_ms"] = statistics.median(latencies) * 1000
+        result["p95_ms"] = latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0] * 1000
+        result["max_ms"] = latencies[-1] * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastAPI 接口并发压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/ping-db")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--payload", help="POST 请求体 JSON 文件路径，不传则发 GET")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    payload = None
+    if args.payload:
+        with open(args.payload, encoding="utf-8") as f:
+            payload = json.load(f)
+
+    result = asyncio.run(run_load_test(args.url, args.requests, args.concurrency, payload, args.timeout))
+
+    print(f"\n{'='*60}")
+    print(f"URL: {args.url}")
+    print(f"{'='*60}")
+    print(f"请求数: {result['requests']}  并发: {result['concurrency']}")
+    print(f"总耗时: {result['elapsed']:.2f}s  吞吐量: {result['throughput']:.1f} req/s")
+    print(f"状态码: {result['status']}  连接错误: {result['errors']}")
+    if "p50_ms" in result:
+        print(f"延迟 p50: {result['p50_ms']:.1f}ms  p95: {result['p95_ms']:.1f}ms  max: {result['max_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import asyncio
+import socket
+import time
+import unittest
+from unittest import mock
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from app import async_email
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class RecordingHandler:
+    """本地 SMTP 服务：记录收到的邮件，并统计同时在处理 DATA 的会话数。"""
+
+    def __init__(self, data_delay: float = 0.0):
+        self.messages = []
+        self.data_delay = data_delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.data_delay)
+            self.messages.append(envelope)
+        finally:
+            self.in_flight -= 1
+        return "250 Message accepted for delivery"
+
+
+def _accept_all(server, session, envelope, mechanism, auth_data):
+    return AuthResult(success=True)
+
+
+class TestAsyncEmailSender(unittest.IsolatedAsyncioTestCase):
+    def start_server(self, handler):
+        port = _free_port()
+        controller = Controller(
+            handler, hostname="127.0.0.1", port=port,
+            authenticator=_accept_all, auth_require_tls=False,
+        )
+        controller.start()
+        self.addCleanup(controller.stop)
+        return {
+            "host": "127.0.0.1",
+            "port": port,
+            "username": "sender@example.com",
+            "password": "secret",
+            "from": "sender@example.com",
+            "use_tls": False,
+            "start_tls": False,
+        }
+
+    def setUp(self):
+        patcher = mock.patch.object(async_email, "audit_sent_email")
+        self.audit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_send_with_cc(self):
+        handler = RecordingHandler()
+        smtp_config = self.start_server(handler)
+
+        success, error = await async_email.AsyncEmailSender().send(
+            to_email="to@example.com", subject="主题", content="<p>正文</p>",
+            smtp_config=smtp_config, stage="C7", cc="cc1@example.com; cc2@example.com",
+        )
+
+        self.assertTrue(success, error)
+        self.assertEqual(len(handler.messages), 1)
+        self.assertEqual(handler.messages[0].rcpt_tos, ["to@example.com", "cc1@example.com", "cc2@example.com"])
+        self.audit.assert_called_once()
+
+    async def test_send_many_respects_per_host_limit(self):
+        handler = RecordingHandler(data_delay=0.05)
+        smtp_config = self.start_server(handler)
+        jobs = [
+            {"to_email": f"to{i}@example.com", "subject": f"S{i}", "content": "<p>x</p>",
+             "smtp_config": smtp_config, "stage": "C8"}
+            for i in range(12)
+        ]
+
+        start = time.perf_counter()
+        results = await async_email.AsyncEmailSender(per_host_limit=4).send_many(jobs)
+        elapsed = time.perf_counter() - start
+
+        self.assertTrue(all(success for success, _ in results))
+        self.assertEqual(len(handler.messages), 12)
+        self.assertLessEqual(handler.max_in_flight, 4)
+        self.assertGreater(handler.max_in_flight, 1)
+        # 串行至少需要 12 * 0.05 秒
+        self.assertLess(elapsed, 12 * 0.05)
+
+    async def test_missing_attachment_is_reported(self):
+        smtp_config = self.start_server(RecordingHandler())
+        success, error = await async_email.AsyncEmailSender().send(
+            to_email="to@example.com", subject="S", content="<p>x</p>",
+            smtp_config=smtp_config, stage="C7", attachments=["/nonexistent/结算单.xlsx"],
+        )
+        self.assertFalse(success)
+        self.assertIn("附件读取失败", error)
+        self.audit.assert_not_called()
+
+    async def test_connection_failure_is_reported(self):
+        smtp_config = {
+            "host": "127.0.0.1", "port": _free_port(), "username": "u", "password": "p",
+            "from": "sender@example.com", "use_tls": False, "start_tls": False,
+        }
+        success, error = await async_email.AsyncEmailSender(timeout=2).send(
+            to_email="to@example.com", subject="S", content="<p>x</p>", smtp_config=smtp_config, stage="C9",
+        )
+        self.assertFalse(success)
+        self.assertTrue(error)
+
+
+if __name__ == "__main__":
+    unittest.main()
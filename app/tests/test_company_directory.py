@@ -0,0 +1,169 @@
+import dataclasses
+import inspect
+import threading
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import database, email_utils, models
+from app.company_directory import CompanyDirectory, CompanyProfile
+
+
+class FakeVersion:
+    """Redis 版本号的本地替身。"""
+
+    def __init__(self):
+        self.value = "1"
+        self.fail = False
+
+    def get(self):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.value
+
+    def bump(self):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.value = str(int(self.value) + 1)
+
+
+class TestCompanyDirectory(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(self.engine)
+        Session = sessionmaker(bind=self.engine)
+        patcher = mock.patch.object(database, "SessionLocal", Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with Session() as db:
+            db.add_all([
+                models.CompanyInfo(company_name="深圳B公司", company_type="B", short_name="BB", email="b@example.com"),
+                models.CompanyInfo(company_name="领先D公司", company_type="D", short_name="LF", email="lf@example.com"),
+                models.CompanyInfo(company_name="领先D公司", company_type="C", short_name="LF", email="lf-c@example.com"),
+            ])
+            db.commit()
+
+        self.queries = 0
+
+        def count(*args):
+            self.queries += 1
+        event.listen(self.engine, "before_cursor_execute", count)
+
+        self.version = FakeVersion()
+        self.directory = CompanyDirectory(
+            ttl=300, check_interval=0, version_getter=self.version.get, version_bumper=self.version.bump
+        )
+
+    def test_lookups_by_each_index(self):
+        self.assertEqual(self.directory.get_by_name("深圳B公司").short_name, "BB")
+        self.assertEqual(self.directory.get_by_name("领先D公司").company_type, "D")  # 同名取 id 最小的一条
+        self.assertEqual(self.directory.get_by_name("领先D公司", "C").email, "lf-c@example.com")
+        self.assertEqual(self.directory.get_by_short("LF", "D").company_name, "领先D公司")
+        self.assertEqual(self.directory.get_by_email("b@example.com").company_type, "B")
+        self.assertIsNone(self.directory.get_by_name("外部公司"))
+        self.assertIsNone(self.directory.get_by_short("LF", "B"))
+
+    def test_lookups_ignore_case_and_padding_like_mysql(self):
+        self.assertEqual(self.directory.get_by_email(" B@Example.COM ").company_name, "深圳B公司")
+        self.assertEqual(self.directory.get_by_name("深圳B公司 ").short_name, "BB")
+        self.assertEqual(self.directory.get_by_short("LF ", "D").company_name, "领先D公司")
+
+    def test_lookups_do_not_hit_database_after_load(self):
+        self.directory.load()
+        loaded_queries = self.queries
+        for _ in range(100):
+            self.directory.get_by_email("lf@example.com")
+            self.directory.get_by_name("深圳B公司", "B")
+        self.assertEqual(self.queries, loaded_queries)
+
+    def test_version_change_reloads(self):
+        self.directory.load()
+        with database.SessionLocal() as db:
+            db.query(models.CompanyInfo).filter_by(short_name="BB").update({"email": "new-b@example.com"})
+            db.commit()
+        self.assertEqual(self.directory.get_by_name("深圳B公司").email, "b@example.com")
+
+        self.version.bump()  # 其他进程的写路径调用了 invalidate
+        self.assertEqual(self.directory.get_by_name("深圳B公司").email, "new-b@example.com")
+
+    def test_invalidate_reloads_and_bumps_version(self):
+        self.directory.load()
+        self.directory.invalidate()
+        self.assertEqual(self.version.value, "2")
+        before = self.queries
+        self.directory.get_by_email("b@example.com")
+        self.assertGreater(self.queries, before)
+
+    def test_redis_failure_keeps_serving_cached_rows(self):
+        self.directory.load()
+        self.version.fail = True
+        self.directory.invalidate()
+        self.assertEqual(self.directory.get_by_short("LF", "D").email, "lf@example.com")
+
+    def test_concurrent_expiry_reloads_once(self):
+        self.directory.load()
+        self.version.bump()
+        loads = []
+        real_load = self.directory._load
+
+        def slow_load():
+            loads.append(threading.current_thread().name)
+            time.sleep(0.1)
+            return real_load()
+
+        results = []
+        with mock.patch.object(self.directory, "_load", side_effect=slow_load):
+            threads = [threading.Thread(target=lambda: results.append(self.directory.get_by_short("BB", "B")))
+                       for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual([r.company_name for r in results], ["深圳B公司"] * 5)
+
+    def test_failed_reload_backs_off_until_next_check(self):
+        self.directory.load()
+        self.directory.check_interval = 60
+        self.directory.invalidate()
+        with mock.patch.object(self.directory, "_load", side_effect=RuntimeError("db down")) as load:
+            for _ in range(10):
+                self.assertEqual(self.directory.get_by_short("LF", "D").email, "lf@example.com")
+        self.assertEqual(load.call_count, 1)
+
+
+class TestCompanyProfile(unittest.TestCase):
+    def make_profile(self):
+        return CompanyProfile.from_orm(models.CompanyInfo(
+            id=7, company_name="深圳B公司", company_type="B", short_name="BB", contact_person="张三",
+            email="b@example.com", smtp_host="smtp.example.com", smtp_port=465,
+            smtp_username="b@example.com", smtp_password="secret", smtp_from="b@example.com",
+        ))
+
+    def test_is_immutable_and_slotted(self):
+        profile = self.make_profile()
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            profile.email = "other@example.com"
+        self.assertFalse(hasattr(profile, "__dict__"))
+
+    def test_smtp_config(self):
+        self.assertEqual(self.make_profile().smtp_config, {
+            "host": "smtp.example.com", "port": 465, "username": "b@example.com",
+            "password": "secret", "from": "b@example.com",
+        })
+
+    def test_signature_matches_template_parameters(self):
+        params = inspect.signature(email_utils.render_invitation_template_content).parameters
+        signature = self.make_profile().signature
+        self.assertTrue(set(signature) <= set(params))
+        self.assertEqual(signature["contact_person"], "张三")
+
+
+if __name__ == "__main__":
+    unittest.main()
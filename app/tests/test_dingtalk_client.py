@@ -0,0 +1,30 @@
+import unittest
+
+from app import dingtalk_client
+
+
+class TestDingTalkRetry(unittest.TestCase):
+    def setUp(self):
+        self.retry = dingtalk_client._build_session().get_adapter("https://api.dingtalk.com").max_retries
+
+    def test_post_retries_only_when_not_processed(self):
+        self.assertTrue(self.retry.is_retry("POST", 429))
+        self.assertTrue(self.retry.is_retry("POST", 503))
+        self.assertFalse(self.retry.is_retry("POST", 502))
+        self.assertFalse(self.retry.is_retry("POST", 504))
+        self.assertFalse(self.retry.is_retry("POST", 500))
+
+    def test_get_and_put_retry_gateway_errors(self):
+        for method in ("GET", "PUT"):
+            self.assertTrue(self.retry.is_retry(method, 502))
+            self.assertTrue(self.retry.is_retry(method, 504))
+            self.assertFalse(self.retry.is_retry(method, 500))
+
+    def test_increment_keeps_the_post_rule(self):
+        retry = self.retry.increment("POST", "/v1.0/yida/forms/instances/batchSave")
+        self.assertIsInstance(retry, dingtalk_client.DingTalkRetry)
+        self.assertFalse(retry.is_retry("POST", 502))
+
+
+if __name__ == "__main__":
+    unittest.main()
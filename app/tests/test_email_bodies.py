@@ -0,0 +1,92 @@
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import database, email_bodies, models
+from app.email_record_writer import EmailRecordWriter
+from app.scripts.migrate_email_bodies import migrate_email_bodies
+
+BODY = "<html><body><p>您好，附件为结算单。</p>" + "<p>深圳某某公司 联系人 电话 地址</p>" * 50 + "</body></html>"
+
+
+def make_engine():
+    return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+class TestHashedBodyStorage(unittest.TestCase):
+    def setUp(self):
+        engine = make_engine()
+        models.Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_store_bodies_deduplicates(self):
+        with self.Session() as db:
+            first = email_bodies.store_bodies(db, [BODY, BODY, "<p>other</p>"])
+            second = email_bodies.store_bodies(db, [BODY])
+            self.assertEqual(first[BODY], second[BODY])
+            self.assertEqual(db.query(models.EmailBody).count(), 2)
+            stored = db.get(models.EmailBody, first[BODY])
+            self.assertLess(len(stored.data), len(BODY.encode("utf-8")) / 5)
+            self.assertEqual(stored.text, BODY)
+
+    def test_writer_stores_hash_and_reads_back_transparently(self):
+        writer = EmailRecordWriter(flush_interval=60)
+        with mock.patch.object(email_bodies, "EMAIL_BODY_STORAGE", "hashed"), \
+                mock.patch.object(writer, "_ensure_thread"):
+            for i in range(30):
+                writer.add({"to": f"b{i}@example.com", "subject": "C7", "body": BODY, "status": "success", "stage": "C7"})
+            writer.add({"to": "x@example.com", "subject": "C7", "body": None, "status": "failed", "stage": "C7"})
+            self.assertEqual(writer.flush(), 31)
+
+        with self.Session() as db:
+            self.assertEqual(db.query(models.EmailBody).count(), 1)
+            records = db.query(models.EmailRecord).order_by(models.EmailRecord.id).all()
+            self.assertIsNone(records[0].body)
+            self.assertEqual(records[0].body_hash, email_bodies.body_hash(BODY))
+            self.assertEqual(records[0].content, BODY)
+            self.assertIsNone(records[-1].content)
+
+    def test_inline_mode_is_unchanged(self):
+        writer = EmailRecordWriter(flush_interval=60)
+        with mock.patch.object(writer, "_ensure_thread"):
+            writer.add({"to": "b@example.com", "subject": "A1", "body": BODY, "status": "success", "stage": "A1"})
+            writer.flush()
+        with self.Session() as db:
+            record = db.query(models.EmailRecord).one()
+            self.assertEqual((record.body, record.body_hash, record.content), (BODY, None, BODY))
+            self.assertEqual(db.query(models.EmailBody).count(), 0)
+
+
+class TestMigrateEmailBodies(unittest.TestCase):
+    def test_migrates_legacy_table(self):
+        engine = make_engine()
+        with engine.begin() as conn:
+            # 旧版 emails_records：没有 body_hash 列
+            conn.execute(text(
+                "CREATE TABLE emails_records (id INTEGER PRIMARY KEY, \"to\" VARCHAR(255) NOT NULL, subject VARCHAR(255), "
+                "body TEXT, status VARCHAR(20), task_id VARCHAR(100), created_at DATETIME, error_message TEXT, "
+                "project_id INTEGER, stage VARCHAR(12), actual_sending_time DATETIME)"
+            ))
+            for i in range(7):
+                conn.execute(text("INSERT INTO emails_records (\"to\", body, status) VALUES (:to, :body, 'success')"),
+                             {"to": f"b{i}@example.com", "body": BODY if i % 2 else "<p>short</p>"})
+
+        self.assertEqual(migrate_email_bodies(engine, batch_size=3), 7)
+        self.assertEqual(migrate_email_bodies(engine, batch_size=3), 0)
+
+        self.assertIn("body_hash", {col["name"] for col in inspect(engine).get_columns("emails_records")})
+        with sessionmaker(bind=engine)() as db:
+            self.assertEqual(db.query(models.EmailBody).count(), 2)
+            records = db.query(models.EmailRecord).order_by(models.EmailRecord.id).all()
+            self.assertTrue(all(r.body is None for r in records))
+            self.assertEqual([r.content for r in records[:2]], ["<p>short</p>", BODY])
+
+
+if __name__ == "__main__":
+    unittest.main()
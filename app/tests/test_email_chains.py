@@ -0,0 +1,169 @@
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import database, email_chains, email_utils, models, tasks
+
+SMTP = {"host": "smtp.example.com", "port": 465, "username": "u", "password": "p", "from": "b@example.com"}
+
+
+def make_bcd_chain():
+    """与 schedule_bid_conversation_BCD 相同结构的嵌套任务字典。"""
+    task_b6 = {"to_email": "b@example.com", "subject": "B6", "content": "<p>b6</p>", "smtp_config": SMTP,
+               "stage": "B6", "followup_task_args": None, "followup_delay": 600, "cc": ["c@example.com"]}
+    task_b5 = {"to_email": "d@example.com", "subject": "B5", "content": "<p>b5</p>", "smtp_config": SMTP,
+               "stage": "B5", "followup_task_args": task_b6, "followup_delay": 500}
+    task_b4 = {"to_email": "b@example.com", "subject": "B4", "content": "<p>b4</p>", "smtp_config": SMTP,
+               "stage": "B4", "followup_task_args": task_b5, "followup_delay": 400}
+    return {"to_email": "c@example.com", "subject": "B3", "content": "<p>b3</p>", "smtp_config": SMTP,
+            "stage": "B3", "followup_task_args": task_b4, "followup_delay": 300}
+
+
+class TestEmailChains(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 发送记录不在这里验证，避免全局写入器的后台线程在测试结束后继续往真实库写
+        patcher = mock.patch.object(tasks, "get_email_record_writer")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_flatten_uses_each_steps_own_delay(self):
+        steps = email_chains.flatten_chain(make_bcd_chain(), start_delay=0)
+        self.assertEqual([s["stage"] for s in steps], ["B3", "B4", "B5", "B6"])
+        self.assertEqual([s["delay"] for s in steps], [0, 400, 500, 600])
+        self.assertEqual(steps[3]["cc"], ["c@example.com"])
+        self.assertIsNone(steps[0]["attachments"])
+
+    def test_create_and_load_steps(self):
+        chain_id = email_chains.create_email_chain(make_bcd_chain())
+        with self.Session() as db:
+            step = email_chains.load_chain_step(db, chain_id, 2)
+            self.assertEqual(step.stage, "B5")
+            self.assertEqual(step.smtp_config, SMTP)
+            self.assertIsNone(email_chains.load_chain_step(db, chain_id, 4))
+
+    def test_start_email_chain_sends_only_references(self):
+        with mock.patch.object(tasks.send_email_chain_step, "apply_async") as apply_async:
+            chain_id = tasks.start_email_chain(make_bcd_chain())
+        apply_async.assert_called_once_with(args=(chain_id, 0))
+
+    def test_delayed_start_is_left_to_the_scheduler(self):
+        with mock.patch.object(tasks.send_email_chain_step, "apply_async") as apply_async:
+            chain_id = tasks.start_email_chain(make_bcd_chain(), countdown=120)
+        apply_async.assert_not_called()
+        with self.Session() as db:
+            step = email_chains.load_chain_step(db, chain_id, 0)
+            self.assertEqual(step.status, "scheduled")
+            self.assertGreater(step.due_at, datetime.now() + timedelta(seconds=100))
+
+    def test_step_sends_and_schedules_next(self):
+        chain_id = email_chains.create_email_chain(make_bcd_chain())
+        with mock.patch.object(email_utils, "send_email", return_value=(True, "")) as send_email, \
+                mock.patch.object(tasks.send_email_chain_step, "apply_async") as apply_async:
+            result = tasks.send_email_chain_step(chain_id, 1)
+
+        self.assertTrue(result["success"])
+        send_email.assert_called_once_with("b@example.com", "B4", "<p>b4</p>", SMTP, "B4", cc=None)
+        apply_async.assert_not_called()
+        with self.Session() as db:
+            self.assertEqual(email_chains.load_chain_step(db, chain_id, 1).status, "sent")
+            next_step = email_chains.load_chain_step(db, chain_id, 2)
+            self.assertEqual(next_step.status, "scheduled")
+            self.assertAlmostEqual(
+                (next_step.due_at - datetime.now()).total_seconds(), 500, delta=5
+            )
+
+    def test_last_step_with_attachments(self):
+        root = {"to_email": "b@example.com", "subject": "C7", "content": "<p>c7</p>", "smtp_config": SMTP,
+                "stage": "C7", "attachments": ["/tmp/settlement.xlsx"], "followup_task_args": None}
+        chain_id = email_chains.create_email_chain(root)
+        with mock.patch.object(email_utils, "send_email_with_attachments", return_value=(True, "")) as send, \
+                mock.patch.object(tasks.send_email_chain_step, "apply_async") as apply_async:
+            tasks.send_email_chain_step(chain_id, 0)
+
+        send.assert_called_once_with("b@example.com", "C7", "<p>c7</p>", SMTP, ["/tmp/settlement.xlsx"], "C7", cc=None)
+        apply_async.assert_not_called()
+
+
+class TestDelayedSendScheduler(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def schedule_emails(self, count, due_at):
+        rows = [{
+            "chain_id": f"chain{i:06d}", "step_index": 0, "stage": "A2", "to_email": f"d{i}@example.com",
+            "subject": "A2", "content": "<p>" + "x" * 2000 + "</p>", "smtp_config": SMTP,
+            "delay": 0, "status": "scheduled", "due_at": due_at,
+        } for i in range(count)]
+        with self.Session() as db:
+            db.bulk_insert_mappings(models.EmailChainStep, rows)
+            db.commit()
+
+    def test_claims_only_due_steps_in_due_order(self):
+        now = datetime.now()
+        self.schedule_emails(3, now + timedelta(hours=1))
+        with self.Session() as db:
+            db.add(models.EmailChainStep(chain_id="late", step_index=0, to_email="a@x.com", smtp_config=SMTP,
+                                         status="scheduled", due_at=now - timedelta(minutes=1)))
+            db.add(models.EmailChainStep(chain_id="early", step_index=0, to_email="a@x.com", smtp_config=SMTP,
+                                         status="scheduled", due_at=now - timedelta(minutes=5)))
+            db.commit()
+            self.assertEqual(email_chains.claim_due_steps(db, now=now), [("early", 0), ("late", 0)])
+            self.assertEqual(email_chains.claim_due_steps(db, now=now), [])
+
+    def test_requeues_steps_stuck_in_queued(self):
+        now = datetime.now()
+        with self.Session() as db:
+            db.add(models.EmailChainStep(chain_id="stuck", step_index=2, to_email="a@x.com", smtp_config=SMTP,
+                                         status="queued", queued_at=now - timedelta(hours=1)))
+            db.add(models.EmailChainStep(chain_id="running", step_index=0, to_email="a@x.com", smtp_config=SMTP,
+                                         status="queued", queued_at=now - timedelta(seconds=10)))
+            db.commit()
+            self.assertEqual(email_chains.claim_due_steps(db, now=now), [("stuck", 2)])
+
+    def test_future_sends_are_not_published(self):
+        self.schedule_emails(3000, datetime.now() + timedelta(minutes=30))
+        with mock.patch.object(tasks.send_email_chain_step, "apply_async") as apply_async:
+            self.assertEqual(tasks.release_due_email_steps(), 0)
+        apply_async.assert_not_called()
+
+    def release_peak_memory(self, backlog):
+        """积压 backlog 个到点步骤，测一次批量投递的内存峰值。"""
+        self.schedule_emails(backlog, datetime.now() - timedelta(minutes=1))
+        with mock.patch.object(email_chains, "EMAIL_SCHEDULER_BATCH_SIZE", 50), \
+                mock.patch.object(tasks, "EMAIL_SCHEDULER_MAX_BATCHES", 1), \
+                mock.patch.object(tasks.send_email_chain_step, "apply_async") as apply_async:
+            tracemalloc.start()
+            released = tasks.release_due_email_steps()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.assertEqual(released, 50)
+        self.assertEqual(apply_async.call_count, 50)
+        return peak
+
+    def test_release_memory_does_not_grow_with_backlog(self):
+        small = self.release_peak_memory(500)
+        with self.Session() as db:
+            db.query(models.EmailChainStep).delete()
+            db.commit()
+        large = self.release_peak_memory(5000)
+        self.assertLess(large, small * 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import database, email_chains, email_record_writer, email_utils, models, tasks
+from app.email_record_writer import EmailRecordWriter
+
+SMTP = {"host": "smtp.example.com", "port": 465, "username": "u", "password": "p", "from": "b@example.com"}
+
+
+def make_record(i):
+    return {"to": f"d{i}@example.com", "subject": "A2", "body": "<p>a2</p>", "status": "success",
+            "stage": "A2", "project_id": i}
+
+
+class RecordWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def records(self):
+        with self.Session() as db:
+            return db.query(models.EmailRecord).order_by(models.EmailRecord.id).all()
+
+
+class TestEmailRecordWriter(RecordWriterTestCase):
+    def test_flush_inserts_in_batches(self):
+        statements = []
+        event.listen(self.engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        writer = EmailRecordWriter(max_batch_size=50, flush_interval=60)
+        with mock.patch.object(writer, "_ensure_thread"):
+            for i in range(120):
+                writer.add(make_record(i))
+            self.assertEqual(writer.flush(), 120)
+
+        inserts = [s for s in statements if s.startswith("INSERT INTO emails_records")]
+        self.assertEqual(len(inserts), 3)
+        records = self.records()
+        self.assertEqual(len(records), 120)
+        self.assertEqual(records[7].to, "d7@example.com")
+        self.assertIsNotNone(records[7].created_at)
+
+    def test_failed_batch_is_retried_then_dropped(self):
+        writer = EmailRecordWriter(max_batch_size=10, flush_interval=60, max_attempts=2)
+        with mock.patch.object(writer, "_ensure_thread"):
+            writer.add(make_record(1))
+            with mock.patch.object(writer, "sink", return_value=False):
+                self.assertEqual(writer.flush(), 0)
+                self.assertEqual(writer.pending_count(), 1)
+                writer.flush()
+            self.assertEqual(writer.pending_count(), 0)
+        self.assertEqual(self.records(), [])
+
+    def test_background_thread_flushes_when_batch_is_full(self):
+        writer = EmailRecordWriter(max_batch_size=5, flush_interval=60)
+        for i in range(5):
+            writer.add(make_record(i))
+        deadline = time.monotonic() + 5
+        while len(self.records()) < 5 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(self.records()), 5)
+        writer.close()
+
+
+class TestSendTasksRecordEmails(RecordWriterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.writer = EmailRecordWriter(flush_interval=60)
+        patcher = mock.patch.object(email_record_writer, "_email_record_writer", self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(email_record_writer, "_email_record_writer_pid", os.getpid())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.writer, "_ensure_thread")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_legacy_task_records_without_its_own_commit(self):
+        with mock.patch.object(email_utils, "send_email", return_value=(True, "")):
+            tasks.send_reply_email.apply(
+                kwargs={"to_email": "b@example.com", "subject": "A1", "content": "<p>a1</p>", "smtp_config": SMTP,
+                        "delay": 0, "stage": "A1", "project_id": 7}, task_id="legacy")
+        self.assertEqual(self.records(), [])
+        self.writer.flush()
+        record, = self.records()
+        self.assertEqual((record.stage, record.status, record.project_id, record.task_id), ("A1", "success", 7, "legacy"))
+
+    def test_delay_task_records_each_smtp_attempt(self):
+        kwargs = {"to_email": "b@example.com", "subject": "A1", "content": "<p>a1</p>", "smtp_config": SMTP,
+                  "stage": "A1"}
+        with mock.patch.object(email_utils, "send_email", side_effect=[(False, "421 busy"), (True, "")]):
+            tasks.send_email_with_followup_delay.apply(kwargs=kwargs, task_id="a1-task")
+        self.writer.flush()
+        self.assertEqual([(r.status, r.error_message) for r in self.records()],
+                         [("failed", "421 busy"), ("success", None)])
+
+    def test_chain_step_records_once_when_redelivered(self):
+        chain_id = email_chains.create_email_chain(
+            {"to_email": "c@example.com", "subject": "B3", "content": "<p>b3</p>", "smtp_config": SMTP, "stage": "B3"}
+        )
+        with mock.patch.object(email_utils, "send_email", return_value=(True, "")):
+            tasks.send_email_chain_step.apply(args=(chain_id, 0), task_id="first")
+            tasks.send_email_chain_step.apply(args=(chain_id, 0), task_id="redelivered")
+        self.writer.flush()
+        record, = self.records()
+        self.assertEqual((record.to, record.stage, record.task_id), ("c@example.com", "B3", "first"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.email_utils import EmailSubjectCache
+
+
+class FakeVersion:
+    """Redis 版本号的本地替身。"""
+
+    def __init__(self):
+        self.value = "1"
+
+    def get(self):
+        return self.value
+
+    def bump(self):
+        self.value = str(int(self.value) + 1)
+
+
+def make_cache(version, **kwargs):
+    return EmailSubjectCache(version_getter=version.get, version_bumper=version.bump, **kwargs)
+
+
+class TestEmailSubjectCache(unittest.TestCase):
+    def test_concurrent_expiry_reloads_once(self):
+        cache = make_cache(FakeVersion(), ttl=60)
+        loads = []
+
+        def slow_load():
+            loads.append(threading.current_thread().name)
+            time.sleep(0.1)
+            cache._subjects = {("A1", "B公司"): {"subject": "A1标题"}}
+            cache._loaded_at = time.monotonic()
+            return 1
+
+        results = []
+        with mock.patch.object(cache, "_load", side_effect=slow_load):
+            threads = [threading.Thread(target=lambda: results.append(cache.get("A1", "B公司"))) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, [{"subject": "A1标题"}] * 5)
+
+    def test_failed_reload_keeps_old_subjects(self):
+        cache = make_cache(FakeVersion(), ttl=0)
+        cache._subjects = {("A1", "B公司"): {"subject": "旧标题"}}
+        cache._loaded_at = time.monotonic() - 1
+        with mock.patch.object(cache, "_load", side_effect=RuntimeError("db down")):
+            self.assertEqual(cache.get("A1", "B公司"), {"subject": "旧标题"})
+
+    def test_invalidate_reloads_here_and_in_other_processes(self):
+        version = FakeVersion()
+        here, other = make_cache(version, ttl=600, check_interval=0), make_cache(version, ttl=600, check_interval=0)
+        subjects = {"value": "旧标题"}
+
+        def load_for(cache):
+            def load():
+                cache._subjects = {("A1", "B公司"): {"subject": subjects["value"]}}
+                cache._version = version.get()
+                cache._loaded_at = cache._checked_at = time.monotonic()
+                return 1
+            return load
+
+        with mock.patch.object(here, "_load", side_effect=load_for(here)), \
+                mock.patch.object(other, "_load", side_effect=load_for(other)):
+            self.assertEqual(here.get("A1", "B公司"), {"subject": "旧标题"})
+            self.assertEqual(other.get("A1", "B公司"), {"subject": "旧标题"})
+            subjects["value"] = "新标题"  # 直接改库
+            here.invalidate()
+            self.assertEqual(version.value, "2")
+            self.assertEqual(here.get("A1", "B公司"), {"subject": "新标题"})
+            self.assertEqual(other.get("A1", "B公司"), {"subject": "新标题"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,343 @@
+import io
+import os
+import tempfile
+import tracemalloc
+import unittest
+from datetime import date
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from unittest import mock
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, Font, Border, Side
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import excel_utils, models
+
+
+RECEIVABLE_ITEMS = [
+    ("三方/四方货款", 1000000),
+    ("C进口服务费", 12000.5),
+    ("第三方费用", 3000),
+    ("费用结算服务费", 800),
+    ("中标服务费", 2000),
+    ("购买标书费", 500),
+    ("投标服务费", 1500),
+]
+
+
+def legacy_settlement_workbook(received_amount, receivable_items, head_company_name, bottom_company_name) -> Workbook:
+    """改造前结算单生成函数的构建部分，原样保留作对照（benchmark_settlement_excel 也用它做基准）。"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "结算单"
+
+    # 样式
+    title_font = Font(size=14, bold=True)
+    bold_font = Font(bold=True)
+    center = Alignment(horizontal="center", vertical="center")
+    border = Border(
+        left=Side(style="thin"),
+        right=Side(style="thin"),
+        top=Side(style="thin"),
+        bottom=Side(style="thin")
+    )
+
+    def apply_border(cell_range):
+        for row in ws[cell_range]:
+            for cell in row:
+                cell.border = border
+
+    # 列宽
+    ws.column_dimensions["A"].width = 14
+    ws.column_dimensions["B"].width = 25
+    ws.column_dimensions["C"].width = 20
+
+    # 标题
+    ws.merge_cells("A1:C1")
+    ws["A1"] = "结算单"
+    ws["A1"].font = title_font
+    ws["A1"].alignment = center
+
+    # 抬头
+    ws.merge_cells("A2:C2")
+    ws["A2"] = head_company_name
+
+    # 实收款项标题
+    ws.merge_cells("A4:C4")
+    ws["A4"] = "实收款项："
+    ws["A4"].font = bold_font
+
+    apply_border("A4:C4")
+    # apply_border("A5:C5")
+
+    # 实收表头
+    ws["A5"] = "序号"
+    ws["B5"] = "中标金额（RMB）"
+    ws["A5"].font = ws["B5"].font = bold_font
+    ws["A5"].alignment = ws["B5"].alignment = center
+    apply_border("A5:C5")
+
+    # 实收数据
+    ws["A6"] = "1"
+    ws["B6"] = float(received_amount)
+    ws["B6"].number_format = "#,##0.00"
+    ws["A6"].alignment = center
+    ws["B6"].alignment = center
+    apply_border("A6:C6")
+
+    # 应收账款标题
+    ws.merge_cells("A8:C8")
+    ws["A8"] = "应收账款："
+    ws["A8"].font = bold_font
+    apply_border("A8:C8")
+
+    # 应收表头
+    ws["A9"] = "序号"
+    ws["B9"] = "项目"
+    ws["C9"] = "金额（RMB）"
+    for col in ["A", "B", "C"]:
+        ws[f"{col}9"].font = bold_font
+        ws[f"{col}9"].alignment = center
+    apply_border("A9:C9")
+
+    # 应收项目
+    for i, (item, amount) in enumerate(receivable_items, start=1):
+        row = 9 + i
+        ws[f"A{row}"] = i
+        ws[f"A{row}"].alignment = center
+        ws[f"B{row}"] = item
+        try:
+            ws[f"C{row}"] = float(amount) if amount not in ("", None) else 0
+        except ValueError:
+            ws[f"C{row}"] = 0
+        ws[f"C{row}"].number_format = "#,##0.00"
+        apply_border(f"A{row}:C{row}")
+
+    # 小计行
+    subtotal_row = 9 + len(receivable_items) + 1
+    receivable_start_row = 10
+    receivable_end_row = 9 + len(receivable_items)
+
+    ws.merge_cells(f"A{subtotal_row}:B{subtotal_row}")
+    ws[f"A{subtotal_row}"] = "小计："
+    ws[f"A{subtotal_row}"].alignment = Alignment(horizontal="right")
+
+    # 修复：确保SUM范围准确
+    if receivable_items:
+        ws[f"C{subtotal_row}"] = f"=SUM(C{receivable_start_row}:C{receivable_end_row})"
+    else:
+        ws[f"C{subtotal_row}"] = 0
+
+    ws[f"C{subtotal_row}"].number_format = "#,##0.00"
+    apply_border(f"A{subtotal_row}:C{subtotal_row}")
+
+    # 结算款行
+    balance_row = subtotal_row + 2
+    # ws.merge_cells(f"A{balance_row}:B{balance_row}")
+    ws[f"A{balance_row}"] = "结算款(RMB)："
+    ws[f"A{balance_row}"].font = Font(bold=True)
+    
+    ws[f"B{balance_row}"] = "实收款项-应收账款="
+    ws[f"C{balance_row}"] = f"=B6 - C{subtotal_row}"
+    ws[f"C{balance_row}"].number_format = "#,##0.00"
+    apply_border(f"A{balance_row}:C{balance_row}")
+
+    # 公司名称
+    ws[f"C{balance_row + 2}"] = bottom_company_name
+    ws[f"C{balance_row + 2}"].alignment = Alignment(horizontal="right")
+
+    # 设置每行高度
+    for row in range(1, ws.max_row + 1):
+        ws.row_dimensions[row].height = 20
+
+    return wb
+
+
+def cell_snapshot(ws):
+    """逐格记录值和样式，用于对比两种实现生成的结算单。"""
+    return {
+        cell.coordinate: (cell.value, cell.font.b, cell.font.sz, cell.alignment.horizontal,
+                          cell.border.left.style, cell.border.bottom.style, cell.number_format)
+        for row in ws.iter_rows() for cell in row
+    }
+
+
+class TestSettlementWorkbook(unittest.TestCase):
+    def assert_same_as_legacy(self, items):
+        args = (1234567.89, items, "深圳某某采购有限公司", "香港某某贸易有限公司")
+        legacy = legacy_settlement_workbook(*args).active
+        ws = excel_utils.render_settlement_workbook(*args).active
+
+        self.assertEqual(ws.title, legacy.title)
+        self.assertEqual(sorted(map(str, ws.merged_cells.ranges)), sorted(map(str, legacy.merged_cells.ranges)))
+        self.assertEqual(cell_snapshot(ws), cell_snapshot(legacy))
+        self.assertEqual([ws.column_dimensions[c].width for c in "ABC"], [14, 25, 20])
+        self.assertEqual(ws.row_dimensions[ws.max_row].height, 20)
+
+    def test_matches_legacy_layout(self):
+        self.assert_same_as_legacy(RECEIVABLE_ITEMS)
+
+    def test_matches_legacy_with_blank_amounts(self):
+        self.assert_same_as_legacy([("三方/四方货款", ""), ("第三方费用", None), ("其他", "abc")])
+
+    def test_matches_legacy_without_items(self):
+        self.assert_same_as_legacy([])
+
+    def test_settlement_excel_bytes(self):
+        data = excel_utils.settlement_excel_bytes(100, [("第三方费用", 20)], "D公司", "B公司")
+        ws = load_workbook(io.BytesIO(data)).active
+        self.assertEqual(ws["B6"].value, 100)
+        self.assertEqual(ws["C11"].value, "=SUM(C10:C10)")
+        self.assertEqual(ws["C13"].value, "=B6 - C11")
+
+
+class TestSettlementCopies(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.home = tmp.name
+        patcher = mock.patch.dict(os.environ, {"HOME": self.home})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def generate(self, filename, head="D公司"):
+        return excel_utils.generate_settlement_excels(
+            filename=filename, prefix="BD", received_amount=100,
+            receivable_items=[("第三方费用", 20)], head_company_name=head, bottom_company_name="B公司",
+        )
+
+    def test_builds_once_and_links_copies(self):
+        with mock.patch.object(excel_utils, "render_settlement_workbook",
+                               wraps=excel_utils.render_settlement_workbook) as render:
+            archive, attachment = self.generate("P1_BD结算单.xlsx")
+
+        render.assert_called_once()
+        self.assertEqual(archive, os.path.join(self.home, "settlements", "P1_BD结算单.xlsx"))
+        self.assertEqual(attachment, os.path.join(self.home, "BD_settlements", "结算单.xlsx"))
+        self.assertTrue(os.path.samefile(archive, attachment))
+        self.assertEqual(load_workbook(attachment).active["A2"].value, "D公司")
+        self.assertEqual(os.listdir(os.path.dirname(attachment)), ["结算单.xlsx"])
+
+    def test_overwriting_shared_attachment_keeps_earlier_archive(self):
+        first, _ = self.generate("P1_BD结算单.xlsx", head="D1公司")
+        second, attachment = self.generate("P2_BD结算单.xlsx", head="D2公司")
+
+        self.assertEqual(load_workbook(first).active["A2"].value, "D1公司")
+        self.assertEqual(load_workbook(attachment).active["A2"].value, "D2公司")
+        self.assertTrue(os.path.samefile(second, attachment))
+
+    def test_falls_back_to_copy_when_link_fails(self):
+        with mock.patch.object(os, "link", side_effect=OSError("cross-device link")):
+            archive, attachment = self.generate("P1_BD结算单.xlsx")
+        self.assertFalse(os.path.samefile(archive, attachment))
+        with open(archive, "rb") as a, open(attachment, "rb") as b:
+            self.assertEqual(a.read(), b.read())
+
+
+class TestParallelSettlement(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.home = tmp.name
+        patcher = mock.patch.dict(os.environ, {"HOME": self.home})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.jobs = [
+            dict(filename=f"P1_{prefix}结算单.xlsx", prefix=prefix, received_amount=100,
+                 receivable_items=[("第三方费用", 20)], head_company_name=head, bottom_company_name="B公司")
+            for prefix, head in (("CB", "B公司"), ("BD", "D公司"))
+        ]
+
+    def test_generates_all_sheets_in_worker_processes(self):
+        # 重新拉起子进程，让它们在 HOME 打补丁之后启动、写到临时目录
+        excel_utils.shutdown_settlement_pool()
+        self.addCleanup(excel_utils.shutdown_settlement_pool)
+        worker_pids = excel_utils.warm_up_settlement_pool()
+        results = excel_utils.generate_settlement_excels_parallel(self.jobs)
+
+        self.assertNotIn(os.getpid(), worker_pids)
+        self.assertEqual([os.path.basename(archive) for archive, _ in results], ["P1_CB结算单.xlsx", "P1_BD结算单.xlsx"])
+        self.assertEqual(load_workbook(results[1][1]).active["A2"].value, "D公司")
+        self.assertTrue(os.path.samefile(*results[0]))
+
+    def test_runs_in_process_when_pool_disabled(self):
+        with mock.patch.object(excel_utils, "SETTLEMENT_WORKERS", 0):
+            results = excel_utils.generate_settlement_excels_parallel(self.jobs)
+        self.assertEqual(results[0][0], os.path.join(self.home, "settlements", "P1_CB结算单.xlsx"))
+
+    def test_falls_back_when_pool_is_broken(self):
+        pool = mock.Mock()
+        pool.submit.side_effect = BrokenProcessPool("worker died")
+        with mock.patch.object(excel_utils, "get_settlement_pool", return_value=pool):
+            results = excel_utils.generate_settlement_excels_parallel(self.jobs)
+        pool.shutdown.assert_called_once_with(wait=False)
+        self.assertTrue(os.path.exists(results[1][0]))
+
+
+class TestSettlementReport(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "report.xlsx")
+
+    def add_projects(self, count, winning_time=date(2025, 9, 15), start=0):
+        with self.Session() as db:
+            db.bulk_insert_mappings(models.ProjectInfo, [
+                {"id": start + i + 1, "contract_number": f"HT{start + i:06d}", "project_name": f"项目{start + i}",
+                 "project_type": "BCD", "company_b_name": "B公司", "company_d_name": "D公司"}
+                for i in range(count)
+            ])
+            db.bulk_insert_mappings(models.ProjectFeeDetails, [
+                {"project_id": start + i + 1, "winning_time": winning_time, "winning_amount": Decimal("1000.00"),
+                 "three_fourth_amount": Decimal("600.00"), "third_party_fee": Decimal("50.50"), "is_sent": i % 2 == 0}
+                for i in range(count)
+            ])
+            db.commit()
+
+    def test_month_report_rows_and_totals(self):
+        self.add_projects(3)
+        self.add_projects(2, winning_time=date(2025, 10, 1), start=3)
+        with self.Session() as db:
+            count = excel_utils.generate_settlement_report(self.path, date(2025, 9, 1), date(2025, 10, 1), db=db)
+
+        self.assertEqual(count, 3)
+        rows = list(load_workbook(self.path).active.iter_rows(values_only=True))
+        self.assertEqual(list(rows[0]), excel_utils.SETTLEMENT_REPORT_HEADERS)
+        self.assertEqual(rows[1][:4], ("HT000000", "项目0", None, "BCD"))
+        self.assertEqual(rows[1][8:11], (1000, 600, 0))
+        self.assertEqual(rows[1][-3:], (650.5, 349.5, "是"))
+        self.assertEqual(rows[4][0], "合计")
+        self.assertEqual(rows[4][8], "=SUM(I2:I4)")
+        self.assertEqual(len(rows), 5)
+
+    def test_empty_report_has_only_header(self):
+        with self.Session() as db:
+            self.assertEqual(excel_utils.generate_settlement_report(self.path, db=db), 0)
+        self.assertEqual(load_workbook(self.path).active.max_row, 1)
+
+    def report_peak_memory(self, count):
+        self.add_projects(count, start=count * 10)
+        with self.Session() as db:
+            tracemalloc.start()
+            excel_utils.generate_settlement_report(self.path, db=db, batch_size=100)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            db.query(models.ProjectFeeDetails).delete()
+            db.query(models.ProjectInfo).delete()
+            db.commit()
+        return peak
+
+    def test_memory_does_not_grow_with_project_count(self):
+        small = self.report_peak_memory(300)
+        large = self.report_peak_memory(1500)
+        self.assertLess(large, small * 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
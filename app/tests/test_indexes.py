@@ -0,0 +1,105 @@
+import unittest
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.scripts.add_indexes import add_missing_indexes
+
+
+def query_plan(engine, stmt):
+    """用 SQLite 的 EXPLAIN QUERY PLAN 查看语句的执行计划。"""
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return " | ".join(row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+
+
+def make_engine():
+    return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+class TestHotQueryIndexes(unittest.TestCase):
+    """热点查询都应走索引查找，而不是全表扫描。"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = make_engine()
+        models.Base.metadata.create_all(cls.engine)
+
+    def assert_index_seek(self, stmt, index_name):
+        plan = query_plan(self.engine, stmt)
+        self.assertIn(f"INDEX {index_name}", plan)
+        self.assertNotRegex(plan, r"\bSCAN (company_info|project_info)\b")
+
+    def test_company_by_name(self):
+        stmt = select(models.CompanyInfo).where(models.CompanyInfo.company_name == "深圳某某公司")
+        self.assert_index_seek(stmt, "uq_company_info_name_type")
+
+    def test_company_by_name_and_type(self):
+        stmt = select(models.CompanyInfo).where(
+            models.CompanyInfo.company_name == "深圳某某公司", models.CompanyInfo.company_type == "D"
+        )
+        self.assert_index_seek(stmt, "uq_company_info_name_type")
+
+    def test_company_by_short_name_and_type(self):
+        stmt = select(models.CompanyInfo).where(
+            models.CompanyInfo.short_name == "PR", models.CompanyInfo.company_type == "D"
+        )
+        self.assert_index_seek(stmt, "ix_company_info_short_name_type")
+
+    def test_company_by_email(self):
+        stmt = select(models.CompanyInfo).where(models.CompanyInfo.email == "a@example.com")
+        self.assert_index_seek(stmt, "ix_company_info_email")
+
+    def test_project_by_contract_number(self):
+        stmt = select(models.ProjectInfo).where(models.ProjectInfo.contract_number == "HT-001")
+        self.assert_index_seek(stmt, "ix_project_info_contract_number")
+
+    def test_project_by_serial_numbers(self):
+        stmt = select(models.ProjectInfo).filter_by(
+            p_serial_number="PR202504001", l_serial_number="25LDF_001", f_serial_number="HK-FRONT-25#001"
+        )
+        self.assert_index_seek(stmt, "ix_project_info_serial_numbers")
+
+
+class TestAddMissingIndexes(unittest.TestCase):
+    def setUp(self):
+        self.engine = make_engine()
+        models.Base.metadata.create_all(self.engine)
+        # 模拟旧库：表已存在，但还没有新声明的索引
+        with self.engine.begin() as conn:
+            for name in ("uq_company_info_name_type", "ix_company_info_short_name_type", "ix_company_info_email",
+                         "ix_project_info_contract_number", "ix_project_info_serial_numbers"):
+                conn.execute(text(f"DROP INDEX {name}"))
+
+    def test_creates_missing_indexes_once(self):
+        created = add_missing_indexes(self.engine)
+        self.assertEqual(
+            sorted(created),
+            ["ix_company_info_email", "ix_company_info_short_name_type", "ix_project_info_contract_number",
+             "ix_project_info_serial_numbers", "uq_company_info_name_type"],
+        )
+        self.assertEqual(add_missing_indexes(self.engine), [])
+
+    def test_skips_unique_index_on_duplicate_rows(self):
+        with self.engine.begin() as conn:
+            conn.execute(models.CompanyInfo.__table__.insert(), [
+                {"company_name": "深圳某某公司", "company_type": "D"},
+                {"company_name": "深圳某某公司", "company_type": "D"},
+            ])
+        created = add_missing_indexes(self.engine)
+        self.assertNotIn("uq_company_info_name_type", created)
+        self.assertIn("ix_company_info_email", created)
+
+    def test_skips_index_on_column_not_migrated_yet(self):
+        # 模拟还没跑 migrate_email_bodies 的库：emails_records 没有 body_hash 列
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_emails_records_body_hash"))
+            conn.execute(text("ALTER TABLE emails_records DROP COLUMN body_hash"))
+        created = add_missing_indexes(self.engine)
+        self.assertNotIn("ix_emails_records_body_hash", created)
+        self.assertIn("ix_company_info_email", created)
+
+
+if __name__ == "__main__":
+    unittest.main()
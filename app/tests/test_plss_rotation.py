@@ -0,0 +1,50 @@
+import datetime
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import database, email_utils, models
+
+
+class TestAllocatePlssEmail(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_project(self, alias, created_at):
+        with self.Session() as db:
+            db.add(models.ProjectInfo(project_name="p", current_plss_email=alias, created_at=created_at))
+            db.commit()
+
+    def test_rotates_through_all_aliases(self):
+        allocated = [email_utils.allocate_plss_email() for _ in range(6)]
+        self.assertEqual(allocated, ["A", "B", "C", "D", "A", "B"])
+
+    def test_first_allocation_continues_from_last_project(self):
+        self.add_project("A", datetime.datetime(2025, 1, 1))
+        self.add_project("C", datetime.datetime(2025, 1, 2))
+        self.assertEqual(email_utils.allocate_plss_email(), "D")
+        self.assertEqual(email_utils.allocate_plss_email(), "A")
+
+    def test_does_not_scan_projects_once_seeded(self):
+        email_utils.allocate_plss_email()
+        with mock.patch.object(email_utils, "_last_assigned_plss_alias") as scan:
+            email_utils.allocate_plss_email()
+        scan.assert_not_called()
+
+    def test_falls_back_to_project_scan_without_rotation_table(self):
+        self.add_project("B", datetime.datetime(2025, 1, 1))
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP TABLE plss_rotation"))
+        self.assertEqual(email_utils.allocate_plss_email(), "C")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import datetime
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import database, models, project_context
+from app.company_directory import CompanyDirectory
+
+
+class TestLoadProjectContext(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self.Session() as db:
+            db.add_all([
+                models.CompanyInfo(company_name="深圳B公司", company_type="B", short_name="BB"),
+                models.CompanyInfo(company_name="香港C公司", company_type="C", short_name="CC"),
+                models.CompanyInfo(company_name="领先D公司", company_type="D", short_name="LF"),
+                models.CompanyInfo(company_name="前沿D公司", company_type="D", short_name="FR"),
+            ])
+            project = models.ProjectInfo(
+                project_name="测试项目", contract_number="HT-001", company_b_name="深圳B公司",
+                company_c_name="香港C公司", company_d_name="领先D公司",
+            )
+            project.fee_details = models.ProjectFeeDetails(
+                winning_amount=Decimal("1000.00"), winning_time=datetime.date(2025, 5, 1)
+            )
+            db.add(project)
+            db.add(models.ProjectInfo(project_name="无费用项目", contract_number="HT-002"))
+            db.commit()
+
+        directory = CompanyDirectory(check_interval=3600, version_getter=lambda: "1", version_bumper=lambda: None)
+        directory.load()
+        patcher = mock.patch.object(project_context, "company_directory", directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.queries = 0
+
+        def count(*args):
+            self.queries += 1
+        event.listen(self.engine, "before_cursor_execute", count)
+
+    def test_loads_project_fees_and_companies_in_one_query(self):
+        with self.Session() as db:
+            context = project_context.load_project_context(db, "HT-001")
+            self.assertEqual(context.winning_amount, Decimal("1000.00"))
+            self.assertEqual(context.winning_time, datetime.date(2025, 5, 1))
+            self.assertEqual(context.b_company.short_name, "BB")
+            self.assertEqual(context.c_company.short_name, "CC")
+            self.assertEqual(context.d_company.short_name, "LF")
+        self.assertEqual(self.queries, 1)
+
+    def test_companies_follow_project_changes(self):
+        with self.Session() as db:
+            context = project_context.load_project_context(db, "HT-001")
+            context.project.company_d_name = "前沿D公司"
+            self.assertEqual(context.d_company.short_name, "FR")
+
+    def test_project_without_fee_details(self):
+        with self.Session() as db:
+            context = project_context.load_project_context(db, "HT-002")
+            self.assertIsNone(context.fee_details)
+            self.assertIsNone(context.winning_amount)
+            self.assertIsNone(context.b_company)
+
+    def test_missing_project(self):
+        with self.Session() as db:
+            self.assertIsNone(project_context.load_project_context(db, "HT-404"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import async_email, database, email_chains, email_utils, models, send_ledger, tasks
+
+SMTP = {"host": "smtp.example.com", "port": 465, "username": "u", "password": "p", "from": "b@example.com"}
+
+
+class LedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 发送记录不在这里验证，避免全局写入器的后台线程在测试结束后继续往真实库写
+        patcher = mock.patch.object(tasks, "get_email_record_writer")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestSendLedger(LedgerTestCase):
+    def test_claim_then_mark_sent(self):
+        key = send_ledger.make_message_key("chain", "abc", 0)
+        with self.Session() as db:
+            self.assertEqual(send_ledger.claim(db, key, owner="t1"), send_ledger.CLAIMED)
+            self.assertEqual(send_ledger.claim(db, key, owner="t2"), send_ledger.IN_PROGRESS)
+            send_ledger.mark_sent(db, key)
+            self.assertEqual(send_ledger.claim(db, key, owner="t1"), send_ledger.ALREADY_SENT)
+            self.assertEqual(send_ledger.claim(db, key, owner="t3"), send_ledger.ALREADY_SENT)
+
+    def test_same_owner_can_reclaim(self):
+        key = send_ledger.make_message_key("task", "t1")
+        with self.Session() as db:
+            self.assertEqual(send_ledger.claim(db, key, owner="t1"), send_ledger.CLAIMED)
+            self.assertEqual(send_ledger.claim(db, key, owner="t1"), send_ledger.CLAIMED)
+
+    def test_release_allows_retry(self):
+        key = send_ledger.make_message_key("task", "t1")
+        with self.Session() as db:
+            send_ledger.claim(db, key, owner="t1")
+            send_ledger.release(db, key)
+            self.assertEqual(send_ledger.claim(db, key, owner="t2"), send_ledger.CLAIMED)
+
+    def test_expired_lease_can_be_taken_over(self):
+        key = send_ledger.make_message_key("chain", "abc", 1)
+        with self.Session() as db:
+            send_ledger.claim(db, key, owner="dead-worker")
+            db.query(models.EmailSendLedger).update(
+                {"claimed_at": datetime.now() - timedelta(seconds=send_ledger.SEND_LEDGER_LEASE + 1)}
+            )
+            db.commit()
+            self.assertEqual(send_ledger.claim(db, key, owner="t2"), send_ledger.CLAIMED)
+            self.assertEqual(send_ledger.claim(db, key, owner="t3"), send_ledger.IN_PROGRESS)
+
+
+class TestIdempotentTasks(LedgerTestCase):
+    def test_redelivered_chain_step_does_not_resend_or_reschedule(self):
+        root = {"to_email": "c@example.com", "subject": "B3", "content": "<p>b3</p>", "smtp_config": SMTP,
+                "stage": "B3", "followup_task_args": {
+                    "to_email": "b@example.com", "subject": "B4", "content": "<p>b4</p>", "smtp_config": SMTP,
+                    "stage": "B4", "followup_task_args": None, "followup_delay": 400}}
+        chain_id = email_chains.create_email_chain(root)
+
+        with mock.patch.object(email_utils, "send_email", return_value=(True, "")) as send_email:
+            tasks.send_email_chain_step.apply(args=(chain_id, 0), task_id="first")
+            with self.Session() as db:
+                due_at = email_chains.load_chain_step(db, chain_id, 1).due_at
+            tasks.send_email_chain_step.apply(args=(chain_id, 0), task_id="redelivered")
+
+        send_email.assert_called_once()
+        with self.Session() as db:
+            self.assertEqual(email_chains.load_chain_step(db, chain_id, 1).due_at, due_at)
+
+    def test_retry_after_followup_failure_does_not_resend(self):
+        kwargs = {
+            "to_email": "b@example.com", "subject": "A1", "content": "<p>a1</p>", "smtp_config": SMTP,
+            "stage": "A1", "followup_delay": 3,
+            "followup_task_args": {"to_email": "d@example.com", "subject": "A2", "content": "<p>a2</p>",
+                                   "smtp_config": SMTP, "stage": "A2", "followup_delay": 600},
+        }
+        followup = mock.Mock(side_effect=[ConnectionError("broker down"), mock.Mock()])
+        with mock.patch.object(email_utils, "send_email", return_value=(True, "")) as send_email, \
+                mock.patch.object(tasks.send_email_with_followup_delay, "apply_async", followup):
+            tasks.send_email_with_followup_delay.apply(kwargs=kwargs, task_id="a1-task")
+
+        send_email.assert_called_once()
+        self.assertEqual(followup.call_count, 2)
+        self.assertEqual(followup.call_args.kwargs["countdown"], 600)
+
+    def test_redelivered_async_batch_sends_each_job_once(self):
+        jobs = [{"to_email": f"d{i}@example.com", "subject": "A2", "content": "<p>a2</p>", "smtp_config": SMTP,
+                 "stage": "A2"} for i in range(3)]
+        send_many = mock.Mock(side_effect=[[(True, ""), (False, "421 busy"), (True, "")], [(True, "")]])
+        with mock.patch.object(async_email, "send_many", send_many):
+            first = tasks.send_emails_async_batch.apply(args=(jobs,), task_id="batch").get()
+            again = tasks.send_emails_async_batch.apply(args=(jobs,), task_id="batch").get()
+
+        self.assertEqual([r["success"] for r in first], [True, False, True])
+        self.assertEqual([r["success"] for r in again], [True, True, True])
+        self.assertEqual(send_many.call_args_list[1].args[0], [jobs[1]])
+        self.assertEqual(tasks.get_email_record_writer.return_value.add.call_count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import os
+import unittest
+from unittest import mock
+
+import paramiko
+
+from app import sftp_pool as sftp_pool_module, tasks
+from app.sftp_pool import SFTPConnectionPool
+
+CONFIG = {"host": "nas.example.com", "port": 6000, "username": "u", "password": "p"}
+
+
+class FakeTransport:
+    def __init__(self, sock):
+        self.active = True
+        self.keepalive = None
+        self.closed = False
+
+    def connect(self, username, password):
+        pass
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+    def is_active(self):
+        return self.active and not self.closed
+
+    def is_authenticated(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSFTP:
+    def __init__(self, transport, put_errors):
+        self.transport = transport
+        self.put_errors = put_errors
+        self.uploaded = []
+
+    def put(self, local_file, remote_path):
+        error = self.put_errors.pop(0) if self.put_errors else None
+        if error is not None:
+            if isinstance(error, (EOFError, paramiko.SSHException)):
+                self.transport.active = False
+            raise error
+        self.uploaded.append(remote_path)
+
+    def get_channel(self):
+        channel = mock.Mock(closed=not self.transport.is_active())
+        channel.get_transport.return_value = self.transport
+        return channel
+
+    def close(self):
+        pass
+
+
+class SFTPPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.transports = []
+        self.clients = []
+        self.put_errors = []
+
+        def make_transport(sock):
+            transport = FakeTransport(sock)
+            self.transports.append(transport)
+            return transport
+
+        def make_client(transport):
+            client = FakeSFTP(transport, self.put_errors)
+            self.clients.append(client)
+            return client
+
+        for patcher in (
+            mock.patch.object(sftp_pool_module.socket, "create_connection"),
+            mock.patch.object(sftp_pool_module.paramiko, "Transport", side_effect=make_transport),
+            mock.patch.object(sftp_pool_module.paramiko.SFTPClient, "from_transport", side_effect=make_client),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pool = SFTPConnectionPool(idle_timeout=300, keepalive=15)
+
+    def uploaded(self):
+        return [path for client in self.clients for path in client.uploaded]
+
+
+class TestSFTPConnectionPool(SFTPPoolTestCase):
+    def test_reuses_authenticated_transport(self):
+        self.assertEqual(self.pool.put_files(CONFIG, [("/tmp/a.xlsx", "dir/a.xlsx")]), [])
+        self.assertEqual(self.pool.put_files(CONFIG, [("/tmp/b.xlsx", "dir/b.xlsx")]), [])
+        self.assertEqual(len(self.transports), 1)
+        self.assertEqual(self.transports[0].keepalive, 15)
+        self.assertEqual(self.uploaded(), ["dir/a.xlsx", "dir/b.xlsx"])
+
+    def test_reconnects_when_idle_transport_died(self):
+        self.pool.put_files(CONFIG, [("/tmp/a.xlsx", "dir/a.xlsx")])
+        self.transports[0].active = False
+        self.pool.put_files(CONFIG, [("/tmp/b.xlsx", "dir/b.xlsx")])
+        self.assertEqual(len(self.transports), 2)
+        self.assertTrue(self.transports[0].closed)
+
+    def test_retries_remaining_files_after_connection_drop(self):
+        self.put_errors.extend([None, EOFError("connection reset")])
+        files = [(f"/tmp/{n}.xlsx", f"dir/{n}.xlsx") for n in "abc"]
+        self.assertEqual(self.pool.put_files(CONFIG, files), [])
+        self.assertEqual(len(self.transports), 2)
+        self.assertEqual(self.uploaded(), ["dir/a.xlsx", "dir/b.xlsx", "dir/c.xlsx"])
+
+    def test_missing_local_file_fails_only_that_file(self):
+        self.put_errors.extend([FileNotFoundError("/tmp/a.xlsx")])
+        files = [("/tmp/a.xlsx", "dir/a.xlsx"), ("/tmp/b.xlsx", "dir/b.xlsx")]
+        self.assertEqual(self.pool.put_files(CONFIG, files), ["/tmp/a.xlsx"])
+        self.assertEqual(len(self.transports), 1)
+        self.assertEqual(self.uploaded(), ["dir/b.xlsx"])
+
+    def test_sftp_protocol_error_fails_only_that_file(self):
+        self.put_errors.extend([paramiko.SFTPError("Garbage packet received")])
+        files = [("/tmp/a.xlsx", "dir/a.xlsx"), ("/tmp/b.xlsx", "dir/b.xlsx")]
+        self.assertEqual(self.pool.put_files(CONFIG, files), ["/tmp/a.xlsx"])
+        self.assertEqual(self.uploaded(), ["dir/b.xlsx"])
+
+    def test_unexpected_error_fails_remaining_files_without_raising(self):
+        self.put_errors.extend([RuntimeError("boom")])
+        files = [("/tmp/a.xlsx", "dir/a.xlsx"), ("/tmp/b.xlsx", "dir/b.xlsx")]
+        self.assertEqual(self.pool.put_files(CONFIG, files), ["/tmp/a.xlsx", "/tmp/b.xlsx"])
+
+    def test_gives_up_after_second_connection_failure(self):
+        self.put_errors.extend([paramiko.SSHException("gone"), paramiko.SSHException("gone again")])
+        self.assertEqual(self.pool.put_files(CONFIG, [("/tmp/a.xlsx", "dir/a.xlsx")]), ["/tmp/a.xlsx"])
+        self.assertEqual(len(self.transports), 2)
+
+
+class TestSFTPConfig(unittest.TestCase):
+    def test_each_caller_keeps_its_own_account_variables(self):
+        env = {"SFTP_HOST": "nas", "SFTP_PORT": "6000", "SFTP_USER": "celery", "SFTP_PASS": "p1",
+               "SFTP_USERNAME": "legacy", "SFTP_PASSWORD": "p2"}
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(sftp_pool_module.sftp_config_from_env("SFTP_USER", "SFTP_PASS"),
+                             {"host": "nas", "port": 6000, "username": "celery", "password": "p1"})
+            self.assertEqual(sftp_pool_module.sftp_config_from_env("SFTP_USERNAME", "SFTP_PASSWORD")["username"],
+                             "legacy")
+
+
+class TestUploadTasks(SFTPPoolTestCase):
+    def test_project_uploads_share_one_session(self):
+        with mock.patch.object(tasks, "sftp_pool", self.pool), \
+                mock.patch.object(tasks, "sftp_config_from_env", return_value=CONFIG):
+            self.assertTrue(tasks.upload_files_to_sftp_task([("/tmp/BC.xlsx", "BC.xlsx"), ("/tmp/BD.xlsx", "BD.xlsx")]))
+            self.assertTrue(tasks.upload_file_to_sftp_task("/tmp/CD.xlsx", "CD.xlsx"))
+        self.assertEqual(len(self.transports), 1)
+        self.assertEqual(self.uploaded(), [f"{tasks.SFTP_SETTLEMENT_DIR}/{n}.xlsx" for n in ("BC", "BD", "CD")])
+
+
+if __name__ == "__main__":
+    unittest.main()
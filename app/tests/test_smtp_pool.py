@@ -0,0 +1,109 @@
+import smtplib
+import unittest
+from email.message import EmailMessage
+from unittest import mock
+
+from app.email_utils import SMTPConnectionPool
+
+SMTP_CONFIG = {"host": "smtp.example.com", "port": 465, "username": "a@example.com", "password": "x"}
+
+
+class FakeSMTP:
+    """假的 SMTP 连接：可指定在某一步（mail / rcpt / data）抛出服务端断开。"""
+
+    def __init__(self, disconnect_at=None):
+        self.disconnect_at = disconnect_at
+        self.calls = []
+        self.delivered = []
+        self.closed = False
+
+    def _step(self, name):
+        self.calls.append(name)
+        if name == self.disconnect_at:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+    def noop(self):
+        return 250, b"OK"
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, from_addr):
+        self._step("mail")
+        return 250, b"OK"
+
+    def rcpt(self, addr):
+        self._step("rcpt")
+        return 250, b"OK"
+
+    def data(self, msg):
+        self._step("data")
+        self.delivered.append(msg)
+        return 250, b"OK"
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class SMTPConnectionPoolTest(unittest.TestCase):
+    def make_pool(self, *connections):
+        pool = SMTPConnectionPool()
+        connect = mock.patch.object(pool, "_connect", side_effect=list(connections))
+        self.connect = connect.start()
+        self.addCleanup(connect.stop)
+        return pool
+
+    def test_disconnect_before_data_reconnects_and_sends_once(self):
+        stale, fresh = FakeSMTP(disconnect_at="mail"), FakeSMTP()
+        pool = self.make_pool(stale, fresh)
+
+        pool.sendmail(SMTP_CONFIG, "a@example.com", ["b@example.com"], "hello")
+
+        self.assertEqual(self.connect.call_count, 2)
+        self.assertTrue(stale.closed)
+        self.assertEqual(stale.delivered, [])
+        self.assertEqual(fresh.delivered, ["hello"])
+
+    def test_disconnect_during_rcpt_is_retried(self):
+        stale, fresh = FakeSMTP(disconnect_at="rcpt"), FakeSMTP()
+        pool = self.make_pool(stale, fresh)
+
+        pool.sendmail(SMTP_CONFIG, "a@example.com", ["b@example.com"], "hello")
+
+        self.assertEqual(fresh.delivered, ["hello"])
+
+    def test_disconnect_during_data_is_not_retried(self):
+        dropped, spare = FakeSMTP(disconnect_at="data"), FakeSMTP()
+        pool = self.make_pool(dropped, spare)
+
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            pool.sendmail(SMTP_CONFIG, "a@example.com", ["b@example.com"], "hello")
+
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertTrue(dropped.closed)
+        self.assertEqual(spare.calls, [])
+
+    def test_send_message_uses_header_addresses_and_drops_bcc(self):
+        smtp = FakeSMTP()
+        pool = self.make_pool(smtp)
+        recipients = []
+        smtp.rcpt = lambda addr: recipients.append(addr) or (250, b"OK")
+        message = EmailMessage()
+        message["From"] = "Sender <a@example.com>"
+        message["To"] = "b@example.com"
+        message["Cc"] = "c@example.com"
+        message["Bcc"] = "d@example.com"
+        message.set_content("hello")
+
+        pool.send_message(SMTP_CONFIG, message)
+
+        self.assertEqual(recipients, ["b@example.com", "d@example.com", "c@example.com"])
+        self.assertNotIn(b"Bcc:", smtp.delivered[0])
+        self.assertIn(b"\r\n", smtp.delivered[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -28,5 +28,18 @@ class TestSimplifyToTraditional(unittest.TestCase):
     def test_non_chinese_characters(self):
         self.assertEqual(simplify_to_traditional("123 ABC !@#"), "123 ABC !@#")
 
+class TestSharedConverter(unittest.TestCase):
+    def test_matches_fresh_converter(self):
+        from app.utils import simplify_to_traditional as shared
+        for text in ("中华人民共和国", "汉字", "电脑", "", "123 ABC !@#"):
+            self.assertEqual(shared(text), simplify_to_traditional(text))
+
+    def test_repeated_conversion_is_memoized(self):
+        from app.utils import simplify_to_traditional as shared, _convert_s2t
+        shared("深圳市测试采购单位")
+        hits = _convert_s2t.cache_info().hits
+        self.assertEqual(shared("深圳市测试采购单位"), "深圳市測試採購單位")
+        self.assertEqual(_convert_s2t.cache_info().hits, hits + 1)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
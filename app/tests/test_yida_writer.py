@@ -0,0 +1,155 @@
+import time
+import unittest
+from unittest import mock
+
+import requests
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import database, models, utils, yida_writer
+from app.yida_writer import YidaBatchWriter, YidaForm
+
+
+class FakeBatchSave:
+    """batchSave 接口的本地替身：记录每次请求，可指定第几次调用明确失败（限流）或结果不确定（读超时）。"""
+
+    def __init__(self, fail_calls=(), ambiguous_calls=()):
+        self.calls = []
+        self.fail_calls = set(fail_calls)
+        self.ambiguous_calls = set(ambiguous_calls)
+
+    def __call__(self, access_token, app_type, system_token, user_id, form_uuid, form_data_list):
+        self.calls.append(list(form_data_list))
+        if len(self.calls) in self.fail_calls:
+            return {"success": False, "detail": {"code": "Throttling"}, "retryable": True}
+        if len(self.calls) in self.ambiguous_calls:
+            return {"success": False, "error": "Read timed out", "retryable": False}
+        return {"success": True, "formInstanceIds": [f"FINST-{i}" for i in range(len(form_data_list))]}
+
+
+def make_writer(sender, **kwargs):
+    return YidaBatchWriter(
+        app_type="APP", system_token="TOKEN", user_id="1", form_uuid="FORM",
+        sender=sender, token_provider=lambda: "access-token", **kwargs
+    )
+
+
+class TestYidaBatchWriter(unittest.TestCase):
+    def test_flush_splits_into_batches(self):
+        sender = FakeBatchSave()
+        writer = make_writer(sender, max_batch_size=3, flush_interval=60)
+        with writer._lock:  # 直接塞入积压，避免后台线程抢先写入
+            writer._pending = [{"item": {"n": i}, "attempts": 0} for i in range(7)]
+        self.assertEqual(writer.flush(), 7)
+        self.assertEqual([len(c) for c in sender.calls], [3, 3, 1])
+
+    def test_only_failed_batch_is_retried(self):
+        sender = FakeBatchSave(fail_calls={2})
+        writer = make_writer(sender, max_batch_size=2, flush_interval=60)
+        with writer._lock:
+            writer._pending = [{"item": {"n": i}, "attempts": 0} for i in range(6)]
+        self.assertEqual(writer.flush(), 4)
+        self.assertEqual(writer.pending_count(), 2)
+        self.assertEqual(writer.flush(), 2)
+        written = [d["n"] for call in sender.calls for d in call]
+        self.assertEqual(sorted(written), [0, 1, 2, 2, 3, 3, 4, 5])
+        self.assertEqual(sender.calls[-1], [{"n": 2}, {"n": 3}])
+
+    def test_gives_up_after_max_attempts(self):
+        sender = FakeBatchSave(fail_calls={1, 2})
+        writer = make_writer(sender, max_batch_size=10, flush_interval=60, max_attempts=2)
+        with writer._lock:
+            writer._pending = [{"item": {"n": 0}, "attempts": 0}]
+        writer.flush()
+        writer.flush()
+        self.assertEqual(writer.pending_count(), 0)
+        self.assertEqual(len(sender.calls), 2)
+
+    def test_ambiguous_batch_is_not_resent(self):
+        sender = FakeBatchSave(ambiguous_calls={1})
+        writer = make_writer(sender, max_batch_size=2, flush_interval=60)
+        with writer._lock:
+            writer._pending = [{"item": {"n": i}, "attempts": 0} for i in range(3)]
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.pending_count(), 0)
+        self.assertEqual(len(sender.calls), 2)
+
+    def test_size_and_time_window_trigger_background_flush(self):
+        sender = FakeBatchSave()
+        writer = make_writer(sender, max_batch_size=2, flush_interval=0.2)
+        writer.add({"n": 0})
+        writer.add({"n": 1})
+        writer.add({"n": 2})
+        deadline = time.monotonic() + 3
+        while writer.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        writer.close()
+        self.assertEqual(writer.pending_count(), 0)
+        self.assertEqual(sorted(d["n"] for call in sender.calls for d in call), [0, 1, 2])
+
+
+class TestEmailAuditOutbox(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        models.Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        patcher = mock.patch.object(database, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for i in range(5):
+            yida_writer.enqueue_email_audit({"n": i})
+
+    def flush(self, sender):
+        form = YidaForm("APP", "TOKEN", "1", "FORM", sender=sender, token_provider=lambda: "access-token")
+        with mock.patch.object(yida_writer, "YIDA_BATCH_SIZE", 2):
+            return yida_writer.flush_email_audit_outbox(form)
+
+    def statuses(self):
+        with self.Session() as db:
+            return [(row.status, row.attempts) for row in db.query(models.EmailAuditOutbox).order_by(models.EmailAuditOutbox.id)]
+
+    def test_writes_outbox_in_batches(self):
+        sender = FakeBatchSave()
+        self.assertEqual(self.flush(sender), 5)
+        self.assertEqual(sender.calls, [[{"n": 0}, {"n": 1}], [{"n": 2}, {"n": 3}], [{"n": 4}]])
+        self.assertEqual(self.statuses(), [("sent", 1)] * 5)
+
+    def test_failed_batch_stays_pending_for_next_run(self):
+        sender = FakeBatchSave(fail_calls={2})
+        self.assertEqual(self.flush(sender), 2)
+        self.assertEqual(self.statuses(), [("sent", 1)] * 2 + [("pending", 1)] * 2 + [("pending", 0)])
+        self.assertEqual(self.flush(sender), 3)
+        self.assertEqual(sender.calls[2], [{"n": 2}, {"n": 3}])
+
+    def test_ambiguous_batch_is_never_resent(self):
+        sender = FakeBatchSave(ambiguous_calls={1})
+        self.assertEqual(self.flush(sender), 0)
+        self.assertEqual(self.flush(sender), 3)
+        self.assertEqual(self.statuses()[:2], [("unknown", 1)] * 2)
+        self.assertEqual([d["n"] for call in sender.calls for d in call], [0, 1, 2, 3, 4])
+
+
+class TestYidaWriteRetryable(unittest.TestCase):
+    def batch_save(self, **post):
+        with mock.patch.object(utils.dingtalk_client, "post", **post):
+            return utils.batch_create_yida_form_instances("token", "APP", "TOKEN", "1", "FORM", [{"n": 0}])
+
+    def response(self, status_code, body):
+        response = mock.Mock(status_code=status_code, text=str(body))
+        response.json.return_value = body
+        return response
+
+    def test_retries_only_when_nothing_was_created(self):
+        self.assertTrue(self.batch_save(side_effect=requests.exceptions.ConnectTimeout())["retryable"])
+        self.assertTrue(self.batch_save(return_value=self.response(429, {"code": "Throttling"}))["retryable"])
+        self.assertTrue(self.batch_save(return_value=self.response(503, {}))["retryable"])
+
+    def test_ambiguous_failures_are_not_retryable(self):
+        self.assertFalse(self.batch_save(side_effect=requests.exceptions.ReadTimeout())["retryable"])
+        self.assertFalse(self.batch_save(return_value=self.response(502, {}))["retryable"])
+        self.assertFalse(self.batch_save(return_value=self.response(504, {}))["retryable"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,16 @@ import os
 import random
 import json
 import time
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 
 import requests
+import urllib3
+
+from app import dingtalk_client
+from app.sftp_pool import sftp_pool, sftp_config_from_env
 
 from dotenv import load_dotenv
 import logging
@@ -17,6 +24,11 @@ import smtplib
 
 import traceback
 
+try:
+    import fcntl  # 跨进程文件锁，仅 POSIX 可用
+except ImportError:
+    fcntl = None
+
 load_dotenv()
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -32,17 +44,51 @@ def generate_random_number() -> list[int]:
     return [random.randint(5, 60) for _ in range(3)]
 
 
-# 宜搭get access token
-def get_dingtalk_access_token() -> str:
-    # 尝试读取已有 token
-    if os.path.exists(TOKEN_FILE):
+# 宜搭 access token 缓存：
+# - 进程内存命中时不读磁盘、不发请求
+# - 距离过期不足 DINGTALK_TOKEN_REFRESH_MARGIN 秒即提前刷新
+# - 线程锁 + 文件锁保证同一时刻只有一个线程/进程去换新 token，其余进程从文件读取结果
+DINGTALK_TOKEN_REFRESH_MARGIN = int(os.getenv("DINGTALK_TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_LOCK_FILE = TOKEN_FILE + ".lock"
+
+_token_cache = {"access_token": None, "expires_at": 0.0}
+_token_lock = threading.Lock()
+
+
+def _token_is_fresh(data: dict | None, now: float) -> bool:
+    return bool(data and data.get("access_token")) and now < data.get("expires_at", 0) - DINGTALK_TOKEN_REFRESH_MARGIN
+
+
+@contextmanager
+def _token_file_lock():
+    if fcntl is None:
+        yield
+        return
+    with open(TOKEN_LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_token_file() -> dict | None:
+    try:
         with open(TOKEN_FILE, "r") as f:
-            data = json.load(f)
-            if time.time() < data.get("expires_at", 0):
-                print("✅ 使用缓存的 accessToken")
-                return data["access_token"]
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
 
-    # 缓存不存在或已过期，重新获取
+def _write_token_file(data: dict):
+    # 先写临时文件再替换，其他进程不会读到半截 JSON
+    tmp_file = f"{TOKEN_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_file, TOKEN_FILE)
+
+
+def _fetch_dingtalk_access_token() -> dict | None:
     url = "https://api.dingtalk.com/v1.0/oauth2/accessToken"
     headers = {
         "Content-Type": "application/json"
@@ -53,7 +99,7 @@ def get_dingtalk_access_token() -> str:
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = dingtalk_client.post(url, json=payload, headers=headers)
         response.raise_for_status()
         res_data = response.json()
         access_token = res_data.get("accessToken")
@@ -61,12 +107,10 @@ def get_dingtalk_access_token() -> str:
 
         if access_token:
             print("✅ 成功获取新的 accessToken")
-            with open(TOKEN_FILE, "w") as f:
-                json.dump({
-                    "access_token": access_token,
-                    "expires_at": time.time() + expire_in - 60  # 提前 1 分钟过期
-                }, f)
-            return access_token
+            return {
+                "access_token": access_token,
+                "expires_at": time.time() + expire_in - 60  # 提前 1 分钟过期
+            }
         else:
             print("⚠️ 获取失败，响应内容：", res_data)
             return None
@@ -74,6 +118,55 @@ def get_dingtalk_access_token() -> str:
         print("❌ 请求失败：", e)
         return None
 
+
+# 宜搭get access token
+def get_dingtalk_access_token() -> str:
+    if _token_is_fresh(_token_cache, time.time()):
+        return _token_cache["access_token"]
+
+    with _token_lock:
+        now = time.time()
+        if _token_is_fresh(_token_cache, now):
+            return _token_cache["access_token"]
+
+        with _token_file_lock():
+            # 其他进程可能刚刚刷新过
+            data = _read_token_file()
+            if not _token_is_fresh(data, now):
+                fresh = _fetch_dingtalk_access_token()
+                if fresh:
+                    _write_token_file(fresh)
+                    data = fresh
+
+            if data and data.get("access_token") and now < data.get("expires_at", 0):
+                _token_cache.update(access_token=data["access_token"], expires_at=data["expires_at"])
+                return data["access_token"]
+
+        # 刷新失败且旧 token 已过期
+        return None
+
+# 宜搭新增表单实例失败后能否重发：只有确定钉钉没有落库时才可以。
+# 连接没建立、429 / 503 / 其他 4xx 这类明确拒绝可以重发；读超时、连接中途断开、
+# 200 但结果不完整、500 / 502 / 504 时服务端可能已经建好实例，重发会产生重复记录
+def _yida_write_retryable(status_code: int) -> bool:
+    return status_code == 503 or 400 <= status_code < 500
+
+
+def _request_not_sent(e: requests.exceptions.RequestException) -> bool:
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def _response_json(response: requests.Response) -> dict:
+    try:
+        data = response.json()
+    except ValueError:  # 网关返回的 HTML 错误页等
+        return {"status_code": response.status_code, "text": response.text[:500]}
+    return data if isinstance(data, dict) else {"result": data}
+
+
 # 更新宜搭邮件管理表单实例
 def create_yida_form_instance(
     access_token: str,
@@ -98,8 +191,8 @@ def create_yida_form_instance(
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        data = response.json()
+        response = dingtalk_client.post(url, json=payload, headers=headers)
+        data = _response_json(response)
 
         # 判断是否成功（钉钉返回的业务字段）
         if response.status_code == 200 and data.get("result"):
@@ -107,11 +200,66 @@ def create_yida_form_instance(
             return {"success": True, "formInstanceId": data["result"]}
         else:
             logger.error("⚠️ 表单创建失败，响应内容：%s", data)
-            return {"success": False, "detail": data}
+            return {"success": False, "detail": data, "retryable": _yida_write_retryable(response.status_code)}
 
     except requests.exceptions.RequestException as e:
         logger.error("❌ 网络请求失败：%s", e)
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": str(e), "retryable": _request_not_sent(e)}
+
+
+# 批量新增宜搭表单实例（batchSave 接口），一次请求写入多条
+def batch_create_yida_form_instances(
+    access_token: str,
+    app_type: str,
+    system_token: str,
+    user_id: str,
+    form_uuid: str,
+    form_data_list: list[dict],
+) -> dict:
+    url = "https://api.dingtalk.com/v1.0/yida/forms/instances/batchSave"
+    headers = {
+        "Content-Type": "application/json",
+        "x-acs-dingtalk-access-token": access_token
+    }
+
+    payload = {
+        "appType": app_type,
+        "systemToken": system_token,
+        "userId": user_id,
+        "formUuid": form_uuid,
+        "formDataJsonList": [json.dumps(form_data, ensure_ascii=False) for form_data in form_data_list],
+        "noExecuteExpression": True,
+        "asynchronousExecution": False,
+        "keepRunningAfterException": False,
+    }
+
+    try:
+        response = dingtalk_client.post(url, json=payload, headers=headers)
+        data = _response_json(response)
+
+        # keepRunningAfterException=False：要么整批成功，要么整批失败
+        if response.status_code == 200 and len(data.get("result") or []) == len(form_data_list):
+            logger.info("✅ 批量表单创建成功，共 %s 条", len(form_data_list))
+            return {"success": True, "formInstanceIds": data["result"]}
+        else:
+            logger.error("⚠️ 批量表单创建失败，响应内容：%s", data)
+            return {"success": False, "detail": data, "retryable": _yida_write_retryable(response.status_code)}
+
+    except requests.exceptions.RequestException as e:
+        logger.error("❌ 网络请求失败：%s", e)
+        return {"success": False, "error": str(e), "retryable": _request_not_sent(e)}
+
+
+# 写入宜搭邮件管理表单（发送记录），表单配置从 .env 读取
+def create_email_audit_form_instance(form_data: dict) -> dict:
+    return create_yida_form_instance(
+        access_token=get_dingtalk_access_token(),
+        user_id=os.getenv("USER_ID"),
+        app_type=os.getenv("APP_TYPE"),
+        system_token=os.getenv("SYSTEM_TOKEN"),
+        form_uuid=os.getenv("FORM_UUID"),
+        form_data=form_data,
+    )
 
 
 def get_project_info_instance_id(contract_number: str):
@@ -148,8 +296,9 @@ def get_project_info_instance_id(contract_number: str):
         "searchFieldJson": json.dumps(search_conditions, ensure_ascii=False),
      }
 
+    resp = None
     try:
-        resp = requests.post("https://api.dingtalk.com/v2.0/yida/forms/instances/search", headers=headers, data=json.dumps(body))
+        resp = dingtalk_client.post("https://api.dingtalk.com/v2.0/yida/forms/instances/search", headers=headers, data=json.dumps(body))
         data = resp.json()
         # print("data: ", data)
         formInstanceId = data["data"][0]['formInstanceId']
@@ -157,7 +306,7 @@ def get_project_info_instance_id(contract_number: str):
     except requests.HTTPError as e:
         logger.error(f"❌ HTTP错误：{e}，响应：{getattr(e.response, 'text', '')}")
     except Exception as e:
-        print(resp.status_code, resp)
+        print(getattr(resp, "status_code", None), resp)
         logger.error(f"❌ 请求失败：{e}")
     return ""
 
@@ -204,23 +353,50 @@ def update_project_info_company_D(contract_number: str, company_d_name: str, for
         "formInstanceId": form_instance_id
      }
 
+    resp = None
     try:
-        resp = requests.put("https://api.dingtalk.com/v2.0/yida/forms/instances", headers=headers, data=json.dumps(body))
+        resp = dingtalk_client.put("https://api.dingtalk.com/v2.0/yida/forms/instances", headers=headers, data=json.dumps(body))
         logger.info("✅ 回写项目信息表单，D公司更新成功，ID：%s", resp.json()["result"])
         print("✅ 回写项目信息表单，D公司更新成功，ID：%s", resp.json()["result"])
         return "更新表单成功"
     except requests.HTTPError as e:
         logger.error(f"❌ HTTP错误：{e}，响应：{getattr(e.response, 'text', '')}")
     except Exception as e:
-        print(resp.status_code, resp)
+        print(getattr(resp, "status_code", None), resp)
         logger.error(f"❌ 请求失败：{e}")
     return "更新表单失败"
 
 
 
+# 简转繁转换器：加载词典较慢，每个进程只创建一次。
+# 记录创建时的 pid，Celery prefork 子进程里会重新创建自己的实例。
+_s2t_converter = None
+_s2t_pid = None
+_s2t_lock = threading.Lock()
+
+
+def _get_s2t_converter() -> OpenCC:
+    global _s2t_converter, _s2t_pid
+    if _s2t_converter is None or _s2t_pid != os.getpid():
+        with _s2t_lock:
+            if _s2t_converter is None or _s2t_pid != os.getpid():
+                _s2t_converter = OpenCC('s2t')  # s2t 表示 Simplified to Traditional
+                _s2t_pid = os.getpid()
+    return _s2t_converter
+
+
+@lru_cache(maxsize=int(os.getenv("S2T_CACHE_SIZE", "1024")))
+def _convert_s2t(text: str) -> str:
+    converter = _get_s2t_converter()
+    # OpenCC 实例未承诺线程安全，FastAPI 线程池中串行调用
+    with _s2t_lock:
+        return converter.convert(text)
+
+
 def simplify_to_traditional(text: str) -> str:
     """
     将简体中文转换为繁体中文。
+    项目名、采购单位等会在各阶段反复转换，结果做 LRU 缓存。
     
     参数：
         text (str): 简体中文字符串。
@@ -228,8 +404,7 @@ def simplify_to_traditional(text: str) -> str:
     返回：
         str: 转换后的繁体中文字符串。
     """
-    cc = OpenCC('s2t')  # s2t 表示 Simplified to Traditional
-    return cc.convert(text)
+    return _convert_s2t(text)
 
 
 def upload_file_to_sftp(local_file: str, filename: str) -> bool:
@@ -242,32 +417,17 @@ def upload_file_to_sftp(local_file: str, filename: str) -> bool:
     返回：
         bool: 成功为 True，失败为 False
     """
-    # 从环境变量读取配置
-    host = os.getenv("SFTP_HOST")
-    port = int(os.getenv("SFTP_PORT", "22"))
-    username = os.getenv("SFTP_USERNAME")
-    password = os.getenv("SFTP_PASSWORD")
+    # 从环境变量读取配置；连接从进程内的 SFTP 连接池复用
     remote_path = os.getenv("REMOTE_PATH")
 
     print("📂 上传文件：", local_file)
     print("📁 目标路径：", remote_path + filename)
 
-    try:
-        transport = paramiko.Transport((host, port))
-        transport.connect(username=username, password=password)
-        print("✅ 连接成功")
-
-        sftp = paramiko.SFTPClient.from_transport(transport)
-
-        sftp.put(local_file, remote_path + filename)
-
-        print("✅ 文件上传成功")
-        sftp.close()
-        transport.close()
-        return True
-
-    except Exception as e:
-        print("❌ 上传失败:", str(e))
+    failed = sftp_pool.put_files(sftp_config_from_env("SFTP_USERNAME", "SFTP_PASSWORD"), [(local_file, remote_path + filename)])
+    if failed:
+        print("❌ 上传失败:", local_file)
         return False
+    print("✅ 文件上传成功")
+    return True
 
 
@@ -0,0 +1,169 @@
+# app/yida_writer.py
+# 宜搭表单批量写入：按条数或时间窗口用 batchSave 接口一次写入多条，减少钉钉 API 调用次数和限流压力。
+# - YidaBatchWriter：攒在内存里，适合同步脚本这类退出前会 close() 的场景
+# - 邮件管理表单的发送记录先落库到 email_audit_outbox，由 beat 定时任务按批写入，worker 崩溃也不会丢
+import os
+from datetime import datetime
+from typing import Callable, Optional
+
+import logging
+
+from sqlalchemy.orm import Session
+
+from app import database, models
+from app.batch_writer import BatchWriter
+from app.utils import get_dingtalk_access_token, batch_create_yida_form_instances
+
+logger = logging.getLogger(__name__)
+
+YIDA_BATCH_SIZE = int(os.getenv("YIDA_BATCH_SIZE", "50"))              # 单次 batchSave 最多条数
+YIDA_FLUSH_INTERVAL = float(os.getenv("YIDA_FLUSH_INTERVAL", "5"))      # 最长攒批时间（秒）
+YIDA_MAX_ATTEMPTS = int(os.getenv("YIDA_MAX_ATTEMPTS", "5"))            # 每条记录最多尝试次数
+
+
+class YidaForm:
+    """一个宜搭表单的 batchSave 写入。"""
+
+    def __init__(
+        self,
+        app_type: str,
+        system_token: str,
+        user_id: str,
+        form_uuid: str,
+        sender: Callable[..., dict] = batch_create_yida_form_instances,
+        token_provider: Callable[[], str] = get_dingtalk_access_token,
+    ):
+        self.app_type = app_type
+        self.system_token = system_token
+        self.user_id = user_id
+        self.form_uuid = form_uuid
+        self.sender = sender
+        self.token_provider = token_provider
+
+    def batch_save(self, form_data_list: list[dict]) -> Optional[bool]:
+        """
+        True：已写入；False：确定没有写入（连接没建立、限流、明确的业务错误），可以重试；
+        None：请求已发出但结果不确定（读超时、5xx 等），钉钉可能已经建好实例，不能重发。
+        """
+        try:
+            access_token = self.token_provider()
+        except Exception:
+            logger.exception("❌ 获取钉钉 access token 失败")
+            return False
+        try:
+            result = self.sender(
+                access_token=access_token,
+                app_type=self.app_type,
+                system_token=self.system_token,
+                user_id=self.user_id,
+                form_uuid=self.form_uuid,
+                form_data_list=form_data_list,
+            )
+        except Exception:
+            logger.exception("❌ 宜搭批量写入异常，结果不确定")
+            return None
+        if result.get("success"):
+            return True
+        return False if result.get("retryable") else None
+
+
+class YidaBatchWriter(BatchWriter):
+    """按表单攒批写入宜搭（batchSave），攒批、重试规则见 BatchWriter。add() 的每一项是一条表单数据（字段 ID -> 值）。"""
+
+    def __init__(
+        self,
+        app_type: str,
+        system_token: str,
+        user_id: str,
+        form_uuid: str,
+        max_batch_size: int = YIDA_BATCH_SIZE,
+        flush_interval: float = YIDA_FLUSH_INTERVAL,
+        max_attempts: int = YIDA_MAX_ATTEMPTS,
+        sender: Callable[..., dict] = batch_create_yida_form_instances,
+        token_provider: Callable[[], str] = get_dingtalk_access_token,
+    ):
+        self.form = YidaForm(app_type, system_token, user_id, form_uuid, sender=sender, token_provider=token_provider)
+        super().__init__(self.form.batch_save, "宜搭记录", max_batch_size, flush_interval, max_attempts)
+
+
+EMAIL_AUDIT_BATCHES_PER_RUN = int(os.getenv("EMAIL_AUDIT_BATCHES_PER_RUN", "20"))   # 每次定时任务最多写入的批数
+
+
+def email_audit_form() -> YidaForm:
+    """邮件管理表单，配置从 .env 读取。"""
+    return YidaForm(
+        app_type=os.getenv("APP_TYPE"),
+        system_token=os.getenv("SYSTEM_TOKEN"),
+        user_id=os.getenv("USER_ID"),
+        form_uuid=os.getenv("FORM_UUID"),
+    )
+
+
+def enqueue_email_audit(form_data: dict, db: Optional[Session] = None):
+    """把一条发送记录写入 email_audit_outbox，提交后即持久化，之后由 flush_email_audit_outbox 批量写入宜搭。"""
+    own_session = db is None
+    db = db or database.SessionLocal()
+    try:
+        db.add(models.EmailAuditOutbox(form_data=form_data, status="pending"))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if own_session:
+            db.close()
+
+
+def claim_email_audit_batch(db: Session, batch_size: Optional[int] = None) -> list[models.EmailAuditOutbox]:
+    """
+    按写入顺序取一批 pending 记录并标记为 sending。行锁用 SKIP LOCKED，多个调度进程不会取到同一条。
+    写入途中进程被杀的记录会停在 sending：可能已经写入宜搭，不会被重新取出。
+    """
+    outbox = models.EmailAuditOutbox
+    rows = (
+        db.query(outbox)
+        .filter(outbox.status == "pending")
+        .order_by(outbox.id)
+        .limit(batch_size or YIDA_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    now = datetime.now()
+    for row in rows:
+        row.status = "sending"
+        row.claimed_at = now
+    db.commit()
+    return rows
+
+
+def flush_email_audit_outbox(form: Optional[YidaForm] = None, max_batches: Optional[int] = None) -> int:
+    """把 outbox 里待写入的记录按批写入宜搭，返回本次写入的条数。某一批确定失败时停下，等下一次定时任务再试。"""
+    form = form or email_audit_form()
+    written = 0
+    for _ in range(max_batches or EMAIL_AUDIT_BATCHES_PER_RUN):
+        db = database.SessionLocal()
+        try:
+            rows = claim_email_audit_batch(db)
+            if not rows:
+                break
+
+            outcome = form.batch_save([row.form_data for row in rows])
+            for row in rows:
+                row.attempts += 1
+                if outcome:
+                    row.status = "sent"
+                elif outcome is None:
+                    row.status = "unknown"
+                    row.error_message = "batchSave 结果不确定，可能已写入，需人工核对"
+                else:
+                    row.status = "pending" if row.attempts < YIDA_MAX_ATTEMPTS else "failed"
+                    row.error_message = "batchSave 写入失败"
+            db.commit()
+        finally:
+            db.close()
+
+        if not outcome:
+            logger.error("❌ 宜搭邮件记录写入%s，共 %s 条", "结果不确定" if outcome is None else "失败", len(rows))
+            break
+        written += len(rows)
+    return written